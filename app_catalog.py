@@ -0,0 +1,18 @@
+# Map of shortcut names to winget package IDs and friendly names
+APP_MAP = {
+    "vscode": {"winget_id": "Microsoft.VisualStudioCode", "shortcut_name": "Visual Studio Code"},
+    "chrome": {"winget_id": "Google.Chrome", "shortcut_name": "Google Chrome"},
+    "firefox": {"winget_id": "Mozilla.Firefox", "shortcut_name": "Mozilla Firefox"},
+    "notepad++": {"winget_id": "Notepad++.Notepad++", "shortcut_name": "Notepad++"},
+    "7zip": {"winget_id": "7zip.7zip", "shortcut_name": "7-Zip"},
+    "vlc": {"winget_id": "VideoLAN.VLC", "shortcut_name": "VLC Media Player"},
+    "git": {"winget_id": "Git.Git", "shortcut_name": "Git"},
+    "python": {"winget_id": "Python.Python.3.11", "shortcut_name": "Python 3.11"},
+    "nodejs": {"winget_id": "OpenJS.NodeJS", "shortcut_name": "Node.js"},
+    "steam": {"winget_id": "Valve.Steam", "shortcut_name": "Steam"},
+    "spotify": {"winget_id": "Spotify.Spotify", "shortcut_name": "Spotify"},
+    "discord": {"winget_id": "Discord.Discord", "shortcut_name": "Discord"},
+    "slack": {"winget_id": "SlackTechnologies.Slack", "shortcut_name": "Slack"},
+    "zoom": {"winget_id": "Zoom.Zoom", "shortcut_name": "Zoom"},
+    "obs": {"winget_id": "OBSProject.OBSStudio", "shortcut_name": "OBS Studio"}
+}
@@ -0,0 +1,120 @@
+"""Frame handling benchmark: capture through to the parser's input.
+
+Compares the old capture path (GetBitmapBits copy, Image.frombuffer, crop,
+convert and np.asarray in the parser) with the capture session path (BGRX
+view of a persistent buffer, one conversion to an RGB array the parser uses
+as is), including change detection. The file and synthetic backends run on
+any platform; --backend vmconnect captures the real VMConnect window (both
+paths then share the persistent GDI objects, so the legacy numbers leave out
+the old per-frame DC and bitmap setup).
+
+Usage:
+    python bench_capture.py [--backend synthetic|file|vmconnect] [--corpus screenshots/] [--frames 200]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from capture_backends import FileBackend, SyntheticBackend
+from frame_fingerprint import FrameChangeDetector
+from stage_timer import RollingStats, StageTimer
+
+
+def legacy_frame(view: np.ndarray, timer: StageTimer):
+    """What the old path did with each captured frame before parsing started"""
+    height, width = view.shape[:2]
+    with timer.stage('copy_out'):
+        # GetBitmapBits
+        data = view.tobytes()
+    with timer.stage('to_image'):
+        image = Image.frombuffer('RGB', (width, height), data, 'raw', 'BGRX', 0, 1)
+        image = image.crop((0, 0, width, height))
+    with timer.stage('parser_input'):
+        # Omniparser.parse_batch
+        image = image.convert('RGB')
+        return image, np.asarray(image)
+
+
+def session_frame(frame: np.ndarray, timer: StageTimer):
+    """What the session path does with each captured frame before parsing starts"""
+    with timer.stage('parser_input'):
+        # Omniparser.parse_batch keeps the array and only wraps it for the PIL-based stages
+        return Image.fromarray(frame), frame
+
+
+def run(backend, frames: int, legacy: bool) -> RollingStats:
+    stats = RollingStats(window=frames)
+    detector = FrameChangeDetector()
+    for _ in range(frames):
+        timer = StageTimer()
+        start = time.perf_counter()
+        if legacy:
+            with timer.stage('capture'):
+                view = backend.capture_view()
+            image, _ = legacy_frame(view, timer)
+            with timer.stage('change_detect'):
+                detector.is_unchanged(image)
+        else:
+            with timer.stage('capture'):
+                frame = backend.capture()
+            session_frame(frame, timer)
+            with timer.stage('change_detect'):
+                detector.is_unchanged(frame)
+        durations = timer.get_ms()
+        durations['total'] = (time.perf_counter() - start) * 1000
+        stats.add(durations)
+    return stats
+
+
+def create_backend(args):
+    if args.backend == 'file':
+        if not args.corpus:
+            raise SystemExit("--backend file needs --corpus")
+        return FileBackend(args.corpus, hold=args.hold)
+    if args.backend == 'vmconnect':
+        from vmconnect_capture import CaptureSession, find_vmconnect_window
+        hwnd = find_vmconnect_window()
+        if not hwnd:
+            raise SystemExit("No VMConnect window found")
+        return CaptureSession(hwnd)
+    return SyntheticBackend(args.width, args.height, change_every=args.hold)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--backend', choices=['synthetic', 'file', 'vmconnect'], default='synthetic')
+    arg_parser.add_argument('--corpus', help='Directory of screenshots for the file backend')
+    arg_parser.add_argument('--width', type=int, default=1920, help='Synthetic frame width')
+    arg_parser.add_argument('--height', type=int, default=1080, help='Synthetic frame height')
+    arg_parser.add_argument('--hold', type=int, default=1, help='Captures per distinct frame, to include unchanged frames')
+    arg_parser.add_argument('--frames', type=int, default=200, help='Frames per path')
+    arg_parser.add_argument('--json', help='Write the results to this file')
+    args = arg_parser.parse_args()
+
+    results = {}
+    with create_backend(args) as backend:
+        # One untimed capture so buffer creation isn't counted
+        backend.capture()
+        for name, legacy in (('legacy', True), ('session', False)):
+            stats = run(backend, args.frames, legacy)
+            results[name] = stats.get_stats()
+            print(f"\n{name} path, {args.frames} frames")
+            for line in stats.format_table():
+                print(f"  {line}")
+        print(f"\nbackend: {backend.get_stats()}")
+
+    legacy_p50 = results['legacy']['total']['p50']
+    session_p50 = results['session']['total']['p50']
+    print(f"p50 per frame: legacy {legacy_p50:.2f} ms, session {session_p50:.2f} ms ({legacy_p50 / session_p50:.1f}x)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
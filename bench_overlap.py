@@ -0,0 +1,193 @@
+"""Parity check and scaling benchmark for utils.remove_overlap / remove_overlap_new.
+
+Compares the vectorized implementations in utils against the original
+pure-Python loops kept below as the reference, then times both as the number
+of boxes grows.
+
+Usage:
+    python bench_overlap.py [--sizes 50 200 1000 4000] [--trials 20]
+"""
+import argparse
+import copy
+import random
+import time
+from typing import List
+
+import torch
+
+from utils import remove_overlap, remove_overlap_new
+
+
+def _box_area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _intersection_area(box1, box2):
+    x1 = max(box1[0], box2[0])
+    y1 = max(box1[1], box2[1])
+    x2 = min(box1[2], box2[2])
+    y2 = min(box1[3], box2[3])
+    return max(0, x2 - x1) * max(0, y2 - y1)
+
+
+def _IoU(box1, box2):
+    intersection = _intersection_area(box1, box2)
+    union = _box_area(box1) + _box_area(box2) - intersection + 1e-6
+    if _box_area(box1) > 0 and _box_area(box2) > 0:
+        ratio1 = intersection / _box_area(box1)
+        ratio2 = intersection / _box_area(box2)
+    else:
+        ratio1, ratio2 = 0, 0
+    return max(intersection / union, ratio1, ratio2)
+
+
+def _is_inside(box1, box2, threshold):
+    return _intersection_area(box1, box2) / _box_area(box1) > threshold
+
+
+def reference_remove_overlap(boxes, iou_threshold, ocr_bbox=None):
+    """The original O(N^2) loop version of utils.remove_overlap"""
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+    boxes = boxes.tolist()
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    for i, box1 in enumerate(boxes):
+        is_valid_box = True
+        for j, box2 in enumerate(boxes):
+            if i != j and _IoU(box1, box2) > iou_threshold and _box_area(box1) > _box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            if ocr_bbox:
+                if not any(_IoU(box1, box3) > iou_threshold and not _is_inside(box1, box3, 0.95) for box3 in ocr_bbox):
+                    filtered_boxes.append(box1)
+            else:
+                filtered_boxes.append(box1)
+    return torch.tensor(filtered_boxes)
+
+
+def reference_remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
+    """The original O(N^2) loop version of utils.remove_overlap_new"""
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+    filtered_boxes = []
+    if ocr_bbox:
+        filtered_boxes.extend(ocr_bbox)
+    for i, box1_elem in enumerate(boxes):
+        box1 = box1_elem['bbox']
+        is_valid_box = True
+        for j, box2_elem in enumerate(boxes):
+            box2 = box2_elem['bbox']
+            if i != j and _IoU(box1, box2) > iou_threshold and _box_area(box1) > _box_area(box2):
+                is_valid_box = False
+                break
+        if is_valid_box:
+            if ocr_bbox:
+                box_added = False
+                ocr_labels = ''
+                for box3_elem in ocr_bbox:
+                    if not box_added:
+                        box3 = box3_elem['bbox']
+                        if _is_inside(box3, box1, 0.80):
+                            try:
+                                ocr_labels += box3_elem['content'] + ' '
+                                filtered_boxes.remove(box3_elem)
+                            except:
+                                continue
+                        elif _is_inside(box1, box3, 0.80):
+                            box_added = True
+                            break
+                if not box_added:
+                    if ocr_labels:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+                    else:
+                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+            else:
+                filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+    return filtered_boxes
+
+
+def random_screen_boxes(rng: random.Random, num_icons: int, num_ocr: int):
+    """Generate icon and OCR boxes in ratio coordinates that look like a busy desktop.
+
+    Some icons are near-duplicates or nested, some OCR boxes sit inside icons and
+    some icons sit inside OCR boxes, so every suppression rule gets exercised.
+    """
+    def random_box(max_size=0.08):
+        w, h = rng.uniform(0.005, max_size), rng.uniform(0.005, max_size / 2)
+        x, y = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+        return [x, y, x + w, y + h]
+
+    def shrink(box, amount):
+        dx, dy = (box[2] - box[0]) * amount, (box[3] - box[1]) * amount
+        return [box[0] + dx, box[1] + dy, box[2] - dx, box[3] - dy]
+
+    icons = []
+    for _ in range(num_icons):
+        roll = rng.random()
+        if icons and roll < 0.2:
+            icons.append(shrink(rng.choice(icons), rng.uniform(-0.05, 0.2)))
+        else:
+            icons.append(random_box())
+    ocr = []
+    for n in range(num_ocr):
+        roll = rng.random()
+        if icons and roll < 0.3:
+            box = shrink(rng.choice(icons), rng.uniform(0.0, 0.3))
+        elif icons and roll < 0.4:
+            box = shrink(rng.choice(icons), -rng.uniform(0.1, 0.5))
+        else:
+            box = random_box(0.15)
+        ocr.append(box)
+    return icons, ocr
+
+
+def check_parity(trials: int, seed: int = 0):
+    """Compare both vectorized implementations against the references on random screens"""
+    rng = random.Random(seed)
+    for trial in range(trials):
+        num_icons, num_ocr = rng.randint(0, 300), rng.randint(0, 100)
+        icons, ocr = random_screen_boxes(rng, num_icons, num_ocr)
+        iou_threshold = rng.choice([0.1, 0.3, 0.7, 0.9])
+
+        icon_elems = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in icons]
+        ocr_elems = [{'type': 'text', 'bbox': box, 'interactivity': False, 'content': f'text {i}', 'source': 'box_ocr_content_ocr'} for i, box in enumerate(ocr)]
+        expected = reference_remove_overlap_new(copy.deepcopy(icon_elems), iou_threshold, copy.deepcopy(ocr_elems))
+        actual = remove_overlap_new(copy.deepcopy(icon_elems), iou_threshold, copy.deepcopy(ocr_elems))
+        assert actual == expected, f"remove_overlap_new mismatch in trial {trial}"
+
+        icon_tensor = torch.tensor(icons, dtype=torch.float32).reshape(-1, 4)
+        expected = reference_remove_overlap(icon_tensor, iou_threshold, ocr or None)
+        actual = remove_overlap(icon_tensor, iou_threshold, ocr or None)
+        assert torch.equal(actual, expected), f"remove_overlap mismatch in trial {trial}"
+    print(f"Parity OK over {trials} random screens")
+
+
+def benchmark(sizes, repeats: int = 3, seed: int = 1):
+    """Time reference vs vectorized remove_overlap_new for growing numbers of boxes"""
+    rng = random.Random(seed)
+    print(f"{'icons':>8} {'ocr':>6} {'reference ms':>14} {'vectorized ms':>14} {'speedup':>8}")
+    for size in sizes:
+        icons, ocr = random_screen_boxes(rng, size, size // 4)
+        icon_elems = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in icons]
+        ocr_elems = [{'type': 'text', 'bbox': box, 'interactivity': False, 'content': f'text {i}', 'source': 'box_ocr_content_ocr'} for i, box in enumerate(ocr)]
+
+        timings = {}
+        for name, fn in (('reference', reference_remove_overlap_new), ('vectorized', remove_overlap_new)):
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn(icon_elems, 0.7, list(ocr_elems))
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best * 1000
+        print(f"{size:>8} {len(ocr):>6} {timings['reference']:>14.1f} {timings['vectorized']:>14.1f} {timings['reference'] / timings['vectorized']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000, 2000, 4000])
+    arg_parser.add_argument('--trials', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    check_parity(args.trials)
+    benchmark(args.sizes)
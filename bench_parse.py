@@ -0,0 +1,248 @@
+"""Offline parse benchmark over a directory of saved screenshots.
+
+Feeds every screenshot in a corpus through Omniparser.parse and through the
+lower level check_ocr_box + get_som_labeled_img path, and reports latency
+percentiles, throughput, peak RSS and a per-stage breakdown. No VM or Tk
+windows are involved, so it runs on a CPU-only Linux machine and can gate
+changes to utils.py and box_annotator.py.
+
+Usage:
+    python bench_parse.py --corpus screenshots/ --json results.json
+    python bench_parse.py --corpus screenshots/ --compare baseline.json [--threshold 0.1]
+
+Without --corpus a few synthetic screens are used. With --compare the exit
+code is 1 when any latency got worse than the baseline by more than the
+threshold, so the script can be used as a CI gate.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Stages faster than this in the baseline are too noisy to flag
+MIN_COMPARED_MS = 1.0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KB on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().peak_wset / (1024 * 1024)
+
+
+def load_corpus(corpus: str, limit: int = None) -> List[Tuple[str, 'Image.Image']]:
+    """Load every screenshot in a directory, sorted by file name"""
+    from PIL import Image
+    names = sorted(name for name in os.listdir(corpus) if name.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    if not names:
+        raise SystemExit(f"No screenshots found in {corpus}")
+    return [(name, Image.open(os.path.join(corpus, name)).convert('RGB')) for name in names]
+
+
+def synthetic_corpus(count: int) -> List[Tuple[str, 'Image.Image']]:
+    """Synthetic screens at a few common resolutions"""
+    from utils import make_synthetic_screen
+    sizes = [(1920, 1080), (2560, 1440), (1280, 800)]
+    return [(f"synthetic_{w}x{h}", make_synthetic_screen(w, h)) for w, h in (sizes[i % len(sizes)] for i in range(count))]
+
+
+def summarize(latencies_ms: List[float]) -> Dict[str, float]:
+    """Count, mean and percentiles of a list of latencies"""
+    import numpy as np
+    values = np.array(latencies_ms)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean': float(values.mean()), 'min': float(values.min()), 'max': float(values.max()),
+            'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+def run_parse(parser, corpus, repeat: int, incremental: bool) -> Dict:
+    """Time Omniparser.parse on every screenshot"""
+    from stage_timer import RollingStats
+    stages = RollingStats(window=len(corpus) * repeat)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, image in corpus:
+            if not incremental:
+                parser.reset_incremental_state()
+            frame_start = time.perf_counter()
+            parser.parse(image)
+            latencies.append((time.perf_counter() - frame_start) * 1000)
+            stages.add({stage: ms for stage, ms in parser.last_timings.items() if stage != 'total'})
+    elapsed = time.perf_counter() - start
+    return {'latency_ms': summarize(latencies), 'throughput_fps': len(latencies) / elapsed, 'stages': stages.get_stats()}
+
+
+def run_som(parser, corpus, repeat: int, lazy: bool = False) -> Dict:
+    """Time check_ocr_box + get_som_labeled_img on every screenshot; with lazy the labels are never drawn"""
+    from stage_timer import RollingStats, StageTimer
+    from utils import check_ocr_box, get_som_labeled_img
+    stages = RollingStats(window=len(corpus) * repeat)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, image in corpus:
+            timer = StageTimer()
+            frame_start = time.perf_counter()
+            with timer.stage('ocr'):
+                (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=parser.use_paddleocr, ocr_cache=parser.ocr_cache)
+            get_som_labeled_img(image, parser.som_model, BOX_TRESHOLD=parser.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox, draw_bbox_config=parser._get_draw_bbox_config(image), caption_model_processor=parser.caption_model_processor, ocr_text=text, use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128, caption_cache=parser.caption_cache, timer=timer, lazy=lazy)
+            latencies.append((time.perf_counter() - frame_start) * 1000)
+            stages.add(timer.get_ms())
+    elapsed = time.perf_counter() - start
+    return {'latency_ms': summarize(latencies), 'throughput_fps': len(latencies) / elapsed, 'stages': stages.get_stats()}
+
+
+def get_environment() -> Dict:
+    """Describe the machine and code the results were measured on"""
+    import torch
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def print_report(results: Dict):
+    for path, result in results['paths'].items():
+        latency = result['latency_ms']
+        print(f"\n{path}: {latency['count']} frames, {result['throughput_fps']:.2f} frames/s")
+        print(f"  latency ms  p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  mean {latency['mean']:.1f}")
+        width = max([len('stage')] + [len(stage) for stage in result['stages']])
+        print(f"  {'stage':<{width}} {'p50 ms':>9} {'p95 ms':>9} {'share':>7}")
+        total = sum(stage['mean'] for stage in result['stages'].values()) or 1.0
+        for name, stage in result['stages'].items():
+            print(f"  {name:<{width}} {stage['p50']:>9.1f} {stage['p95']:>9.1f} {stage['mean'] / total:>6.0%}")
+    print(f"\npeak RSS: {results['peak_rss_mb']:.0f} MB")
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Compare results against a baseline run.
+
+    Returns:
+        list: Descriptions of every latency or throughput that regressed by more than threshold
+    """
+    regressions = []
+
+    def check(label, current, previous, higher_is_worse=True):
+        if previous is None or current is None:
+            return
+        change = (current - previous) / previous if previous else 0.0
+        worse_by = change if higher_is_worse else -change
+        marker = 'REGRESSION' if worse_by > threshold else ''
+        print(f"  {label:<28} {previous:>10.1f} {current:>10.1f} {change:>+8.1%} {marker}")
+        if marker:
+            regressions.append(f"{label}: {previous:.1f} -> {current:.1f} ({change:+.1%})")
+
+    for path, result in results['paths'].items():
+        previous = baseline.get('paths', {}).get(path)
+        if previous is None:
+            print(f"\n{path}: not in baseline")
+            continue
+        print(f"\n{path} vs baseline ({baseline.get('environment', {}).get('commit')})")
+        print(f"  {'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+        for percentile in ('p50', 'p95'):
+            check(f"{path} latency {percentile}", result['latency_ms'][percentile], previous['latency_ms'][percentile])
+        check(f"{path} throughput fps", result['throughput_fps'], previous['throughput_fps'], higher_is_worse=False)
+        for name, stage in result['stages'].items():
+            previous_stage = previous['stages'].get(name)
+            if previous_stage and previous_stage['p50'] >= MIN_COMPARED_MS:
+                check(f"{path} {name} p50", stage['p50'], previous_stage['p50'])
+
+    previous_rss = baseline.get('peak_rss_mb')
+    if previous_rss:
+        print()
+        check("peak RSS MB", results['peak_rss_mb'], previous_rss)
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--corpus', help='Directory of screenshots; synthetic screens are used if omitted')
+    arg_parser.add_argument('--limit', type=int, help='Use at most this many screenshots')
+    arg_parser.add_argument('--synthetic', type=int, default=3, help='Number of synthetic screens without --corpus')
+    arg_parser.add_argument('--paths', nargs='+', choices=['parse', 'som'], default=['parse', 'som'], help='Code paths to benchmark')
+    arg_parser.add_argument('--repeat', type=int, default=1, help='Passes over the corpus')
+    arg_parser.add_argument('--warmup', type=int, default=1, help='Untimed parses before measuring')
+    arg_parser.add_argument('--incremental', action='store_true', help='Parse the corpus as consecutive frames with incremental parsing')
+    arg_parser.add_argument('--lazy-annotate', action='store_true', help='Only ask get_som_labeled_img for the elements, so the labels are never drawn')
+    arg_parser.add_argument('--caches', action='store_true', help='Keep the caption and OCR caches enabled (repeat passes then mostly hit them)')
+    arg_parser.add_argument('--cpu', action='store_true', help='Hide any GPU so the run matches a CPU-only machine')
+    arg_parser.add_argument('--threads', type=int, help='Torch intra-op threads')
+    arg_parser.add_argument('--som-model-path', default='weights/icon_detect/model.pt')
+    arg_parser.add_argument('--caption-model-path', default='weights/icon_caption_florence')
+    arg_parser.add_argument('--json', help='Write the results to this file')
+    arg_parser.add_argument('--compare', help='Baseline results file to compare against')
+    arg_parser.add_argument('--threshold', type=float, default=0.10, help='Relative slowdown that counts as a regression')
+    args = arg_parser.parse_args()
+
+    if args.cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    from omniparser import Omniparser
+
+    corpus = load_corpus(args.corpus, args.limit) if args.corpus else synthetic_corpus(args.synthetic)
+    config = {
+        'som_model_path': args.som_model_path,
+        'caption_model_name': 'florence2',
+        'caption_model_path': args.caption_model_path,
+        'BOX_TRESHOLD': 0.05,
+        'incremental': args.incremental,
+    }
+    if not args.caches:
+        # A zero budget makes every lookup a miss and stores nothing
+        config['caption_cache_bytes'] = 0
+        config['ocr_cache_bytes'] = 0
+    parser = Omniparser(config)
+
+    for _ in range(args.warmup):
+        parser.parse(corpus[0][1])
+    parser.reset_incremental_state()
+
+    results = {'environment': get_environment(), 'corpus': [name for name, _ in corpus], 'paths': {}}
+    if 'parse' in args.paths:
+        results['paths']['parse'] = run_parse(parser, corpus, args.repeat, args.incremental)
+    if 'som' in args.paths:
+        results['paths']['som'] = run_som(parser, corpus, args.repeat, args.lazy_annotate)
+    results['peak_rss_mb'] = peak_rss_mb()
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Startup-time benchmark: how long until the first frame is parsed.
+
+Measures importing the parser, constructing Omniparser and the first (cold)
+and second (warm) parse of a frame, with the process RSS after each step.
+Run it from a fresh interpreter so the import timings are meaningful.
+
+Usage:
+    python bench_startup.py [--image screenshot.png] [--json results.json]
+"""
+import time
+
+_process_start = time.perf_counter()
+
+import argparse
+import json
+import os
+import sys
+
+
+def get_rss_mb() -> float:
+    """Current resident set size of this process in MB"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        import resource
+        # ru_maxrss is the peak, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--image', help='Screenshot to parse; a synthetic frame is used if omitted')
+    arg_parser.add_argument('--som-model-path', default='weights/icon_detect/model.pt')
+    arg_parser.add_argument('--caption-model-path', default='weights/icon_caption_florence')
+    arg_parser.add_argument('--warmup', action='store_true', help='Run the warm-up parse during construction')
+    arg_parser.add_argument('--json', help='Write the results to this file')
+    args = arg_parser.parse_args()
+
+    steps = []
+
+    def record(name, start):
+        steps.append({'step': name, 'ms': (time.perf_counter() - start) * 1000, 'rss_mb': get_rss_mb()})
+
+    start = time.perf_counter()
+    from omniparser import Omniparser
+    from utils import make_synthetic_screen
+    record('import omniparser', start)
+
+    config = {
+        'som_model_path': args.som_model_path,
+        'caption_model_name': 'florence2',
+        'caption_model_path': args.caption_model_path,
+        'BOX_TRESHOLD': 0.05,
+        'warmup': args.warmup,
+    }
+    start = time.perf_counter()
+    parser = Omniparser(config)
+    record('construct Omniparser', start)
+
+    if args.image:
+        from PIL import Image
+        image = Image.open(args.image).convert('RGB')
+    else:
+        image = make_synthetic_screen(2880, 1620)
+
+    start = time.perf_counter()
+    parser.parse(image)
+    record('first parse', start)
+    time_to_first_frame_ms = (time.perf_counter() - _process_start) * 1000
+
+    start = time.perf_counter()
+    parser.parse(image)
+    record('second parse', start)
+
+    print(f"{'step':<24} {'ms':>10} {'rss MB':>10}")
+    for step in steps:
+        print(f"{step['step']:<24} {step['ms']:>10.0f} {step['rss_mb']:>10.0f}")
+    print(f"{'time to first frame':<24} {time_to_first_frame_ms:>10.0f}")
+    print('model load timings: ' + ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in parser.load_timings.items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'steps': steps, 'time_to_first_frame_ms': time_to_first_frame_ms, 'load_timings': parser.load_timings, 'python': sys.version}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -85,6 +85,7 @@ class BoxAnnotator:
             ```
         """
         font = cv2.FONT_HERSHEY_SIMPLEX
+        placer = LabelPlacer(detections.xyxy.astype(int), image_size) if self.avoid_overlap and not skip_label else None
         for i in range(len(detections)):
             x1, y1, x2, y2 = detections.xyxy[i].astype(int)
             class_id = (
@@ -135,7 +136,9 @@ class BoxAnnotator:
                 # text_background_x2 = x1
                 # text_background_y2 = y1 + 2 * self.text_padding + text_height
             else:
-                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size)
+                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, placer=placer)
+                # later labels also avoid this one
+                placer.add_box([text_background_x1, text_background_y1, text_background_x2, text_background_y2])
 
             cv2.rectangle(
                 img=scene,
@@ -186,23 +189,96 @@ def IoU(box1, box2, return_max=True):
         return intersection / union
 
 
-def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size):
+class LabelPlacer:
+    """Overlap tests for label placement against detections and already placed labels.
+
+    Boxes are bucketed into a uniform grid, so each candidate label position is
+    only compared (in one vectorized IoU call) with the boxes in the grid cells
+    it covers. Placing every label on a dense screen is then roughly linear in
+    the number of detections instead of quadratic.
+    """
+
+    def __init__(self, boxes: np.ndarray, image_size: Tuple[int, int], cell_size: int = 128):
+        """
+        Args:
+            boxes (np.ndarray): (N, 4) integer xyxy detection boxes
+            image_size (Tuple[int, int]): (width, height) of the image
+            cell_size (int): Grid cell size in pixels
+        """
+        self.image_size = image_size
+        self.cell_size = cell_size
+        self._boxes = []
+        self._box_array = np.zeros((0, 4), dtype=np.int64)
+        self._grid = {}
+        for box in boxes:
+            self.add_box(box)
+
+    def _cells(self, box):
+        cx1, cy1 = int(box[0]) // self.cell_size, int(box[1]) // self.cell_size
+        cx2, cy2 = int(box[2]) // self.cell_size, int(box[3]) // self.cell_size
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                yield cx, cy
+
+    def add_box(self, box):
+        """Add an obstacle that later label positions must avoid"""
+        index = len(self._boxes)
+        self._boxes.append([int(v) for v in box])
+        for cell in self._cells(box):
+            self._grid.setdefault(cell, []).append(index)
+
+    def is_overlap(self, box, threshold: float = 0.3) -> bool:
+        """Check a candidate label box against nearby obstacles and the image bounds
+
+        Args:
+            box: Candidate label background in xyxy pixels
+            threshold (float): IoU above which the candidate counts as overlapping
+
+        Returns:
+            bool: True if the candidate overlaps an obstacle or leaves the image
+        """
+        # check if the text is out of the image
+        if box[0] < 0 or box[2] > self.image_size[0] or box[1] < 0 or box[3] > self.image_size[1]:
+            return True
+
+        nearby = set()
+        for cell in self._cells(box):
+            nearby.update(self._grid.get(cell, ()))
+        if not nearby:
+            return False
+        if len(self._box_array) != len(self._boxes):
+            self._box_array = np.array(self._boxes, dtype=np.int64)
+        return bool((IoU_many(box, self._box_array[sorted(nearby)]) > threshold).any())
+
+
+def IoU_many(box, boxes: np.ndarray) -> np.ndarray:
+    """IoU(box, b) for every row b of boxes, vectorized"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    area1 = box_area(box)
+    area2 = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area1 + area2 - intersection
+    both_positive = (area1 > 0) & (area2 > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio1 = np.where(both_positive, intersection / area1, 0)
+        ratio2 = np.where(both_positive, intersection / area2, 0)
+        return np.maximum(intersection / union, np.maximum(ratio1, ratio2))
+
+
+def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, placer=None):
     """ check overlap of text and background detection box, and get_optimal_label_pos, 
         pos: str, position of the text, must be one of 'top left', 'top right', 'outer left', 'outer right' TODO: if all are overlapping, return the last one, i.e. outer right
         Threshold: default to 0.3
+        placer: optional LabelPlacer holding the detections (and already placed labels); built from detections if not given
     """
+    if placer is None:
+        placer = LabelPlacer(detections.xyxy.astype(int), image_size)
 
-    def get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size):
-        is_overlap = False
-        for i in range(len(detections)):
-            detection = detections.xyxy[i].astype(int)
-            if IoU([text_background_x1, text_background_y1, text_background_x2, text_background_y2], detection) > 0.3:
-                is_overlap = True
-                break
-        # check if the text is out of the image
-        if text_background_x1 < 0 or text_background_x2 > image_size[0] or text_background_y1 < 0 or text_background_y2 > image_size[1]:
-            is_overlap = True
-        return is_overlap
+    def get_is_overlap(text_background_x1, text_background_y1, text_background_x2, text_background_y2):
+        return placer.is_overlap([text_background_x1, text_background_y1, text_background_x2, text_background_y2])
     
     # if pos == 'top left':
     text_x = x1 + text_padding
@@ -213,7 +289,7 @@ def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2,
 
     text_background_x2 = x1 + 2 * text_padding + text_width
     text_background_y2 = y1
-    is_overlap = get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size)
+    is_overlap = get_is_overlap(text_background_x1, text_background_y1, text_background_x2, text_background_y2)
     if not is_overlap:
         return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
     
@@ -226,7 +302,7 @@ def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2,
 
     text_background_x2 = x1
     text_background_y2 = y1 + 2 * text_padding + text_height
-    is_overlap = get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size)
+    is_overlap = get_is_overlap(text_background_x1, text_background_y1, text_background_x2, text_background_y2)
     if not is_overlap:
         return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
     
@@ -241,7 +317,7 @@ def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2,
     text_background_x2 = x2 + 2 * text_padding + text_width
     text_background_y2 = y1 + 2 * text_padding + text_height
 
-    is_overlap = get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size)
+    is_overlap = get_is_overlap(text_background_x1, text_background_y1, text_background_x2, text_background_y2)
     if not is_overlap:
         return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
 
@@ -255,7 +331,7 @@ def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2,
     text_background_x2 = x2
     text_background_y2 = y1
 
-    is_overlap = get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size)
+    is_overlap = get_is_overlap(text_background_x1, text_background_y1, text_background_x2, text_background_y2)
     if not is_overlap:
         return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
 
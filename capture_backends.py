@@ -0,0 +1,134 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+class CaptureBackend(ABC):
+    """A source of screen frames.
+
+    Backends render each frame into a buffer they own, in the 32-bit BGRX
+    layout of a Windows DIB section, and expose it through capture_view().
+    capture() converts the view into an RGB array in a single pass; that array
+    belongs to the caller and can go straight to Omniparser.parse. The VMConnect
+    window capture is vmconnect_capture.CaptureSession; the file and synthetic
+    backends here produce frames the same way on any platform, so the frame
+    handling path can be benchmarked without a VM.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.failures = 0
+
+    @abstractmethod
+    def capture_view(self) -> Optional[np.ndarray]:
+        """Capture a frame into the backend's buffer.
+
+        Returns:
+            np.ndarray: (height, width, 4) BGRX view of the frame, or None if capture failed.
+                The view is only valid until the next capture.
+        """
+
+    def capture(self) -> Optional[np.ndarray]:
+        """Capture a frame as a new (height, width, 3) RGB array, or None if capture failed"""
+        view = self.capture_view()
+        if view is None:
+            self.failures += 1
+            return None
+        self.frames += 1
+        return cv2.cvtColor(view, cv2.COLOR_BGRA2RGB)
+
+    def close(self):
+        """Release the backend's resources"""
+        pass
+
+    def get_stats(self) -> Dict:
+        """Get frame and failure counters"""
+        return {'frames': self.frames, 'failures': self.failures}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _to_bgrx(image: Image.Image) -> np.ndarray:
+    return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGRA)
+
+
+class FileBackend(CaptureBackend):
+    """Replays screenshots from disk, in file name order, as if they were captured"""
+
+    def __init__(self, source: Union[str, List[str]], hold: int = 1, loop: bool = True):
+        """Load the screenshots
+
+        Args:
+            source: Directory of screenshots, or a list of image paths
+            hold (int): Number of consecutive captures that return each screenshot, so
+                unchanged frames can be simulated
+            loop (bool): Start again from the first screenshot after the last one; if
+                False, capture returns None once every screenshot has been returned
+        """
+        super().__init__()
+        if isinstance(source, str):
+            source = [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+        if not source:
+            raise ValueError("No screenshots to capture from")
+        self.paths = list(source)
+        self.hold = max(1, hold)
+        self.loop = loop
+        # Decoded up front so captures only cost what a real capture costs
+        self._frames = [_to_bgrx(Image.open(path)) for path in self.paths]
+        self._buffer = None
+        self._index = 0
+
+    def capture_view(self) -> Optional[np.ndarray]:
+        position = self._index // self.hold
+        if position >= len(self._frames):
+            if not self.loop:
+                return None
+            self._index = position = 0
+        self._index += 1
+        frame = self._frames[position]
+        if self._buffer is None or self._buffer.shape != frame.shape:
+            self._buffer = np.empty_like(frame)
+        # A real capture writes into the same buffer every frame
+        self._buffer[...] = frame
+        return self._buffer
+
+
+class SyntheticBackend(CaptureBackend):
+    """Synthetic desktop frames with a small region that changes periodically"""
+
+    def __init__(self, width: int = 1920, height: int = 1080, change_every: int = 1):
+        """Build the base frame
+
+        Args:
+            width, height (int): Frame size in pixels
+            change_every (int): Number of captures between changes; the frames in between
+                are identical, like an idle screen
+        """
+        super().__init__()
+        from utils import make_synthetic_screen
+        self.width = width
+        self.height = height
+        self.change_every = max(1, change_every)
+        self._base = _to_bgrx(make_synthetic_screen(width, height))
+        self._buffer = self._base.copy()
+        self._count = 0
+
+    def capture_view(self) -> Optional[np.ndarray]:
+        changes = self._count // self.change_every
+        self._count += 1
+        self._buffer[...] = self._base
+        # A block moving across the top of the screen, like a progress indicator
+        size = max(8, self.height // 40)
+        x = (changes * size) % max(1, self.width - size)
+        self._buffer[size:2 * size, x:x + size] = (0, 120, 255, 255)
+        return self._buffer
@@ -1,6 +1,9 @@
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import ttk, scrolledtext
-from typing import Callable
+from typing import Callable, Optional
 
 class ConsoleWindow:
     def __init__(self, window_title="Console Window", window_size=(600, 400)):
@@ -91,6 +94,84 @@ class ConsoleWindow:
         """Close the window"""
         self.root.destroy()
 
+class StreamConsole:
+    """Console for headless runs: commands come from a file or stdin, output goes to stdout.
+
+    Commands are read on a background thread and handed to the command handler
+    from update(), so they run on the main loop thread just like commands typed
+    into ConsoleWindow. A command is only started once the previous one has
+    returned, even though handlers call update() again while they run.
+    """
+    def __init__(self, source: Optional[str] = None, output=None):
+        """Initialize the console
+
+        Args:
+            source (str): File with one command per line ('#' starts a comment); stdin if None or '-'
+            output: Stream to write output to, defaults to stdout
+        """
+        self.output = output or sys.stdout
+        self.command_callback = None
+        # True once every command has been read and run
+        self.finished = False
+        self._commands = queue.Queue()
+        self._reader_done = False
+        self._running_command = False
+        self._stream = sys.stdin if source in (None, '-') else open(source, 'r', encoding='utf-8')
+        self._reader = threading.Thread(target=self._read_commands, daemon=True)
+        self._reader.start()
+
+    def _read_commands(self):
+        for line in self._stream:
+            command = line.strip()
+            if command and not command.startswith('#'):
+                self._commands.put(command)
+        self._reader_done = True
+
+    def set_command_handler(self, callback: Callable[[str], None]):
+        """Set the callback function for command execution
+
+        Args:
+            callback: Function that takes command string as argument
+        """
+        self.command_callback = callback
+
+    def write_line(self, text: str, system: bool = False):
+        """Write a line to the output stream
+
+        Args:
+            text: Text to write
+            system: If True, format as system output
+        """
+        self.output.write(('  ' if system else '') + text + '\n')
+        self.output.flush()
+
+    def clear(self):
+        """Nothing to clear on a stream"""
+        pass
+
+    def update(self):
+        """Run the next pending command, if any - call this in your main loop"""
+        if self._running_command:
+            return
+        try:
+            command = self._commands.get_nowait()
+        except queue.Empty:
+            self.finished = self._reader_done
+            return
+
+        self.write_line(f"> {command}")
+        if self.command_callback:
+            self._running_command = True
+            try:
+                self.command_callback(command)
+            finally:
+                self._running_command = False
+
+    def close(self):
+        """Close the command file"""
+        if self._stream is not sys.stdin:
+            self._stream.close()
+
 if __name__ == "__main__":
     # Example usage
     console = ConsoleWindow(window_title="Command Console")
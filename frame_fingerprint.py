@@ -0,0 +1,101 @@
+import hashlib
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def _as_rgb_array(image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    return image if isinstance(image, np.ndarray) else np.asarray(image.convert("RGB"))
+
+
+class FrameChangeDetector:
+    """Cheaply decides whether a frame is unchanged since the last parsed frame.
+
+    Each frame is downsampled to a small thumbnail and hashed. When the hash
+    matches the reference frame, an exact pixel diff confirms the match (a
+    small change can average out in the thumbnail). With a non-zero tolerance
+    the exact diff also decides frames whose thumbnails differ slightly.
+    """
+
+    def __init__(self, tolerance: float = 0.0, pixel_threshold: int = 0, thumb_size: Tuple[int, int] = (64, 36)):
+        """Initialize the detector
+
+        Args:
+            tolerance (float): Fraction of pixels (0-1) allowed to differ while still
+                treating the frame as unchanged. 0 means pixel-identical only.
+            pixel_threshold (int): Per-channel difference a pixel may have before it
+                counts as changed
+            thumb_size (tuple): Size of the thumbnail used for the fingerprint
+        """
+        self.tolerance = tolerance
+        self.pixel_threshold = pixel_threshold
+        self.thumb_size = thumb_size
+        self.hits = 0
+        self.misses = 0
+        self.exact_checks = 0
+        self._reference_digest = None
+        self._reference_array = None
+
+    def fingerprint(self, image: Union[Image.Image, np.ndarray]) -> str:
+        """Hash of a downsampled copy of the image"""
+        if isinstance(image, np.ndarray):
+            thumb = cv2.resize(image, self.thumb_size, interpolation=cv2.INTER_AREA)
+        else:
+            thumb = image.convert("RGB").resize(self.thumb_size, Image.Resampling.BOX)
+        return hashlib.blake2b(thumb.tobytes(), digest_size=16).hexdigest()
+
+    def is_unchanged(self, image: Union[Image.Image, np.ndarray]) -> bool:
+        """Check a frame against the reference frame and update the counters.
+
+        A changed frame becomes the new reference, so drift is always measured
+        against the last frame that was actually parsed.
+
+        Args:
+            image: The newly captured frame, as a PIL Image or an RGB array
+
+        Returns:
+            bool: True if the frame is unchanged within the configured tolerance
+        """
+        digest = self.fingerprint(image)
+        unchanged = False
+        if self._reference_array is not None and (digest == self._reference_digest or self.tolerance > 0):
+            frame_array = _as_rgb_array(image)
+            unchanged = self._within_tolerance(frame_array)
+        else:
+            frame_array = None
+
+        if unchanged:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        self._reference_digest = digest
+        self._reference_array = frame_array if frame_array is not None else _as_rgb_array(image)
+        return False
+
+    def _within_tolerance(self, frame_array: np.ndarray) -> bool:
+        self.exact_checks += 1
+        if frame_array.shape != self._reference_array.shape:
+            return False
+        if self.tolerance <= 0 and self.pixel_threshold <= 0:
+            return np.array_equal(frame_array, self._reference_array)
+        diff = np.abs(frame_array.astype(np.int16) - self._reference_array.astype(np.int16))
+        changed = (diff > self.pixel_threshold).any(axis=-1)
+        return changed.mean() <= self.tolerance
+
+    def reset(self):
+        """Forget the reference frame so the next frame is always treated as changed"""
+        self._reference_digest = None
+        self._reference_array = None
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "exact_checks": self.exact_checks,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
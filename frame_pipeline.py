@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFrameQueue:
+    """A small bounded queue that only keeps the newest items.
+
+    Putting into a full queue drops the oldest item instead of blocking, so a
+    slow consumer always sees the most recent frame rather than a backlog.
+    """
+
+    def __init__(self, maxsize: int = 1):
+        """Initialize the queue
+
+        Args:
+            maxsize (int): Maximum number of items held before the oldest is dropped
+        """
+        self.maxsize = max(1, maxsize)
+        self._items = deque()
+        self._cond = threading.Condition()
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        """Add an item, dropping the oldest one if the queue is full"""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """Remove and return the oldest item, waiting up to timeout seconds.
+
+        Returns:
+            The item, or None if nothing arrived before the timeout
+        """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def get_nowait(self):
+        """Remove and return the oldest item, or None if the queue is empty"""
+        return self.get(timeout=0)
+
+    def depth(self) -> int:
+        """Number of items currently waiting in the queue"""
+        with self._cond:
+            return len(self._items)
+
+    def wake(self):
+        """Wake up any consumer blocked in get()"""
+        with self._cond:
+            self._cond.notify_all()
+
+
+class FramePipeline:
+    """Runs screenshot capture and parsing as separate background stages.
+
+    Capture and parse each run on their own thread and hand frames to the next
+    stage through LatestFrameQueue instances. The display stage stays with the
+    caller (Tk must be driven from the main thread) and pulls parse results
+    with get_result().
+    """
+
+    def __init__(self, capture_fn: Callable, parse_fn: Callable, queue_size: int = 1, capture_interval: float = 0.05, change_detector=None, stage_timings_fn: Optional[Callable] = None):
+        """Initialize the pipeline
+
+        Args:
+            capture_fn: Callable returning a new frame, as a PIL Image or an RGB array
+                (see CaptureBackend.capture), or None if capture failed
+            parse_fn: Callable taking a frame and returning (labeled_img, parsed_content)
+            queue_size (int): Number of frames each queue holds before dropping the oldest
+            capture_interval (float): Minimum seconds between the start of two captures
+            change_detector: Optional FrameChangeDetector. Frames it reports as unchanged
+                reuse the previous parse result instead of being parsed again.
+            stage_timings_fn: Optional callable returning the per-stage milliseconds of the
+                parse that just finished, such as lambda: parser.last_timings. It is called
+                on the parse thread right after parse_fn.
+        """
+        self.capture_fn = capture_fn
+        self.parse_fn = parse_fn
+        self.capture_interval = capture_interval
+        self.change_detector = change_detector
+        self.stage_timings_fn = stage_timings_fn
+        self._last_parse = None
+        self.capture_queue = LatestFrameQueue(queue_size)
+        self.result_queue = LatestFrameQueue(queue_size)
+        self._stop_event = threading.Event()
+        self._threads = []
+        self.capture_count = 0
+        self.capture_failures = 0
+        self.parse_count = 0
+        self.parse_failures = 0
+        self.display_count = 0
+        self.last_capture_ms = 0.0
+        self.last_parse_ms = 0.0
+        self.last_frame_age_ms = 0.0
+
+    def start(self):
+        """Start the capture and parse threads"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_stage, name="capture-stage", daemon=True),
+            threading.Thread(target=self._parse_stage, name="parse-stage", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the background stages and wait for them to exit"""
+        self._stop_event.set()
+        self.capture_queue.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def is_running(self) -> bool:
+        """True if the background stages are running"""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def get_result(self, timeout: Optional[float] = None):
+        """Get the newest parse result for the display stage.
+
+        Returns:
+            dict with 'frame', 'labeled_img', 'parsed_content', 'captured_at',
+            'capture_ms', 'parse_ms', 'stage_timings', 'error' and 'reused' keys, or None
+            if no new result
+        """
+        return self.result_queue.get(timeout)
+
+    def mark_displayed(self, result: dict):
+        """Record that the display stage consumed a result from get_result()"""
+        self.display_count += 1
+        self.last_frame_age_ms = (time.perf_counter() - result["captured_at"]) * 1000
+
+    def _capture_stage(self):
+        while not self._stop_event.is_set():
+            start_time = time.perf_counter()
+            try:
+                frame = self.capture_fn()
+            except Exception as e:
+                logger.warning(f"Failed to capture screenshot: {str(e)}")
+                frame = None
+            self.last_capture_ms = (time.perf_counter() - start_time) * 1000
+
+            if frame is None:
+                self.capture_failures += 1
+                # Avoid spinning when the VM window is unavailable
+                self._stop_event.wait(0.1)
+                continue
+
+            self.capture_count += 1
+            self.capture_queue.put({
+                "frame": frame,
+                "captured_at": time.perf_counter(),
+                "capture_ms": self.last_capture_ms,
+            })
+
+            # Frames captured faster than the parser can consume them are just dropped
+            remaining = self.capture_interval - (time.perf_counter() - start_time)
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+
+    def _parse_stage(self):
+        while not self._stop_event.is_set():
+            item = self.capture_queue.get(timeout=0.1)
+            if item is None:
+                continue
+
+            start_time = time.perf_counter()
+            if self._is_unchanged(item["frame"]):
+                # Same screen as last time, reuse the previous parse result
+                labeled_img, parsed_content = self._last_parse
+                item.update({
+                    "labeled_img": labeled_img,
+                    "parsed_content": parsed_content,
+                    "parse_ms": (time.perf_counter() - start_time) * 1000,
+                    "stage_timings": {},
+                    "error": None,
+                    "reused": True,
+                })
+                self.result_queue.put(item)
+                continue
+
+            labeled_img = None
+            parsed_content = None
+            stage_timings = {}
+            error = None
+            try:
+                labeled_img, parsed_content = self.parse_fn(item["frame"])
+                self._last_parse = (labeled_img, parsed_content)
+                if self.stage_timings_fn:
+                    stage_timings = dict(self.stage_timings_fn())
+            except Exception as e:
+                error = e
+                self.parse_failures += 1
+                self._last_parse = None
+                if self.change_detector:
+                    self.change_detector.reset()
+            self.last_parse_ms = (time.perf_counter() - start_time) * 1000
+            self.parse_count += 1
+
+            item.update({
+                "labeled_img": labeled_img,
+                "parsed_content": parsed_content,
+                "parse_ms": self.last_parse_ms,
+                "stage_timings": stage_timings,
+                "error": error,
+                "reused": False,
+            })
+            self.result_queue.put(item)
+
+    def _is_unchanged(self, frame) -> bool:
+        if not self.change_detector:
+            return False
+        unchanged = self.change_detector.is_unchanged(frame)
+        return unchanged and self._last_parse is not None
+
+    def get_stats(self) -> dict:
+        """Get per-stage counters, queue depths and dropped-frame counts"""
+        return {
+            "capture": {
+                "frames": self.capture_count,
+                "failures": self.capture_failures,
+                "last_ms": self.last_capture_ms,
+                "queue_depth": self.capture_queue.depth(),
+                "dropped": self.capture_queue.dropped,
+            },
+            "parse": {
+                "frames": self.parse_count,
+                "failures": self.parse_failures,
+                "last_ms": self.last_parse_ms,
+                "queue_depth": self.result_queue.depth(),
+                "dropped": self.result_queue.dropped,
+            },
+            "display": {
+                "frames": self.display_count,
+                "last_frame_age_ms": self.last_frame_age_ms,
+            },
+            "fingerprint": self.change_detector.get_stats() if self.change_detector else None,
+        }
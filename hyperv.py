@@ -1,31 +1,60 @@
-from typing import Optional
-import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+import numpy as np
 import json
 from PIL import Image
 import io
 import win32com.client
 import os
-from vmconnect_capture import get_vmconnect_screenshot
+import time
+from frame_fingerprint import FrameChangeDetector
+from ps_session import PowerShellDialect, ShellError, ShellSession
+from stage_timer import RollingStats
+from vmconnect_capture import get_vmconnect_frame, get_vmconnect_screenshot
+
+# Seconds a checkpoint restore may take before the PowerShell session is restarted
+CHECKPOINT_TIMEOUT = 600.0
+# Seconds the VM may take to reach Running and show its desktop after a restore
+READY_TIMEOUT = 300.0
+# Seconds between VM state and desktop checks while an async revert runs
+REVERT_POLL_INTERVAL = 1.0
+# Fraction of pixels that must differ from the screens VMConnect showed before and just after the restore
+DESKTOP_MIN_CHANGE = 0.05
+# Seconds the screen must then stay unchanged before the desktop counts as ready
+DESKTOP_STABLE_SECONDS = 3.0
+# Per-channel difference a pixel may have, and fraction of pixels that may change, while the screen counts as unchanged
+DESKTOP_PIXEL_THRESHOLD = 8
+DESKTOP_STABLE_TOLERANCE = 0.002
 
 class HyperVConnection:
-    def __init__(self, vm_name: str):
+    def __init__(self, vm_name: str, session: Optional[ShellSession] = None):
+        """
+        Args:
+            vm_name (str): Name of the Hyper-V VM
+            session (ShellSession): Shell to run Hyper-V commands in; by default a
+                PowerShell session with the Hyper-V module, started on first use
+        """
         self.vm_name = vm_name
         self.vm = None
         self.hyperv = None
+        self.session = session or ShellSession(PowerShellDialect(), startup_commands=['Import-Module Hyper-V'])
+        self._vm_name_literal = self.session.dialect.quote(vm_name)
+        # Runs async reverts, one at a time
+        self._revert_executor = None
+        # Rolling restore, time-to-ready and total times of async reverts
+        self.revert_stats = RollingStats(window=100)
+        self.revert_failures = 0
 
     def connect(self) -> bool:
         try:
-            # Check if VM exists using PowerShell
-            result = subprocess.run(
-                ['powershell', '-Command', f'Get-VM -Name "{self.vm_name}" | ConvertTo-Json'],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                print(f"Failed to find VM: {result.stderr}")
+            # Check if VM exists; the session keeps $vm for the input commands
+            result = self.session.run(f'$vm = Get-VM -Name {self._vm_name_literal}; $vm | Select-Object Name, State | ConvertTo-Json -Compress')
+
+            if not result.ok:
+                print(f"Failed to find VM: {result.output}")
                 return False
-                           
+
+            self.vm = result.json()
             return True
         except Exception as e:
             print(f"Failed to connect to VM: {e}")
@@ -39,25 +68,29 @@ class HyperVConnection:
         """
         return get_vmconnect_screenshot()
 
+    def get_frame(self) -> Optional[np.ndarray]:
+        """
+        Capture the VM screen as an RGB array, reusing the capture buffers between calls
+        Returns:
+            Optional[np.ndarray]: (height, width, 3) RGB array, or None if failed
+        """
+        return get_vmconnect_frame()
+
     def send_keys(self, keys: str):
         try:
             # Use PowerShell to send keys
-            subprocess.run(
-                ['powershell', '-Command', f'$vm = Get-VM -Name "{self.vm_name}"; $vm.KeyboardInput("{keys}")'],
-                capture_output=True,
-                text=True
-            )
+            result = self.session.run(f'$vm = Get-VM -Name {self._vm_name_literal}; $vm.KeyboardInput({self.session.dialect.quote(keys)})')
+            if not result.ok:
+                print(f"Failed to send keys: {result.output}")
         except Exception as e:
             print(f"Failed to send keys: {e}")
 
     def send_mouse_click(self, x: int, y: int):
         try:
             # Use PowerShell to send mouse click
-            subprocess.run(
-                ['powershell', '-Command', f'$vm = Get-VM -Name "{self.vm_name}"; $vm.MouseClick({x}, {y})'],
-                capture_output=True,
-                text=True
-            )
+            result = self.session.run(f'$vm = Get-VM -Name {self._vm_name_literal}; $vm.MouseClick({int(x)}, {int(y)})')
+            if not result.ok:
+                print(f"Failed to send mouse click: {result.output}")
         except Exception as e:
             print(f"Failed to send mouse click: {e}")
 
@@ -79,16 +112,15 @@ class HyperVConnection:
         """
         try:
             # Use PowerShell to apply the checkpoint
-            result = subprocess.run(
-                ['powershell', '-Command', f'Restore-VMSnapshot -VMName "{self.vm_name}" -Name "{checkpoint_name}" -Confirm:$false'],
-                capture_output=True,
-                text=True
+            result = self.session.run(
+                f'Restore-VMSnapshot -VMName {self._vm_name_literal} -Name {self.session.dialect.quote(checkpoint_name)} -Confirm:$false',
+                timeout=CHECKPOINT_TIMEOUT
             )
-            
-            if result.returncode != 0:
-                print(f"Failed to apply checkpoint: {result.stderr}")
+
+            if not result.ok:
+                print(f"Failed to apply checkpoint: {result.output}")
                 return False
-                
+
             return True
         except Exception as e:
             print(f"Failed to apply checkpoint: {e}")
@@ -102,3 +134,139 @@ class HyperVConnection:
         """
         return self.apply_checkpoint("revert")
 
+    def revert_async(self, checkpoint_name: str = "revert", ready_check: Optional[Callable[[], bool]] = None,
+                     poll_interval: float = REVERT_POLL_INTERVAL) -> Future:
+        """
+        Start restoring a checkpoint and return immediately, so the caller can prepare
+        its next step while the restore runs
+        Args:
+            checkpoint_name (str): The name of the checkpoint to apply
+            ready_check: Called every poll_interval once the VM is running, returns True when
+                the VM is usable; defaults to a desktop_ready_check made before the restore starts
+            poll_interval (float): Seconds between VM state and ready checks
+        Returns:
+            Future: Resolves to a dict with 'ok', 'error', and seconds for 'restore' (until
+                the checkpoint was applied), 'running' and 'ready' (since the revert started)
+                and 'total'
+        """
+        if self._revert_executor is None:
+            self._revert_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revert")
+        return self._revert_executor.submit(self._revert_and_wait, checkpoint_name, ready_check, poll_interval)
+
+    def desktop_ready_check(self) -> Callable[[], bool]:
+        """
+        Make a ready check for one revert; make it before the restore starts. VMConnect keeps
+        showing the screen from before the restore, and then the VM's turned-off screen, for a
+        while after the restore, so the check only passes once the screen differs from both the
+        screen captured now and the first one captured once the VM is running, and has then
+        stayed unchanged for DESKTOP_STABLE_SECONDS
+        Returns:
+            Callable[[], bool]: Check for revert_async's ready_check
+        """
+        stale_frames = [frame for frame in [self.get_frame()] if frame is not None]
+        detector = FrameChangeDetector(tolerance=DESKTOP_STABLE_TOLERANCE, pixel_threshold=DESKTOP_PIXEL_THRESHOLD)
+        state = {'running_frame': False, 'stable_since': None}
+
+        def differs(frame, stale):
+            if frame.shape != stale.shape:
+                return True
+            changed = (np.abs(frame.astype(np.int16) - stale.astype(np.int16)) > DESKTOP_PIXEL_THRESHOLD).any(axis=-1)
+            return changed.mean() >= DESKTOP_MIN_CHANGE
+
+        def ready_check():
+            frame = self.get_frame()
+            if frame is not None and not state['running_frame']:
+                state['running_frame'] = True
+                stale_frames.append(frame)
+                return False
+            if frame is None or not all(differs(frame, stale) for stale in stale_frames):
+                detector.reset()
+                return False
+            now = time.perf_counter()
+            if not detector.is_unchanged(frame):
+                state['stable_since'] = now
+                return False
+            return now - state['stable_since'] >= DESKTOP_STABLE_SECONDS
+        return ready_check
+
+    def _get_vm_state(self) -> str:
+        return self.session.run(f'[string](Get-VM -Name {self._vm_name_literal}).State', check=True).output.strip()
+
+    def _revert_and_wait(self, checkpoint_name: str, ready_check: Optional[Callable[[], bool]], poll_interval: float) -> dict:
+        start_time = time.perf_counter()
+        result = {'ok': False, 'checkpoint': checkpoint_name, 'error': None, 'restore': None, 'running': None, 'ready': None, 'total': None}
+        try:
+            if ready_check is None:
+                ready_check = self.desktop_ready_check()
+            # Run the restore as a job so the session stays free for the state polls
+            job_id = int(self.session.run(
+                f'(Restore-VMSnapshot -VMName {self._vm_name_literal} -Name {self.session.dialect.quote(checkpoint_name)} -Confirm:$false -AsJob).Id',
+                check=True).output.strip())
+            deadline = start_time + CHECKPOINT_TIMEOUT
+            while True:
+                job_state = self.session.run(f'[string](Get-Job -Id {job_id}).State', check=True).output.strip()
+                if job_state == 'Completed':
+                    break
+                if job_state in ('Failed', 'Stopped'):
+                    # Receive-Job rethrows the restore's error
+                    raise ShellError(self.session.run(f'Receive-Job -Id {job_id}').output or f"Restore job {job_state.lower()}")
+                if time.perf_counter() > deadline:
+                    raise ShellError(f"Restore did not finish within {CHECKPOINT_TIMEOUT:.0f}s")
+                time.sleep(poll_interval)
+            self.session.run(f'Remove-Job -Id {job_id}')
+            result['restore'] = time.perf_counter() - start_time
+
+            # Checkpoints taken with the VM off leave it off
+            deadline = time.perf_counter() + READY_TIMEOUT
+            vm_state = self._get_vm_state()
+            if vm_state in ('Off', 'Saved'):
+                self.session.run(f'Start-VM -Name {self._vm_name_literal}', check=True)
+            while vm_state != 'Running':
+                if time.perf_counter() > deadline:
+                    raise ShellError(f"VM did not start within {READY_TIMEOUT:.0f}s, state {vm_state}")
+                time.sleep(poll_interval)
+                vm_state = self._get_vm_state()
+            result['running'] = time.perf_counter() - start_time
+
+            while not ready_check():
+                if time.perf_counter() > deadline:
+                    raise ShellError(f"VM desktop not ready within {READY_TIMEOUT:.0f}s")
+                time.sleep(poll_interval)
+            result['ready'] = time.perf_counter() - start_time
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+            print(f"Failed to revert to checkpoint: {e}")
+        result['total'] = time.perf_counter() - start_time
+
+        if result['ok']:
+            self.revert_stats.add({'restore': result['restore'] * 1000, 'time_to_ready': result['ready'] * 1000})
+        else:
+            self.revert_failures += 1
+        return result
+
+    def get_revert_stats(self) -> dict:
+        """
+        Get async revert counters and rolling restore and time-to-ready percentiles
+        Returns:
+            dict: 'failures' and RollingStats.get_stats() entries in milliseconds
+        """
+        return {'failures': self.revert_failures, **self.revert_stats.get_stats()}
+
+    def get_session_stats(self) -> dict:
+        """
+        Get the PowerShell session's start, command, failure and timeout counters
+        Returns:
+            dict: ShellSession.get_stats()
+        """
+        return self.session.get_stats()
+
+    def close(self):
+        """
+        Stop the PowerShell session; it is started again if the connection is used afterwards
+        """
+        if self._revert_executor is not None:
+            # An unfinished revert fails once the session is gone
+            self._revert_executor.shutdown(wait=False)
+            self._revert_executor = None
+        self.session.close()
@@ -106,6 +106,37 @@ class ImageViewer:
 
         # no need to remove circle, it will get pulled off in next frame update
 
+class NullImageViewer:
+    """Stand-in for ImageViewer when nobody is watching (headless runs).
+
+    Accepts the same calls as ImageViewer and does nothing, so no Tk root is
+    created and no thumbnails are rendered.
+    """
+    def __init__(self, window_title="Image Viewer", window_size=(800, 600)):
+        self.root = None
+        self.current_image = None
+        self.click_callback = None
+
+    def set_click_handler(self, callback):
+        """Set the callback function for click events (never called)"""
+        self.click_callback = callback
+
+    def update_image(self, image):
+        """Ignore the image"""
+        pass
+
+    def update(self):
+        """Nothing to update"""
+        pass
+
+    def close(self):
+        """Nothing to close"""
+        pass
+
+    def draw_circle(self, x: int, y: int, radius: int = 10):
+        """Ignore the circle"""
+        pass
+
 if __name__ == "__main__":
     # Example usage
     viewer = ImageViewer()
@@ -0,0 +1,447 @@
+"""Runs a matrix of app install tests across several VMs.
+
+Every app runs on every VM. Each VM has one worker that reverts the VM to its
+checkpoint, installs the app and launches it, then moves on to the next app.
+Failed attempts are queued again up to max_attempts. The revert runs in the
+background while the backend prepares the attempt, so preparation doesn't add
+to the time the VM spends restoring. Phases that use shared
+resources (the parser, the LLM quota) hold a slot from ResourceLimits, so
+more VMs than slots queue for them instead of overloading them. Every attempt
+is written to a JSONL results file as it finishes; a summary with throughput,
+queue wait and per-phase timings is written last.
+
+SimulatedVMBackend stands in for a VM so the scheduler can be load tested
+anywhere:
+
+    python install_scheduler.py --vms 4 --apps all --failure-rate 0.1
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from stage_timer import RollingStats, StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Default slots per shared resource
+DEFAULT_RESOURCE_LIMITS = {'parser': 2, 'llm': 1}
+# Directory results files go to by default; ignored by git
+RESULTS_DIR = 'install_results'
+
+
+class ResourceLimits:
+    """Named counting semaphores for resources shared by all VM workers"""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            limits (dict): Slots per resource name; resources not listed are unlimited
+        """
+        self.limits = dict(DEFAULT_RESOURCE_LIMITS if limits is None else limits)
+        self._semaphores = {name: threading.BoundedSemaphore(slots) for name, slots in self.limits.items()}
+
+    @contextmanager
+    def hold(self, names: Sequence[str], timer: Optional[StageTimer] = None):
+        """Hold a slot of each named resource for the enclosed block
+
+        Slots are taken in sorted name order so workers can't deadlock on each other.
+        The time spent waiting for each is recorded on timer as 'wait.<name>'.
+        """
+        with ExitStack() as stack:
+            for name in sorted(set(names)):
+                semaphore = self._semaphores.get(name)
+                if semaphore is None:
+                    continue
+                start = time.perf_counter()
+                semaphore.acquire()
+                stack.callback(semaphore.release)
+                if timer is not None:
+                    timer.add(f"wait.{name}", time.perf_counter() - start)
+            yield
+
+
+class InstallAttempt:
+    """One attempt at installing one app on one VM"""
+
+    def __init__(self, app_name: str, winget_id: str, shortcut_name: str, vm_name: str, attempt: int, queued_at: float,
+                 resources: ResourceLimits):
+        self.app_name = app_name
+        self.winget_id = winget_id
+        self.shortcut_name = shortcut_name
+        self.vm_name = vm_name
+        self.attempt = attempt
+        self.queued_at = queued_at
+        self.started_at = None
+        self.finished_at = None
+        self.ok = False
+        self.error = None
+        self.timer = StageTimer()
+        self._resources = resources
+
+    def phase(self, name: str, *resources: str):
+        """Context manager timing a phase of the test, holding a slot of each named resource while it runs"""
+        @contextmanager
+        def run_phase():
+            with self._resources.hold(resources, self.timer):
+                with self.timer.stage(name):
+                    yield
+        return run_phase()
+
+    def to_record(self) -> Dict:
+        """JSON-serializable summary of the attempt"""
+        return {
+            'app': self.app_name,
+            'winget_id': self.winget_id,
+            'vm': self.vm_name,
+            'attempt': self.attempt,
+            'ok': self.ok,
+            'error': self.error,
+            'queue_wait_ms': (self.started_at - self.queued_at) * 1000,
+            'duration_ms': (self.finished_at - self.started_at) * 1000,
+            'phases_ms': self.timer.get_ms(),
+        }
+
+
+class VMBackend(ABC):
+    """Drives install tests on one VM"""
+
+    def __init__(self, vm_name: str):
+        self.vm_name = vm_name
+        self._revert_executor = None
+
+    @abstractmethod
+    def revert(self, checkpoint_name: str) -> bool:
+        """Restore the VM to a checkpoint and wait until it is usable"""
+
+    def revert_async(self, checkpoint_name: str) -> Future:
+        """Start restoring the VM to a checkpoint
+
+        Returns:
+            Future: Resolves to a dict with 'ok', 'error' and the seconds the revert took as
+                'total', plus 'restore' and 'ready' if the backend measures them (see
+                HyperVConnection.revert_async)
+        """
+        def run_revert():
+            start = time.perf_counter()
+            ok = self.revert(checkpoint_name)
+            return {'ok': ok, 'error': None if ok else f"Failed to revert to checkpoint '{checkpoint_name}'",
+                    'total': time.perf_counter() - start}
+        return self._submit_revert(run_revert)
+
+    def _submit_revert(self, revert_fn) -> Future:
+        """Run revert_fn on the backend's revert thread, one revert at a time"""
+        if self._revert_executor is None:
+            self._revert_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"revert-{self.vm_name}")
+        return self._revert_executor.submit(revert_fn)
+
+    def wait_for_revert(self, revert: Future) -> Dict:
+        """Wait for a revert_async future and return its result"""
+        return revert.result()
+
+    def prepare(self, attempt: InstallAttempt):
+        """Get ready for an attempt while the VM reverts, such as planning it or warming caches"""
+        pass
+
+    @abstractmethod
+    def install(self, attempt: InstallAttempt) -> bool:
+        """Install and launch attempt's app, timing each step with attempt.phase
+
+        Returns:
+            bool: True if the app was installed; raising counts as a failure too
+        """
+
+    def close(self):
+        """Release the backend's resources"""
+        if self._revert_executor is not None:
+            self._revert_executor.shutdown(wait=False)
+            self._revert_executor = None
+
+
+class MegaAppTesterBackend(VMBackend):
+    """Runs install tests through an initialized MegaAppTester.
+
+    MegaAppTester drives the VMConnect window and its UI on the thread that
+    created it, so this backend has to be the first one passed to
+    InstallScheduler, whose worker runs on the calling thread.
+    """
+
+    def __init__(self, app):
+        """
+        Args:
+            app (MegaAppTester): App initialized with a connection, viewer, console and parser
+        """
+        super().__init__(app.connection.vm_name)
+        self.app = app
+
+    def revert(self, checkpoint_name: str) -> bool:
+        return self.wait_for_revert(self.revert_async(checkpoint_name))['ok']
+
+    def revert_async(self, checkpoint_name: str) -> Future:
+        return self.app.connection.revert_async(checkpoint_name)
+
+    def wait_for_revert(self, revert: Future) -> Dict:
+        # Keeps the windows updating while the restore runs
+        return self.app.wait_for_revert(revert)
+
+    def prepare(self, attempt: InstallAttempt):
+        self.app.prepare_install(attempt.app_name)
+
+    def install(self, attempt: InstallAttempt) -> bool:
+        return self.app.install_app(attempt.app_name, phase=attempt.phase)
+
+
+class SimulatedVMBackend(VMBackend):
+    """Stand-in VM that sleeps through each phase of a test, for load testing the scheduler"""
+
+    # Typical seconds per phase on a real VM; 'boot' is the time from the restore until the desktop is ready
+    PHASE_SECONDS = {'revert': 45.0, 'boot': 20.0, 'prepare': 20.0, 'install': 60.0, 'drive_installer': 120.0, 'launch': 15.0}
+
+    def __init__(self, vm_name: str, time_scale: float = 0.001, failure_rate: float = 0.0, jitter: float = 0.3,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            vm_name (str): Name reported in the results
+            time_scale (float): Real seconds slept per simulated second
+            failure_rate (float): Probability that an attempt fails in one of its phases
+            jitter (float): Random +/- fraction applied to every phase duration
+            seed (int): Seed for the durations and failures, for repeatable runs
+        """
+        super().__init__(vm_name)
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def _sleep(self, phase: str):
+        seconds = self.PHASE_SECONDS[phase] * (1 + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(seconds * self.time_scale)
+
+    def _simulate_revert(self) -> Dict:
+        start = time.perf_counter()
+        self._sleep('revert')
+        restore = time.perf_counter() - start
+        self._sleep('boot')
+        ready = time.perf_counter() - start
+        return {'ok': True, 'error': None, 'restore': restore, 'ready': ready, 'total': ready}
+
+    def revert(self, checkpoint_name: str) -> bool:
+        return self._simulate_revert()['ok']
+
+    def revert_async(self, checkpoint_name: str) -> Future:
+        # Same as the base class, but reports the restore and time-to-ready split
+        return self._submit_revert(self._simulate_revert)
+
+    def prepare(self, attempt: InstallAttempt):
+        # Planning the attempt and warming caches
+        self._sleep('prepare')
+
+    def install(self, attempt: InstallAttempt) -> bool:
+        failing_phase = self._random.choice(['install', 'drive_installer', 'launch']) if self._random.random() < self.failure_rate else None
+        for phase, resources in (('install', ('parser',)), ('drive_installer', ('parser', 'llm')), ('launch', ('parser',))):
+            with attempt.phase(phase, *resources):
+                self._sleep(phase)
+            if phase == failing_phase:
+                raise RuntimeError(f"Simulated failure in {phase}")
+        return True
+
+
+class InstallScheduler:
+    """Runs every app on every VM, one worker per VM"""
+
+    def __init__(self, backends: Sequence[VMBackend], app_map: Dict[str, Dict], resource_limits: Optional[Dict[str, int]] = None,
+                 max_attempts: int = 2, results_path: Optional[str] = None, checkpoint_name: str = "revert",
+                 overlap_revert: bool = True):
+        """
+        Args:
+            backends: One backend per VM; the first one's worker runs on the thread calling run()
+            app_map (dict): MegaAppTester.app_map style {name: {"winget_id", "shortcut_name"}}
+            resource_limits (dict): Slots per shared resource, defaults to DEFAULT_RESOURCE_LIMITS
+            max_attempts (int): Attempts per app and VM before it is reported as failed
+            results_path (str): JSONL file to write every attempt and the final summary to
+            checkpoint_name (str): Checkpoint each VM is reverted to before every attempt
+            overlap_revert (bool): Prepare each attempt while its VM reverts; if False the
+                revert finishes before preparation starts
+        """
+        self.backends = list(backends)
+        self.app_map = app_map
+        self.resources = ResourceLimits(resource_limits)
+        self.max_attempts = max(1, max_attempts)
+        self.results_path = results_path
+        self.checkpoint_name = checkpoint_name
+        self.overlap_revert = overlap_revert
+        self.attempts = []
+        self._lock = threading.Lock()
+        self._results_file = None
+
+    def _new_attempt(self, app_name: str, vm_name: str, attempt: int) -> InstallAttempt:
+        app_info = self.app_map.get(app_name.lower(), {})
+        return InstallAttempt(app_name, app_info.get("winget_id", app_name), app_info.get("shortcut_name", app_name), vm_name,
+                              attempt, time.perf_counter(), self.resources)
+
+    def _record(self, attempt: InstallAttempt):
+        record = attempt.to_record()
+        with self._lock:
+            self.attempts.append(attempt)
+            if self._results_file:
+                self._results_file.write(json.dumps(record) + "\n")
+                self._results_file.flush()
+
+    def _run_attempt(self, backend: VMBackend, attempt: InstallAttempt):
+        attempt.started_at = time.perf_counter()
+        try:
+            revert = backend.revert_async(self.checkpoint_name)
+            if self.overlap_revert:
+                with attempt.phase('prepare'):
+                    backend.prepare(attempt)
+            # Only the part of the revert that preparation didn't cover
+            with attempt.phase('revert_wait'):
+                reverted = backend.wait_for_revert(revert)
+            attempt.timer.add('revert', reverted['total'])
+            if reverted.get('restore') is not None:
+                attempt.timer.add('restore', reverted['restore'])
+            if reverted.get('ready') is not None:
+                attempt.timer.add('time_to_ready', reverted['ready'])
+            if not reverted['ok']:
+                attempt.error = reverted['error'] or f"Failed to revert to checkpoint '{self.checkpoint_name}'"
+            else:
+                if not self.overlap_revert:
+                    with attempt.phase('prepare'):
+                        backend.prepare(attempt)
+                attempt.ok = bool(backend.install(attempt))
+                if not attempt.ok:
+                    attempt.error = "Install reported failure"
+        except Exception as e:
+            attempt.error = str(e) or type(e).__name__
+        attempt.finished_at = time.perf_counter()
+
+    def _worker(self, backend: VMBackend, apps: Sequence[str]):
+        queue = deque(self._new_attempt(app_name, backend.vm_name, 1) for app_name in apps)
+        while queue:
+            attempt = queue.popleft()
+            self._run_attempt(backend, attempt)
+            self._record(attempt)
+            if attempt.ok:
+                logger.info(f"{attempt.vm_name}: {attempt.app_name} passed (attempt {attempt.attempt})")
+            elif attempt.attempt < self.max_attempts:
+                logger.warning(f"{attempt.vm_name}: {attempt.app_name} failed (attempt {attempt.attempt}): {attempt.error}, retrying")
+                # Retried after the rest of the queue, so a transient problem has time to clear
+                queue.append(self._new_attempt(attempt.app_name, backend.vm_name, attempt.attempt + 1))
+            else:
+                logger.error(f"{attempt.vm_name}: {attempt.app_name} failed after {attempt.attempt} attempts: {attempt.error}")
+
+    def run(self, apps: Optional[Sequence[str]] = None) -> Dict:
+        """Run the matrix and wait for it to finish
+
+        Args:
+            apps: App names to test, defaults to every app in app_map
+
+        Returns:
+            dict: The summary from get_summary()
+        """
+        apps = list(apps or self.app_map.keys())
+        self.attempts = []
+        start = time.perf_counter()
+        if self.results_path:
+            os.makedirs(os.path.dirname(self.results_path) or '.', exist_ok=True)
+            self._results_file = open(self.results_path, 'w')
+        try:
+            threads = [threading.Thread(target=self._worker, args=(backend, apps), name=f"install-{backend.vm_name}", daemon=True)
+                       for backend in self.backends[1:]]
+            for thread in threads:
+                thread.start()
+            if self.backends:
+                self._worker(self.backends[0], apps)
+            for thread in threads:
+                thread.join()
+            summary = self.get_summary(time.perf_counter() - start)
+            if self._results_file:
+                self._results_file.write(json.dumps({'summary': summary}) + "\n")
+        finally:
+            if self._results_file:
+                self._results_file.close()
+                self._results_file = None
+        return summary
+
+    def get_summary(self, elapsed: float) -> Dict:
+        """Pass/fail counts, tests per hour, and queue wait and per-phase timing percentiles
+
+        Args:
+            elapsed (float): Wall-clock seconds the run took
+        """
+        with self._lock:
+            attempts = list(self.attempts)
+        final = {}
+        for attempt in attempts:
+            # The last attempt of each app and VM decides the result
+            final[(attempt.app_name, attempt.vm_name)] = attempt
+        timings = RollingStats(window=max(1, len(attempts)))
+        for attempt in attempts:
+            durations = attempt.timer.get_ms()
+            durations['queue_wait'] = (attempt.started_at - attempt.queued_at) * 1000
+            durations['total'] = (attempt.finished_at - attempt.started_at) * 1000
+            timings.add(durations)
+        passed = sum(1 for attempt in final.values() if attempt.ok)
+        return {
+            'tests': len(final),
+            'passed': passed,
+            'failed': len(final) - passed,
+            'attempts': len(attempts),
+            'retries': len(attempts) - len(final),
+            'vms': len(self.backends),
+            'elapsed_s': elapsed,
+            'tests_per_hour': len(final) * 3600 / elapsed if elapsed > 0 else 0.0,
+            'timings_ms': timings.get_stats(),
+        }
+
+
+def format_summary(summary: Dict) -> List[str]:
+    """Format a scheduler summary as text lines"""
+    lines = [f"{summary['tests']} tests on {summary['vms']} VMs: {summary['passed']} passed, {summary['failed']} failed, "
+             f"{summary['retries']} retries in {summary['elapsed_s']:.1f}s ({summary['tests_per_hour']:.1f} tests/hour)"]
+    timings = summary['timings_ms']
+    if timings:
+        width = max(len('phase'), *(len(name) for name in timings))
+        lines.append(f"{'phase':<{width}} {'count':>6} {'p50 ms':>10} {'p95 ms':>10}")
+        for name, stage in timings.items():
+            lines.append(f"{name:<{width}} {stage['count']:>6} {stage['p50']:>10.1f} {stage['p95']:>10.1f}")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    from app_catalog import APP_MAP
+
+    arg_parser = argparse.ArgumentParser(description="Load test the install scheduler against simulated VMs")
+    arg_parser.add_argument('--vms', type=int, default=4, help='Number of simulated VMs')
+    arg_parser.add_argument('--apps', default='all', help="Comma separated app names, or 'all' for every app in the app map")
+    arg_parser.add_argument('--failure-rate', type=float, default=0.1, help='Probability that an attempt fails')
+    arg_parser.add_argument('--max-attempts', type=int, default=2, help='Attempts per app and VM')
+    arg_parser.add_argument('--time-scale', type=float, default=0.001, help='Real seconds per simulated second')
+    arg_parser.add_argument('--parser-slots', type=int, default=DEFAULT_RESOURCE_LIMITS['parser'])
+    arg_parser.add_argument('--llm-slots', type=int, default=DEFAULT_RESOURCE_LIMITS['llm'])
+    arg_parser.add_argument('--results', default=os.path.join(RESULTS_DIR, 'install_results.jsonl'), help='JSONL file for attempts and the summary')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--serial-revert', action='store_true', help='Wait for each revert before preparing the attempt, for comparison')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    apps = list(APP_MAP) if args.apps == 'all' else [app.strip() for app in args.apps.split(',')]
+    backends = [SimulatedVMBackend(f"sim-vm-{i + 1}", args.time_scale, args.failure_rate, seed=args.seed + i) for i in range(args.vms)]
+    scheduler = InstallScheduler(backends, APP_MAP, {'parser': args.parser_slots, 'llm': args.llm_slots},
+                                 max_attempts=args.max_attempts, results_path=args.results, overlap_revert=not args.serial_revert)
+    summary = scheduler.run(apps)
+    for backend in backends:
+        backend.close()
+    # Throughput in simulated time, as it would be on real VMs
+    print(f"Simulated throughput: {summary['tests_per_hour'] * args.time_scale:.1f} tests/hour")
+    for line in format_summary(summary):
+        print(line)
+    print(f"Results written to {args.results}")
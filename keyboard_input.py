@@ -0,0 +1,299 @@
+"""Keystroke injection through SendInput, built and submitted in bulk.
+
+A whole string is turned into one array of keyboard INPUT events (with the
+shift, ctrl and alt presses VkKeyScan asks for) and handed to SendInput in a
+few large calls instead of one call and one sleep per event. Nothing here
+needs Windows until the events are actually sent, so the event building can
+be exercised anywhere with RecordingSendInput and us_layout_vk_key_scan.
+"""
+import ctypes
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+INPUT_KEYBOARD = 1
+KEYEVENTF_KEYUP = 0x0002
+KEYEVENTF_UNICODE = 0x0004
+
+VK_TAB = 0x09
+VK_RETURN = 0x0D
+VK_SHIFT = 0x10
+VK_CONTROL = 0x11
+VK_MENU = 0x12  # Alt key
+
+# VkKeyScan modifier bits, in the order the modifiers are pressed
+MODIFIERS = ((0x1, VK_SHIFT), (0x2, VK_CONTROL), (0x4, VK_MENU))
+
+# Events per SendInput call when no pacing is requested
+DEFAULT_BATCH_SIZE = 256
+
+# (virtual key code, scan code, flags)
+KeyEvent = Tuple[int, int, int]
+
+
+# Fixed-width fields, so the layout matches Windows whatever platform builds it
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [("wVk", ctypes.c_uint16),
+                ("wScan", ctypes.c_uint16),
+                ("dwFlags", ctypes.c_uint32),
+                ("time", ctypes.c_uint32),
+                ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [("dx", ctypes.c_int32),
+                ("dy", ctypes.c_int32),
+                ("mouseData", ctypes.c_uint32),
+                ("dwFlags", ctypes.c_uint32),
+                ("time", ctypes.c_uint32),
+                ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class HARDWAREINPUT(ctypes.Structure):
+    _fields_ = [("uMsg", ctypes.c_uint32),
+                ("wParamL", ctypes.c_uint16),
+                ("wParamH", ctypes.c_uint16)]
+
+
+class _INPUTUNION(ctypes.Union):
+    # The mouse member is the largest, so it has to be here for sizeof(INPUT) to match Windows
+    _fields_ = [("ki", KEYBDINPUT),
+                ("mi", MOUSEINPUT),
+                ("hi", HARDWAREINPUT)]
+
+
+class INPUT(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_uint32),
+                ("ii", _INPUTUNION)]
+
+
+# US keyboard layout: character -> VkKeyScan result (modifier bits << 8 | virtual key code)
+_US_LAYOUT = {' ': 0x20, '\t': VK_TAB, '\n': VK_RETURN, '\r': VK_RETURN}
+for _i in range(26):
+    _US_LAYOUT[chr(ord('a') + _i)] = 0x41 + _i
+    _US_LAYOUT[chr(ord('A') + _i)] = 0x100 | (0x41 + _i)
+for _i, _shifted in enumerate(")!@#$%^&*("):
+    _US_LAYOUT[str(_i)] = 0x30 + _i
+    _US_LAYOUT[_shifted] = 0x100 | (0x30 + _i)
+for _vk, _plain, _shifted in ((0xBA, ';', ':'), (0xBB, '=', '+'), (0xBC, ',', '<'), (0xBD, '-', '_'), (0xBE, '.', '>'), (0xBF, '/', '?'),
+                              (0xC0, '`', '~'), (0xDB, '[', '{'), (0xDC, '\\', '|'), (0xDD, ']', '}'), (0xDE, "'", '"')):
+    _US_LAYOUT[_plain] = _vk
+    _US_LAYOUT[_shifted] = 0x100 | _vk
+
+
+def us_layout_vk_key_scan(char: str) -> int:
+    """VkKeyScan for a US keyboard layout, for use where user32 is not available
+
+    Returns:
+        int: Modifier bits << 8 | virtual key code, or -1 if the character has no key
+    """
+    return _US_LAYOUT.get(char, -1)
+
+
+def windows_vk_key_scan(char: str) -> int:
+    """VkKeyScan for the keyboard layout of the current thread"""
+    # Line breaks are typed as Enter; VkKeyScan maps '\n' to Ctrl+Enter
+    if char in '\r\n':
+        return VK_RETURN
+    vk_key_scan_w = ctypes.windll.user32.VkKeyScanW
+    # SHORT, so an unmapped character comes back as -1
+    vk_key_scan_w.restype = ctypes.c_short
+    return vk_key_scan_w(ord(char))
+
+
+def default_vk_key_scan() -> Callable[[str], int]:
+    return windows_vk_key_scan if sys.platform == 'win32' else us_layout_vk_key_scan
+
+
+def build_text_events(text: str, vk_key_scan: Optional[Callable[[str], int]] = None, use_unicode: bool = False) -> List[KeyEvent]:
+    """Build the keyboard events that type a string.
+
+    Modifiers are only pressed and released when the next character needs a
+    different set, so runs of capitals don't toggle shift for every letter.
+
+    Args:
+        text: String to type
+        vk_key_scan: Character to VkKeyScan result mapping, defaults to the current layout
+        use_unicode: Send characters the layout can't type as KEYEVENTF_UNICODE events
+            (VK_PACKET); otherwise they are skipped. Whether VMConnect passes these
+            through to the guest depends on the connection, so it is off by default.
+
+    Returns:
+        list: (virtual key code, scan code, flags) events
+    """
+    vk_key_scan = vk_key_scan or default_vk_key_scan()
+    events = []
+    held = 0
+
+    def set_modifiers(wanted):
+        nonlocal held
+        for bit, vk in MODIFIERS:
+            if wanted & bit and not held & bit:
+                events.append((vk, 0, 0))
+        for bit, vk in reversed(MODIFIERS):
+            if held & bit and not wanted & bit:
+                events.append((vk, 0, KEYEVENTF_KEYUP))
+        held = wanted
+
+    for char in text:
+        result = vk_key_scan(char)
+        if result == -1 or result & 0xFFFF == 0xFFFF:
+            if not use_unicode:
+                print(f"No virtual key code found for character: {char}")
+                continue
+            set_modifiers(0)
+            # Characters outside the BMP are sent as a UTF-16 surrogate pair
+            encoded = char.encode('utf-16-le')
+            for i in range(0, len(encoded), 2):
+                unit = int.from_bytes(encoded[i:i + 2], 'little')
+                events.append((0, unit, KEYEVENTF_UNICODE))
+                events.append((0, unit, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP))
+            continue
+
+        set_modifiers((result >> 8) & 0x7)
+        vk = result & 0xFF
+        events.append((vk, 0, 0))
+        events.append((vk, 0, KEYEVENTF_KEYUP))
+
+    set_modifiers(0)
+    return events
+
+
+def build_input_array(events: List[KeyEvent]) -> ctypes.Array:
+    """Pack keyboard events into a ctypes INPUT array for SendInput"""
+    inputs = (INPUT * len(events))()
+    for item, (vk, scan, flags) in zip(inputs, events):
+        item.type = INPUT_KEYBOARD
+        item.ii.ki = KEYBDINPUT(vk, scan, flags, 0, 0)
+    return inputs
+
+
+def _keystroke_ends(events: List[KeyEvent]) -> List[int]:
+    """Indices just past each character's events, so pacing never splits a keystroke"""
+    ends = []
+    for i, (vk, _, flags) in enumerate(events):
+        # A character is done when a non-modifier key is released
+        if flags & KEYEVENTF_KEYUP and vk not in (VK_SHIFT, VK_CONTROL, VK_MENU):
+            ends.append(i + 1)
+    if not ends or ends[-1] != len(events):
+        ends.append(len(events))
+    return ends
+
+
+def send_events(events: List[KeyEvent], send_input: Optional[Callable] = None, batch_size: int = DEFAULT_BATCH_SIZE, key_delay: float = 0.0) -> int:
+    """Submit keyboard events with SendInput.
+
+    Args:
+        events: Events from build_text_events
+        send_input: SendInput compatible callable, defaults to user32.SendInput
+        batch_size: Events per SendInput call when key_delay is 0
+        key_delay: Seconds to wait after each character for guests that drop fast input;
+            0 sends everything in as few calls as batch_size allows
+
+    Returns:
+        int: Number of events SendInput accepted; fewer than len(events) means input was blocked
+    """
+    if not events:
+        return 0
+    send_input = send_input or ctypes.windll.user32.SendInput
+    inputs = build_input_array(events)
+    size = ctypes.sizeof(INPUT)
+
+    if key_delay > 0:
+        ends = _keystroke_ends(events)
+    else:
+        ends = list(range(batch_size, len(events), batch_size)) + [len(events)]
+
+    sent = 0
+    start = 0
+    for end in ends:
+        pointer = ctypes.cast(ctypes.addressof(inputs) + start * size, ctypes.POINTER(INPUT))
+        accepted = send_input(end - start, pointer, size)
+        sent += accepted
+        if accepted != end - start:
+            break
+        start = end
+        if key_delay > 0 and end != len(events):
+            time.sleep(key_delay)
+    return sent
+
+
+def type_text(text: str, send_input: Optional[Callable] = None, vk_key_scan: Optional[Callable[[str], int]] = None, use_unicode: bool = False,
+              batch_size: int = DEFAULT_BATCH_SIZE, key_delay: float = 0.0) -> bool:
+    """Type a string into the foreground window
+
+    Args:
+        text: String to type
+        send_input: SendInput compatible callable, defaults to user32.SendInput
+        vk_key_scan: Character to VkKeyScan result mapping, defaults to the current layout
+        use_unicode: Send characters the layout can't type as KEYEVENTF_UNICODE events
+        batch_size: Events per SendInput call when key_delay is 0
+        key_delay: Seconds to wait after each character
+
+    Returns:
+        bool: True if every event was accepted
+    """
+    events = build_text_events(text, vk_key_scan=vk_key_scan, use_unicode=use_unicode)
+    return send_events(events, send_input=send_input, batch_size=batch_size, key_delay=key_delay) == len(events)
+
+
+class RecordingSendInput:
+    """Stand-in for user32.SendInput that records the events instead of injecting them.
+
+    typed_text() replays the recorded events through a keyboard layout to get
+    back the text a window would have received.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.events = []
+
+    def __call__(self, count: int, inputs, size: int) -> int:
+        if size != ctypes.sizeof(INPUT):
+            return 0
+        batch = [inputs[i] for i in range(count)]
+        self.calls.append(count)
+        self.events.extend((item.ii.ki.wVk, item.ii.ki.wScan, item.ii.ki.dwFlags) for item in batch if item.type == INPUT_KEYBOARD)
+        return count
+
+    def typed_text(self, vk_key_scan: Callable[[str], int] = us_layout_vk_key_scan, layout_chars: str = ''.join(_US_LAYOUT)) -> str:
+        """Text the recorded events type with a layout; keys the layout can't produce become '\\ufffd'"""
+        keys = {}
+        for char in layout_chars:
+            # The first character wins, so Enter decodes as '\n'
+            keys.setdefault(vk_key_scan(char), char)
+        held = 0
+        units = []
+        text = []
+        for vk, scan, flags in self.events:
+            modifier = next((bit for bit, modifier_vk in MODIFIERS if modifier_vk == vk), None)
+            if modifier is not None:
+                held = held & ~modifier if flags & KEYEVENTF_KEYUP else held | modifier
+            elif flags & KEYEVENTF_UNICODE:
+                if not flags & KEYEVENTF_KEYUP:
+                    units.append(scan)
+                    if not 0xD800 <= scan < 0xDC00:
+                        text.append(b''.join(unit.to_bytes(2, 'little') for unit in units).decode('utf-16-le'))
+                        units = []
+            elif not flags & KEYEVENTF_KEYUP:
+                text.append(keys.get((held << 8) | vk, '\ufffd'))
+        return ''.join(text)
+
+
+if __name__ == "__main__":
+    # Type a winget command line into the recorder and check it round-trips
+    command = 'winget install --id Microsoft.VisualStudioCode -e --accept-source-agreements "C:\\Temp Dir\\log.txt"\n'
+    recorder = RecordingSendInput()
+    start = time.perf_counter()
+    ok = type_text(command, send_input=recorder, vk_key_scan=us_layout_vk_key_scan)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert ok and recorder.typed_text() == command, recorder.typed_text()
+    # The old send_text slept 50 ms after every event, plus one shift press/release pair per capital
+    old_events = sum(4 if us_layout_vk_key_scan(char) & 0x100 else 2 for char in command)
+    print(f"{len(command)} characters, {len(recorder.events)} events in {len(recorder.calls)} SendInput call(s), {elapsed:.1f} ms "
+          f"(was {old_events} calls and {old_events * 0.05:.1f} s of sleeps)")
+
+    recorder = RecordingSendInput()
+    assert type_text('naïve → ✓', send_input=recorder, vk_key_scan=us_layout_vk_key_scan, use_unicode=True)
+    assert recorder.typed_text() == 'naïve → ✓', recorder.typed_text()
+    print("Unicode fallback round-trips")
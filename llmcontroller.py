@@ -1,12 +1,45 @@
 from openai import AzureOpenAI
-import tiktoken
 import sys
 import os
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Columns of the control table sent to the model
+CONTROL_COLUMNS = "id|type|x|y|content"
+
+# Rough characters per token, used when tiktoken or its encoding isn't available
+CHARS_PER_TOKEN = 4
+
 class LLMController:
-    def __init__(self):
+    def __init__(self, max_control_tokens: int = 6000, max_content_chars: int = 40):
+        """
+        Args:
+            max_control_tokens (int): Token budget for the control table in each prompt; the
+                lowest priority controls are left out of screens that don't fit
+            max_content_chars (int): Characters of each control's content kept in the table
+        """
+        self.model = "gpt-4o"
         self.max_context_tokens = 128000
         self.max_response_tokens = 4096
+        self.max_control_tokens = max_control_tokens
+        self.max_content_chars = max_content_chars
+        self._encoding = None
+        self._encoding_loaded = False
+
+        # Token counts of the most recent model call, and totals over all calls
+        self.last_call_tokens = None
+        self.total_calls = 0
+        self.total_prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.total_controls_omitted = 0
+        # (controls sent, controls left out, table tokens) of the prompt being built
+        self._control_counts = (0, 0, 0)
+        # System prompts are the same on every call, so their token counts are kept
+        self._system_prompt_tokens = {}
+        self._task_system_prompt = None
         
         # Load API key and endpoint from environment variables
         self.api_key = os.getenv('AZURE_OPENAI_API_KEY')
@@ -21,12 +54,13 @@ class LLMController:
         self.client = None
 
         self.system_prompt_control_list = \
-          "The request will include a list of all controls on the screen, in the form of a JSON array.  Each control will have the following properties: " \
+          f"The request will include the controls on the screen as a table with a header line '{CONTROL_COLUMNS}' and one control per line, columns separated by '|': " \
           "  - 'id': A unique identifier for the control" \
           "  - 'type': The type of control, can ONLY be 'icon' or 'text'" \
-          "  - 'content': The content of the control" \
           "  - 'x': The x coordinate of the control" \
           "  - 'y': The y coordinate of the control" \
+          "  - 'content': The content of the control, shortened if it is long, empty if unknown" \
+          "If the screen has too many controls, the least useful ones (icons without content first) are left out and the table ends with a line saying how many." \
 
         self.system_prompt_actions_available = \
           "Action responses should be an action in the form of a JSON object with the following properties: " \
@@ -74,9 +108,125 @@ class LLMController:
         return [{"id": control["id"], 
                 "type": control["type"], 
                 "content": control["content"],
+                "interactivity": control.get("interactivity", False),
                 "x": int(control["bbox"][0] * 1920),
                 "y": int(control["bbox"][1] * 1080)} for control in control_list]
 
+    def count_tokens(self, text: str) -> int:
+        """Count the tokens text takes in a prompt.
+
+        Uses the model's tiktoken encoding; without tiktoken, or if the encoding
+        can't be loaded, the count is estimated from the length of the text.
+
+        Args:
+            text (str): Prompt text
+
+        Returns:
+            int: Number of tokens
+        """
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            if tiktoken is None:
+                print("tiktoken is not installed, estimating token counts")
+            else:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except Exception as e:
+                    print(f"Failed to load the tiktoken encoding for {self.model}, estimating token counts: {e}")
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def _count_system_tokens(self, system_prompt: str) -> int:
+        """count_tokens for a system prompt, counted once per distinct prompt"""
+        if system_prompt not in self._system_prompt_tokens:
+            self._system_prompt_tokens[system_prompt] = self.count_tokens(system_prompt)
+        return self._system_prompt_tokens[system_prompt]
+
+    def get_task_system_prompt(self) -> str:
+        """Build the system prompt for tasks and count its tokens.
+
+        Both are kept, so calling this before the first task (for example while
+        the VM reverts) takes building the prompt and loading the token encoding
+        off the task's critical path.
+
+        Returns:
+            str: The system prompt get_task_response sends
+        """
+        if self._task_system_prompt is None:
+            self._task_system_prompt = self.system_prompt_task + "\n" + self.system_prompt_control_list + "\n" + self.system_prompt_actions_available + "\n" + self.system_prompt_task_hints
+            self._count_system_tokens(self._task_system_prompt)
+        return self._task_system_prompt
+
+    @staticmethod
+    def _control_priority(control) -> int:
+        """Lower is kept first: controls that can be acted on and have content, then text, then icons without content"""
+        if not control["content"]:
+            return 2
+        return 0 if control["interactivity"] else 1
+
+    def _format_control(self, control) -> str:
+        content = " ".join(str(control["content"] or "").split()).replace("|", "/")
+        if len(content) > self.max_content_chars:
+            content = content[:self.max_content_chars - 3] + "..."
+        return f"{control['id']}|{control['type']}|{control['x']}|{control['y']}|{content}"
+
+    def _encode_controls(self, control_list, token_budget: int):
+        """Encode controls as a compact table that fits a token budget.
+
+        When the table doesn't fit, controls are dropped lowest priority first,
+        and in reverse screen order within a priority, so the same screen always
+        produces the same table. The controls that are kept stay in screen order.
+
+        Args:
+            control_list (list): Processed controls from _process_control_list
+            token_budget (int): Tokens the table may take
+
+        Returns:
+            tuple: (table text, number of controls in it, number left out)
+        """
+        rows = [self._format_control(control) for control in control_list]
+        row_tokens = [self.count_tokens(row + "\n") for row in rows]
+        budget = token_budget - self.count_tokens(CONTROL_COLUMNS + "\n")
+        if sum(row_tokens) <= budget:
+            keep = set(range(len(rows)))
+        else:
+            # Room for the line saying how many controls were left out
+            budget -= self.count_tokens(f"({len(rows)} more controls not shown)\n")
+            keep = set()
+            used = 0
+            for index in sorted(range(len(rows)), key=lambda i: (self._control_priority(control_list[i]), i)):
+                if used + row_tokens[index] > budget:
+                    break
+                keep.add(index)
+                used += row_tokens[index]
+        lines = [CONTROL_COLUMNS] + [row for index, row in enumerate(rows) if index in keep]
+        omitted = len(rows) - len(keep)
+        if omitted:
+            lines.append(f"({omitted} more controls not shown)")
+        return "\n".join(lines) + "\n", len(keep), omitted
+
+    def _build_control_section(self, system_prompt, context_prompt, control_list):
+        """Encode the controls within both the control budget and what's left of the context window"""
+        available = self.max_context_tokens - self.max_response_tokens - self._count_system_tokens(system_prompt) - self.count_tokens(context_prompt)
+        table, sent, omitted = self._encode_controls(self._process_control_list(control_list), min(self.max_control_tokens, available))
+        self._control_counts = (sent, omitted, self.count_tokens(table))
+        return table
+
+    def get_token_stats(self):
+        """Get the token counts of the last model call and totals over all calls
+
+        Returns:
+            dict: 'calls', 'prompt_tokens', 'completion_tokens', 'controls_omitted' totals and 'last_call'
+        """
+        return {
+            'calls': self.total_calls,
+            'prompt_tokens': self.total_prompt_tokens,
+            'completion_tokens': self.total_completion_tokens,
+            'controls_omitted': self.total_controls_omitted,
+            'last_call': self.last_call_tokens,
+        }
+
     def _call_model(self, system_prompt, context_prompt):
         """Call the OpenAI model with the given prompts.
         
@@ -88,9 +238,18 @@ class LLMController:
             str: The model's response
         """
         print("Calling the model with the following context: " + context_prompt)
+        controls_sent, controls_omitted, control_tokens = self._control_counts
+        self._control_counts = (0, 0, 0)
+        tokens = {
+            'system': self._count_system_tokens(system_prompt),
+            'context': self.count_tokens(context_prompt),
+            'controls': control_tokens,
+            'controls_sent': controls_sent,
+            'controls_omitted': controls_omitted,
+        }
 
         completion = self.client.chat.completions.create(
-            model="gpt-4o",
+            model=self.model,
             messages=[
                 {
                     "role": "system",
@@ -116,6 +275,17 @@ class LLMController:
         )
 
         response = completion.choices[0].message.content
+        # The service's own counts when it reports them, which include the message framing
+        usage = getattr(completion, 'usage', None)
+        tokens['prompt_tokens'] = usage.prompt_tokens if usage else tokens['system'] + tokens['context']
+        tokens['completion_tokens'] = usage.completion_tokens if usage else self.count_tokens(response or "")
+        self.last_call_tokens = tokens
+        self.total_calls += 1
+        self.total_prompt_tokens += tokens['prompt_tokens']
+        self.total_completion_tokens += tokens['completion_tokens']
+        self.total_controls_omitted += controls_omitted
+        print(f"Prompt tokens: {tokens['prompt_tokens']} (controls {control_tokens} for {controls_sent} controls, {controls_omitted} left out), "
+              f"completion tokens: {tokens['completion_tokens']}")
         print("Got response from the model:")
         print(response)
         return response
@@ -133,12 +303,11 @@ class LLMController:
         if not self.client:
             raise RuntimeError("Client not initialized. Call setup() first.")
 
-        control_json = self._process_control_list(control_list)
-
-        system_prompt = self.system_prompt_task + "\n" + self.system_prompt_control_list + "\n" + self.system_prompt_actions_available + "\n" + self.system_prompt_task_hints
+        system_prompt = self.get_task_system_prompt()
 
         context_prompt = "I'm trying to accomplish the following task: " + task_string + "\n"
-        context_prompt += "The controls on the screen are:\n" + "\n".join(str(control) for control in control_json) + "\n"
+        context_prompt += "The controls on the screen are:\n"
+        context_prompt += self._build_control_section(system_prompt, context_prompt, control_list)
 
         return self._call_model(system_prompt, context_prompt)
 
@@ -156,13 +325,13 @@ class LLMController:
         if not self.client:
             raise RuntimeError("Client not initialized. Call setup() first.")
 
-        control_json = self._process_control_list(control_list)
-
         system_prompt = self.system_prompt_action + "\n" + self.system_prompt_control_list + "\n" + self.system_prompt_actions_available
 
         context_prompt = "I need to perform this single action: " + action_string + "\n"
-        context_prompt += "The controls on the screen are:\n" + "\n".join(str(control) for control in control_json) + "\n"
-        context_prompt += "Please respond with the single action to take.  If you can't determine the action, respond with 'task_complete'."
+        closing = "Please respond with the single action to take.  If you can't determine the action, respond with 'task_complete'."
+        context_prompt += "The controls on the screen are:\n"
+        context_prompt += self._build_control_section(system_prompt, context_prompt + closing, control_list)
+        context_prompt += closing
 
         return self._call_model(system_prompt, context_prompt)
 
@@ -1,13 +1,31 @@
 print("Script starting...")
 from hyperv import HyperVConnection
+from app_catalog import APP_MAP
+from install_scheduler import RESULTS_DIR, InstallScheduler, MegaAppTesterBackend, format_summary
 from omniparser import Omniparser
-from image_viewer import ImageViewer
-from console_window import ConsoleWindow
-from vmconnect_capture import click_at_coordinates, send_text, press_key, open_run_dialog
+from omniparser_server import OmniparserClient, parse_address
+from image_viewer import ImageViewer, NullImageViewer
+from console_window import ConsoleWindow, StreamConsole
+from vmconnect_capture import click_at_coordinates, send_text, press_key, open_run_dialog, get_window_lookup_stats, get_foreground_stats
 from llmcontroller import LLMController
+from frame_pipeline import FramePipeline
+from frame_fingerprint import FrameChangeDetector
+from stage_timer import RollingStats
+import logging
+import os
 import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Callable, Optional, Tuple
+import numpy as np
+from PIL import Image
 from enum import Enum, auto
 
+logger = logging.getLogger(__name__)
+
+# Seconds the click marker stays on screen before the click is sent
+CLICK_MARKER_SECONDS = 0.5
+
 class MegaAppTester:
     class AppMode(Enum):
         UNINITIALIZED = auto()
@@ -16,23 +34,7 @@ class MegaAppTester:
         APP_INSTALL_TEST = auto()
 
     # Map of shortcut names to winget package IDs and friendly names
-    app_map = {
-        "vscode": {"winget_id": "Microsoft.VisualStudioCode", "shortcut_name": "Visual Studio Code"},
-        "chrome": {"winget_id": "Google.Chrome", "shortcut_name": "Google Chrome"},
-        "firefox": {"winget_id": "Mozilla.Firefox", "shortcut_name": "Mozilla Firefox"},
-        "notepad++": {"winget_id": "Notepad++.Notepad++", "shortcut_name": "Notepad++"},
-        "7zip": {"winget_id": "7zip.7zip", "shortcut_name": "7-Zip"},
-        "vlc": {"winget_id": "VideoLAN.VLC", "shortcut_name": "VLC Media Player"},
-        "git": {"winget_id": "Git.Git", "shortcut_name": "Git"},
-        "python": {"winget_id": "Python.Python.3.11", "shortcut_name": "Python 3.11"},
-        "nodejs": {"winget_id": "OpenJS.NodeJS", "shortcut_name": "Node.js"},
-        "steam": {"winget_id": "Valve.Steam", "shortcut_name": "Steam"},
-        "spotify": {"winget_id": "Spotify.Spotify", "shortcut_name": "Spotify"},
-        "discord": {"winget_id": "Discord.Discord", "shortcut_name": "Discord"},
-        "slack": {"winget_id": "SlackTechnologies.Slack", "shortcut_name": "Slack"},
-        "zoom": {"winget_id": "Zoom.Zoom", "shortcut_name": "Zoom"},
-        "obs": {"winget_id": "OBSProject.OBSStudio", "shortcut_name": "OBS Studio"}
-    }
+    app_map = APP_MAP
 
     def get_winget_id(self, app_name: str) -> str:
         """Get the winget package ID for a given app shortcut name.
@@ -58,15 +60,31 @@ class MegaAppTester:
         app_info = self.app_map.get(app_name.lower())
         return app_info["shortcut_name"] if app_info else app_name
 
-    def __init__(self):
+    def __init__(self, frame_change_tolerance: float = 0.0):
+        """Create the app.
+
+        Args:
+            frame_change_tolerance (float): Fraction of pixels that may change between
+                frames before a frame is parsed again instead of reusing the last result
+        """
+        self.frame_change_tolerance = frame_change_tolerance
         self.current_mode = self.AppMode.UNINITIALIZED
         self.console = None
         self.viewer = None
         self.connection = None
         self.parser = None
+        self.pipeline = None
         self.parsed_content = None
         self.screenshot_width = 0
         self.screenshot_height = 0
+        # Most recent frame handled by the display stage, the reference for wait_for_change
+        self.last_frame = None
+        # Whether the last do_task ended with the LLM reporting task_complete
+        self.task_completed = False
+        # (app_name, winget_id, shortcut_name, installer task) resolved by prepare_install
+        self._prepared_install = None
+        # Rolling per-stage timings of displayed frames, shown by the stats command
+        self.timing_stats = RollingStats()
         self.llm_controller = LLMController()
         self.llm_controller.setup()
 
@@ -76,19 +94,31 @@ class MegaAppTester:
         self.viewer = viewer
         self.console = console
         self.parser = parser
+        self.pipeline = FramePipeline(
+            capture_fn=connection.get_frame,
+            parse_fn=parser.parse,
+            change_detector=FrameChangeDetector(tolerance=self.frame_change_tolerance),
+            stage_timings_fn=lambda: parser.last_timings,
+        )
         self.console.set_command_handler(self.handle_command)
         self.show_mode_selection()
 
     def run_loop(self, duration_seconds=None):
         """Run the main processing loop for a specified duration.
+
+        Capture and parsing run continuously on the frame pipeline's background
+        threads; this loop is the display stage, keeping both windows responsive
+        and picking up the newest parse result whenever one is ready.
         
         Args:
-            duration_seconds: Optional float, number of seconds to run. If None, runs indefinitely.
+            duration_seconds: Optional float, number of seconds to run. If None, runs indefinitely,
+                or until a headless console has run all of its commands.
             
         Returns:
             bool: True if loop completed normally, False if interrupted
         """
         start_time = time.perf_counter()
+        self.pipeline.start()
         
         try:
             while True:
@@ -96,43 +126,252 @@ class MegaAppTester:
                 if duration_seconds is not None:
                     if time.perf_counter() - start_time >= duration_seconds:
                         return True
+                elif getattr(self.console, 'finished', False):
+                    return True
                 
-                # Update both windows
-                self.viewer.update()
-                self.console.update()
-                
-                # Get new screenshot and time it
-                start_time_screenshot = time.perf_counter()
-                screenshot = self.connection.get_screenshot()
-                screenshot_time = (time.perf_counter() - start_time_screenshot) * 1000
-                
-                if screenshot:
-                    # Store screenshot dimensions
-                    self.screenshot_width, self.screenshot_height = screenshot.size
-                    
-                    # Parse the screenshot and time it
-                    start_time_parse = time.perf_counter()
-                    try:
-                        labeled_img, parsed_content = self.parser.parse(screenshot)
-                        parse_time = (time.perf_counter() - start_time_parse) * 1000
-                        
-                        # Display the labeled image instead of raw screenshot
-                        self.viewer.update_image(labeled_img)
-                        # Add id field to each element based on index
-                        for i, element in enumerate(parsed_content):
-                            element["id"] = i
-                        self.parsed_content = parsed_content
-                    except Exception as e:
-                        error_msg = f"Failed to parse screenshot: {str(e)}"
-                        print(error_msg)
-                        # If parsing fails, show raw screenshot as fallback
-                        self.viewer.update_image(screenshot)
+                self._pump()
                         
         except KeyboardInterrupt:
             return False
             
         return True
 
+    def _pump(self) -> Optional[dict]:
+        """Run one iteration of the main loop and return the parse result it handled, if any"""
+        # Update both windows
+        self.viewer.update()
+        self.console.update()
+        
+        # Wait briefly for the next parse result so the windows stay responsive
+        result = self.pipeline.get_result(timeout=0.01)
+        if result:
+            self.handle_parse_result(result)
+        return result
+
+    def wait_until(self, condition: Callable[[Optional[dict]], bool], timeout: float, name: str) -> bool:
+        """Run the main loop until a condition holds or the timeout passes.
+
+        The condition is checked after every loop iteration with the parse
+        result of a frame captured after the wait started (or None if the
+        iteration had no such result). The time the wait took is logged and
+        recorded in the timing statistics as wait.<name>.
+
+        Args:
+            condition: Callable taking a parse result, or None, and returning True once the wait is over
+            timeout (float): Seconds to wait at most
+            name (str): Name of the wait for the log and statistics
+
+        Returns:
+            bool: True if the condition was met, False on timeout or interrupt
+        """
+        start_time = time.perf_counter()
+        self.pipeline.start()
+        satisfied = False
+        try:
+            while not satisfied and time.perf_counter() - start_time < timeout:
+                result = self._pump()
+                if result is not None and (result["captured_at"] < start_time or result["error"] is not None):
+                    result = None
+                satisfied = condition(result)
+        except KeyboardInterrupt:
+            pass
+
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.timing_stats.add({f"wait.{name}": elapsed_ms})
+        logger.info(f"Wait {name} {'finished' if satisfied else 'timed out'} after {elapsed_ms:.0f}ms")
+        return satisfied
+
+    def wait_until_stable(self, stable_ms: float = 1000, timeout: float = 10.0) -> bool:
+        """Wait until no new frame has changed the screen for stable_ms milliseconds
+
+        Stability is measured in capture time: the wait only ends on an unchanged
+        (reused) frame captured at least stable_ms after the last changed frame.
+        While a changed frame is still being parsed no results arrive, and that
+        gap doesn't count as the screen being stable.
+
+        Args:
+            stable_ms (float): How long the screen has to stay unchanged
+            timeout (float): Seconds to wait at most
+
+        Returns:
+            bool: True if the screen settled before the timeout
+        """
+        state = {"last_change": time.perf_counter()}
+
+        def is_stable(result):
+            if result is None:
+                return False
+            if not result["reused"]:
+                state["last_change"] = result["captured_at"]
+                return False
+            return (result["captured_at"] - state["last_change"]) * 1000 >= stable_ms
+
+        return self.wait_until(is_stable, timeout, "stable")
+
+    def wait_for_text(self, text: str, timeout: float = 10.0, region: Optional[Tuple[float, float, float, float]] = None) -> bool:
+        """Wait until a parsed element's content contains text (case-insensitive)
+
+        Args:
+            text (str): Text to look for
+            timeout (float): Seconds to wait at most
+            region (tuple): (x1, y1, x2, y2) in 0-1 screen ratios the element's center has
+                to be in, or None for anywhere on the screen
+
+        Returns:
+            bool: True if an element with the text appeared before the timeout
+        """
+        text = text.lower()
+
+        def matches(element):
+            if text not in (element.get("content") or "").lower():
+                return False
+            if region is None:
+                return True
+            x1, y1, x2, y2 = element["bbox"]
+            return region[0] <= (x1 + x2) / 2 <= region[2] and region[1] <= (y1 + y2) / 2 <= region[3]
+
+        def has_text(result):
+            return result is not None and any(matches(element) for element in result["parsed_content"] or [])
+
+        return self.wait_until(has_text, timeout, "text")
+
+    def wait_for_change(self, region: Optional[Tuple[float, float, float, float]] = None, timeout: float = 10.0,
+                        min_changed: float = 0.001, pixel_threshold: int = 16) -> bool:
+        """Wait until part of the screen differs from the last frame seen before the wait
+
+        Args:
+            region (tuple): (x1, y1, x2, y2) in 0-1 screen ratios to watch, or None for the whole screen
+            timeout (float): Seconds to wait at most
+            min_changed (float): Fraction of the region's pixels that have to change
+            pixel_threshold (int): Per-channel difference a pixel needs to count as changed
+
+        Returns:
+            bool: True if the region changed before the timeout
+        """
+        reference = {"frame": self.last_frame}
+
+        def crop(frame):
+            if region is None:
+                return frame
+            h, w = frame.shape[:2]
+            x1, y1, x2, y2 = region
+            return frame[int(y1 * h):max(int(y2 * h), int(y1 * h) + 1), int(x1 * w):max(int(x2 * w), int(x1 * w) + 1)]
+
+        def has_changed(result):
+            if result is None:
+                return False
+            if reference["frame"] is None:
+                reference["frame"] = result["frame"]
+                return False
+            before, after = crop(reference["frame"]), crop(result["frame"])
+            if before.shape != after.shape:
+                return True
+            changed = (np.abs(after.astype(np.int16) - before.astype(np.int16)) > pixel_threshold).any(axis=-1)
+            return changed.mean() >= min_changed
+
+        return self.wait_until(has_changed, timeout, "change")
+
+    def wait_for_revert(self, revert: Future) -> dict:
+        """Keep the windows updating until an async revert finishes.
+
+        Args:
+            revert (Future): Future returned by HyperVConnection.revert_async
+
+        Returns:
+            dict: The revert's result, with 'ok', 'error' and its timings in seconds
+        """
+        while not revert.done():
+            self._pump()
+        result = revert.result()
+        if result['ok']:
+            # The desktop is up; let the parsed view catch up with it
+            self.wait_until_stable(stable_ms=1000, timeout=30.0)
+        return result
+
+    def handle_parse_result(self, result: dict):
+        """Display a parse result from the frame pipeline and publish its parsed content.
+        
+        Args:
+            result (dict): A result returned by FramePipeline.get_result()
+        """
+        frame = result["frame"]
+        self.last_frame = frame
+        # Store screenshot dimensions
+        self.screenshot_height, self.screenshot_width = frame.shape[:2]
+        self.pipeline.mark_displayed(result)
+
+        if result["error"] is not None:
+            error_msg = f"Failed to parse screenshot: {str(result['error'])}"
+            logger.warning(error_msg)
+            # If parsing fails, show raw screenshot as fallback
+            self.viewer.update_image(Image.fromarray(frame))
+            return
+
+        # Unchanged frames reuse the parse result already published. If the fresh result
+        # was displaced from the latest-only queue before it was handled, a reused result
+        # is the first to carry it, so publish it from that one instead.
+        if result["reused"] and result["parsed_content"] is self.parsed_content:
+            return
+
+        # Display the labeled image instead of raw screenshot; headless runs don't render one
+        display_start = time.perf_counter()
+        if result["labeled_img"] is not None:
+            self.viewer.update_image(result["labeled_img"])
+        if not result["reused"]:
+            self.timing_stats.add({
+                "capture": result["capture_ms"],
+                "parse": result["parse_ms"],
+                **{f"parse.{stage}": ms for stage, ms in result["stage_timings"].items() if stage != "total"},
+                "display": (time.perf_counter() - display_start) * 1000,
+                "frame_age": self.pipeline.last_frame_age_ms,
+            })
+        # Add id field to each element based on index
+        parsed_content = result["parsed_content"]
+        for i, element in enumerate(parsed_content):
+            element["id"] = i
+        self.parsed_content = parsed_content
+
+    def shutdown(self):
+        """Stop the frame pipeline and report its per-stage statistics"""
+        if self.pipeline:
+            self.pipeline.stop()
+            for stage, stats in self.pipeline.get_stats().items():
+                logger.info(f"{stage} stage: {stats}")
+            for line in self.timing_stats.format_table():
+                logger.info(line)
+        logger.info(f"VMConnect window lookups: {get_window_lookup_stats()}")
+        logger.info(f"VMConnect foreground activations: {get_foreground_stats()}")
+        logger.info(f"LLM tokens: {self.llm_controller.get_token_stats()}")
+        if self.connection:
+            logger.info(f"PowerShell session: {self.connection.get_session_stats()}")
+            logger.info(f"Reverts: {self.connection.get_revert_stats()}")
+
+    def show_stats(self):
+        """Show rolling per-stage timings and pipeline counters in the console"""
+        for line in self.timing_stats.format_table():
+            self.console.write_line(line, system=True)
+        if self.pipeline:
+            pipeline_stats = self.pipeline.get_stats()
+            self.console.write_line(f"Captured {pipeline_stats['capture']['frames']} frames, parsed {pipeline_stats['parse']['frames']}, "
+                                    f"displayed {pipeline_stats['display']['frames']}, dropped {pipeline_stats['capture']['dropped'] + pipeline_stats['parse']['dropped']}", system=True)
+        lookup_stats = get_window_lookup_stats()
+        self.console.write_line(f"Window lookups: {lookup_stats['lookups']} ({lookup_stats['avg_lookup_ms']:.1f} ms avg), "
+                                f"cache hits {lookup_stats['cache_hits']}, invalidations {lookup_stats['invalidations']}", system=True)
+        foreground_stats = get_foreground_stats()
+        self.console.write_line(f"Foreground activations: {foreground_stats['activations']}, skipped {foreground_stats['skipped']} "
+                                f"(saved {foreground_stats['saved_ms'] / 1000:.1f}s)", system=True)
+        token_stats = self.llm_controller.get_token_stats()
+        self.console.write_line(f"LLM calls: {token_stats['calls']}, prompt tokens {token_stats['prompt_tokens']}, "
+                                f"completion tokens {token_stats['completion_tokens']}, controls left out {token_stats['controls_omitted']}", system=True)
+        if self.connection:
+            session_stats = self.connection.get_session_stats()
+            self.console.write_line(f"PowerShell commands: {session_stats['commands']} ({session_stats['avg_command_ms']:.1f} ms avg), "
+                                    f"starts {session_stats['starts']}, timeouts {session_stats['timeouts']}", system=True)
+            revert_stats = self.connection.get_revert_stats()
+            if 'time_to_ready' in revert_stats:
+                self.console.write_line(f"Reverts: {revert_stats['time_to_ready']['count']}, restore p50 {revert_stats['restore']['p50'] / 1000:.1f}s, "
+                                        f"ready p50 {revert_stats['time_to_ready']['p50'] / 1000:.1f}s, failures {revert_stats['failures']}", system=True)
+
     def handle_mode_selection(self, cmd: str):
         """Handle mode selection commands when in UNINITIALIZED state"""
         if cmd == "1":
@@ -156,7 +395,7 @@ class MegaAppTester:
         while True:
             action = self.do_task(cmd)
             self.console.write_line(f"Action: {action}", system=True)
-            self.run_loop(1.0)  # Run the loop for 1 second to allow the action to be performed
+            self.wait_until_stable(stable_ms=500, timeout=5.0)  # Let the last action take effect
             return
 
     def handle_single_action_command(self, cmd: str):
@@ -194,20 +433,24 @@ class MegaAppTester:
             cmd (str): The command/task to execute
         """
         action_count = 0
+        self.task_completed = False
         while True:
             action_str = self.llm_controller.get_task_response(task, self.parsed_content)
             if "task_complete" in action_str:
                 self.console.write_line("Task Complete from LLM", system=True)
+                self.task_completed = True
                 return action_count
             if "task_wait" in action_str:
                 action_count += 1
                 self.console.write_line("Waiting...", system=True)
-                self.run_loop(2.0)  # Run the loop for 1 second to allow time to pass
+                # Give the screen a couple of seconds to move on; only if it does, let it settle
+                if self.wait_for_change(timeout=2.0):
+                    self.wait_until_stable(stable_ms=1000, timeout=30.0)
                 continue
             action_count += 1
             action = self.process_action_response(action_str)
             self.console.write_line(f"Action: {action}", system=True)
-            self.run_loop(1.0)  # Run the loop for 1 second to allow the action to be performed
+            self.wait_until_stable(stable_ms=750, timeout=10.0)  # Let the action take effect
             if action_count > 4:
 
                 self.console.write_line(f"Too many actions {action_count} complete", system=True)
@@ -303,8 +546,9 @@ class MegaAppTester:
         scaled_x = int(center_x / 1.5)
         scaled_y = int(center_y / 1.5)
 
-        # Add small delay before clicking to allow circle to be visible
-        time.sleep(3)
+        # Keep the windows updating briefly so the circle is visible before clicking
+        if self.viewer.root is not None:
+            self.run_loop(CLICK_MARKER_SECONDS)
 
         # Click at the scaled coordinates
         click_at_coordinates(scaled_x, scaled_y)
@@ -315,57 +559,150 @@ class MegaAppTester:
         # Check for revert command
         if app_name.lower() == "revert":
             self.console.write_line("Reverting VM to previous snapshot...", system=True)
-            self.connection.apply_checkpoint("revert")
-            self.console.write_line("VM reverted successfully", system=True)
+            result = self.wait_for_revert(self.connection.revert_async("revert"))
+            if result['ok']:
+                self.console.write_line(f"VM reverted successfully, restored in {result['restore']:.1f}s, ready after {result['ready']:.1f}s", system=True)
+            else:
+                self.console.write_line(f"Revert failed: {result['error']}", system=True)
             return
             
-        winget_id = self.get_winget_id(app_name)
+        if app_name.lower().startswith("schedule"):
+            self.run_install_schedule(app_name[len("schedule"):])
+            return
+
+        self.install_app(app_name)
+
+    def get_installer_task(self, shortcut_name: str) -> str:
+        """Task given to the LLM to drive the installer of the app with this shortcut name"""
+        return "Run through the application installer by clicking next, yes, Ok, or whatever is appropriate to move to the next step." \
+            "Do not click 'No' or 'Cancel' or just hit the enter key.  If you do, the installer will exit and the task will fail." \
+            "If it looks like the installer is working and we should wait, respond with 'task_wait'." \
+            "When it looks like the installation is complete, respond with 'task_complete'.  You can tell if this installation is completed" \
+            f"by looking for the {shortcut_name} icon on the desktop, or not seeing any more installer steps."
+
+    def prepare_install(self, app_name: str):
+        """Do the parts of install_app that don't need the VM, such as while it reverts.
+
+        Resolves the app's package ID and shortcut name, builds the LLM's system
+        prompt and makes sure the parser is warm. The next install_app call for
+        the same app uses what was resolved here.
+
+        Args:
+            app_name (str): Shortcut name from app_map, or a winget package ID
+        """
         shortcut_name = self.get_app_shortcut_name(app_name)
+        self._prepared_install = (app_name, self.get_winget_id(app_name), shortcut_name, self.get_installer_task(shortcut_name))
+        self.llm_controller.get_task_system_prompt()
+        self.warm_parser()
+
+    def warm_parser(self):
+        """Make sure the first parse after a revert doesn't pay for lazy initialization"""
+        if isinstance(self.parser, OmniparserClient):
+            # The server warms up when it starts; check it is still reachable
+            self.parser.ping()
+            return
+        if 'warmup' in self.parser.load_timings:
+            return
+        # The warm-up parse swaps the parser's caches out, so nothing may parse alongside it
+        running = self.pipeline.is_running()
+        self.pipeline.stop()
+        try:
+            self.parser.warmup()
+        finally:
+            if running:
+                self.pipeline.start()
+
+    def install_app(self, app_name: str, phase: Optional[Callable] = None) -> bool:
+        """Install an app with winget, drive its installer with the LLM and launch it.
+
+        Args:
+            app_name (str): Shortcut name from app_map, or a winget package ID
+            phase: Optional phase(name, *resources) context manager factory timing each
+                step, such as InstallAttempt.phase; by default the steps aren't timed
+
+        Returns:
+            bool: True if the LLM reported the installer as complete
+        """
+        if phase is None:
+            phase = lambda name, *resources: nullcontext()
+        prepared, self._prepared_install = self._prepared_install, None
+        if prepared is not None and prepared[0] == app_name:
+            _, winget_id, shortcut_name, installer_task = prepared
+        else:
+            winget_id = self.get_winget_id(app_name)
+            shortcut_name = self.get_app_shortcut_name(app_name)
+            installer_task = self.get_installer_task(shortcut_name)
         
         if winget_id != app_name:
             self.console.write_line(f"Installing {shortcut_name} using package ID: {winget_id}", system=True)
         else:
             self.console.write_line(f"Installing package: {app_name}", system=True)
             
-        self.console.write_line("Opening Run Dialog", system=True)
-        open_run_dialog()
-        self.run_loop(1.0)
-        send_text("cmd")
-        press_key("enter")
-        self.console.write_line("Kicking off winget install", system=True)
-        send_text("winget install --accept-source-agreements " + winget_id)
-        press_key("enter")
-        self.run_loop(10.0)
-        self.console.write_line("AI Driving through installer", system=True)
-        self.do_task(f"Run through the application installer by clicking next, yes, Ok, or whatever is appropriate to move to the next step." \
-            "Do not click 'No' or 'Cancel' or just hit the enter key.  If you do, the installer will exit and the task will fail." \
-            "If it looks like the installer is working and we should wait, respond with 'task_wait'." \
-            "When it looks like the installation is complete, respond with 'task_complete'.  You can tell if this installation is completed" \
-            f"by looking for the {shortcut_name} icon on the desktop, or not seeing any more installer steps.")
-        self.console.write_line("Installation complete, launching application", system=True)
-        press_key("windows")
-        send_text(shortcut_name)
-        press_key("enter")
-        self.run_loop(1.0)
+        with phase('install', 'parser'):
+            self.console.write_line("Opening Run Dialog", system=True)
+            open_run_dialog()
+            # The Run dialog's prompt, which opens above the Start button in the bottom left corner
+            if not self.wait_for_text("Type the name of a program", timeout=5.0, region=(0.0, 0.5, 0.5, 1.0)):
+                self.console.write_line("Run dialog not detected, continuing", system=True)
+            send_text("cmd")
+            press_key("enter")
+            self.wait_until_stable(stable_ms=500, timeout=10.0)
+            self.console.write_line("Kicking off winget install", system=True)
+            send_text("winget install --accept-source-agreements " + winget_id)
+            press_key("enter")
+            # winget downloads and then starts the installer; wait until that has stopped changing the screen
+            self.wait_for_change(timeout=15.0)
+            self.wait_until_stable(stable_ms=2000, timeout=120.0)
+        with phase('drive_installer', 'parser', 'llm'):
+            self.console.write_line("AI Driving through installer", system=True)
+            self.do_task(installer_task)
+        installed = self.task_completed
+        with phase('launch', 'parser'):
+            self.console.write_line("Installation complete, launching application", system=True)
+            press_key("windows")
+            self.wait_until_stable(stable_ms=500, timeout=5.0)
+            send_text(shortcut_name)
+            press_key("enter")
+            self.wait_until_stable(stable_ms=1000, timeout=15.0)
         self.console.write_line("Test complete", system=True)
+        return installed
+
+    def run_install_schedule(self, apps: str):
+        """Run install tests for several apps on this VM, reverting between them.
+
+        Args:
+            apps (str): Comma or space separated app names, or empty/'all' for every app in app_map
+        """
+        app_names = [name for name in apps.replace(",", " ").split() if name.lower() != "all"] or list(self.app_map)
+        results_path = os.path.join(RESULTS_DIR, f"install_results_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+        self.console.write_line(f"Scheduling {len(app_names)} install tests, results in {results_path}", system=True)
+        scheduler = InstallScheduler([MegaAppTesterBackend(self)], self.app_map, results_path=results_path)
+        summary = scheduler.run(app_names)
+        for line in format_summary(summary):
+            self.console.write_line(line, system=True)
 
     def show_perform_task_help(self):
         """Show available commands for Perform Task mode"""
         self.console.write_line("Perform Task Commands:", system=True)
         self.console.write_line("  help - Show this help message", system=True)
+        self.console.write_line("  stats - Show per-stage timings", system=True)
         self.console.write_line("  exit - Return to mode selection", system=True)
 
     def show_app_install_help(self):
         """Show available commands for App Install Test mode"""
         self.console.write_line("App Install Test Commands:", system=True)
         self.console.write_line("  help - Show this help message", system=True)
+        self.console.write_line("  stats - Show per-stage timings", system=True)
         self.console.write_line("  exit - Return to mode selection", system=True)
+        self.console.write_line("  revert - Revert the VM to the 'revert' checkpoint", system=True)
+        self.console.write_line("  schedule [apps|all] - Install each app in turn, reverting between them, and write the results to a JSONL file", system=True)
         self.console.write_line("Any other text will be interpreted as an app to install (eg. Chrome)", system=True)
 
     def show_single_action_help(self):
         """Show available commands for Single Action mode"""
         self.console.write_line("Single Action Commands:", system=True)
         self.console.write_line("  help - Show this help message", system=True)
+        self.console.write_line("  stats - Show per-stage timings", system=True)
         self.console.write_line("  exit - Return to mode selection", system=True)
         self.console.write_line("Any other text will be interpreted as a single action to perform", system=True)
 
@@ -378,6 +715,10 @@ class MegaAppTester:
             self.show_mode_selection()
             return
 
+        if cmd.lower() == "stats":
+            self.show_stats()
+            return
+
         if self.current_mode == self.AppMode.UNINITIALIZED:
             self.handle_mode_selection(cmd)
         elif self.current_mode == self.AppMode.PERFORM_TASK:
@@ -394,38 +735,61 @@ class MegaAppTester:
         self.console.write_line("2) Perform Task", system=True)
         self.console.write_line("3) App Install Test", system=True)
 
-def main(vm_name: str):
-    """Main entrypoint that connects to and interacts with a Hyper-V VM"""
-    print(f"Attempting to connect to VM: {vm_name}")
+def main(vm_name: str, parser_server: str = None, headless: bool = False, commands: str = None):
+    """Main entrypoint that connects to and interacts with a Hyper-V VM
+
+    Args:
+        vm_name (str): Name of the VM to connect to
+        parser_server (str): Optional host:port of a running omniparser_server to parse
+            on instead of loading the models in this process
+        headless (bool): Run without the viewer and console windows, reading commands
+            from a file or stdin and skipping labeled image rendering
+        commands (str): File of commands to run when headless, defaults to stdin
+    """
+    logger.info(f"Attempting to connect to VM: {vm_name}")
 
     connection = HyperVConnection(vm_name)
     if not connection.connect():
-        print(f"Failed to connect to VM '{vm_name}'")
+        logger.error(f"Failed to connect to VM '{vm_name}'")
         return
 
-    print("Successfully connected to VM!")
+    logger.info("Successfully connected to VM!")
 
     # create the parser that we'll use during operation
     config = {
         'som_model_path': 'weights/icon_detect/model.pt',
         'caption_model_name': 'florence2',
         'caption_model_path': 'weights/icon_caption_florence',
-        'BOX_TRESHOLD': 0.05
+        'BOX_TRESHOLD': 0.05,
+        'incremental': True,
+        'caption_cache_path': 'weights/caption_cache.json',
+        'ocr_cache_path': 'weights/ocr_cache.json',
+        'warmup': True,
+        # Nobody looks at the labeled image when headless
+        'render_labeled_img': not headless
     }
     start_time = time.perf_counter()
-    parser = Omniparser(config)
+    if parser_server:
+        parser = OmniparserClient(parse_address(parser_server), render=not headless)
+        logger.info(f"Connected to parser server at {parser_server}")
+    else:
+        parser = Omniparser(config)
     parse_time = (time.perf_counter() - start_time) * 1000
-    print(f"Loading OmniParser took {parse_time:.0f}ms")
+    logger.info(f"Loading OmniParser took {parse_time:.0f}ms")
 
-    # Create image viewer window, this will display our view of the parsed image
-    viewer = ImageViewer(window_title=f"VM View: {vm_name}")
+    if headless:
+        viewer = NullImageViewer()
+        console = StreamConsole(commands)
+    else:
+        # Create image viewer window, this will display our view of the parsed image
+        viewer = ImageViewer(window_title=f"VM View: {vm_name}")
 
-    # Create console window for command input/output
-    console = ConsoleWindow(window_title=f"VM Console: {vm_name}")
+        # Create console window for command input/output
+        console = ConsoleWindow(window_title=f"VM Console: {vm_name}")
 
     # Set up click handler to tunnel clicks to VM
     def handle_click(x: int, y: int):
-        print(f"Clicking at ({x}, {y})")
+        logger.debug(f"Clicking at ({x}, {y})")
         click_at_coordinates(x, y)
         console.write_line(f"Clicked at ({x}, {y})", system=True)
     
@@ -438,12 +802,14 @@ def main(vm_name: str):
     start_time = time.perf_counter()
     screenshot = connection.get_screenshot()
     screenshot_time = (time.perf_counter() - start_time) * 1000
+    logger.info(f"First screenshot took {screenshot_time:.0f}ms")
 
     # Resize viewer window to match screenshot size
-    width, height = screenshot.size
-    width = int(width / 1.5)
-    height = int(height / 1.5)
-    viewer.root.geometry(f"{width}x{height}")
+    if not headless:
+        width, height = screenshot.size
+        width = int(width / 1.5)
+        height = int(height / 1.5)
+        viewer.root.geometry(f"{width}x{height}")
 
     # Initialize the app with all components
     app.initialize(connection, viewer, console, parser)
@@ -452,17 +818,25 @@ def main(vm_name: str):
         # Run the main loop indefinitely
         app.run_loop()
     except KeyboardInterrupt:
-        print("\nClosing windows...")
+        logger.info("Closing windows...")
     finally:
+        app.shutdown()
+        parser.close()
         viewer.close()
         console.close()
+        connection.close()
     
     return connection
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 2:
-        print("Usage: script.py <vm_name>")
-        sys.exit(1)
-    
-    main(sys.argv[1])
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Drive a Hyper-V VM with OmniParser and an LLM")
+    arg_parser.add_argument('vm_name', help='Name of the VM to connect to')
+    arg_parser.add_argument('--parser-server', nargs='?', const='127.0.0.1:6010', help='Parse on a running omniparser_server (host:port) instead of loading the models here')
+    arg_parser.add_argument('--headless', action='store_true', help='Run without the viewer and console windows, for unattended runs')
+    arg_parser.add_argument('--commands', help='With --headless, file of console commands to run (one per line); defaults to stdin')
+    arg_parser.add_argument('--log-level', default='INFO', help='DEBUG, INFO, WARNING or ERROR; per-frame parse details are logged at DEBUG')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    main(args.vm_name, args.parser_server, args.headless, args.commands)
@@ -1,36 +1,419 @@
-from utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box
+from utils import get_parsed_elements_batch, get_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box, get_easyocr_reader, get_paddle_ocr, make_synthetic_screen
+from parse_cache import CaptionCache, OcrCache
+from stage_timer import StageTimer
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
 import torch
+import numpy as np
 from PIL import Image
 import io
 import base64
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Order of elements in parsed_content: OCR text, icons labeled by OCR text, captioned icons
+SOURCE_ORDER = {'box_ocr_content_ocr': 0, 'box_yolo_content_ocr': 1, 'box_yolo_content_yolo': 2}
+
+class IncrementalState(object):
+    """The previous frame and its elements that incremental parsing diffs against.
+
+    Omniparser keeps one of these for its own callers; a caller that shares the
+    parser with others (such as a client of the parser server) passes its own
+    instance to parse() so unrelated frame streams don't invalidate each other.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the previous frame so the next parse is a full parse"""
+        self.last_frame = None
+        self.last_elements = None
+        self.last_labeled_img = None
+        self.full_parse_count = 0
+        self.incremental_parse_count = 0
+        self.last_dirty_fraction = 1.0
+
+    def get_stats(self) -> Dict:
+        """Get full/incremental parse counters"""
+        return {
+            'full_parses': self.full_parse_count,
+            'incremental_parses': self.incremental_parse_count,
+            'last_dirty_fraction': self.last_dirty_fraction,
+        }
+
 
 class Omniparser(object):
     def __init__(self, config: Dict):
         self.config = config
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f"\nCUDA {'is' if torch.cuda.is_available() else 'is not'} available")
+        logger.info(f"CUDA {'is' if torch.cuda.is_available() else 'is not'} available")
         if torch.cuda.is_available():
-            print(f"Using GPU: {torch.cuda.get_device_name()}")
+            logger.info(f"Using GPU: {torch.cuda.get_device_name()}")
         else:
-            print("Using CPU for inference")
+            logger.info("Using CPU for inference")
+
+        self.use_paddleocr = config.get('use_paddleocr', False)
+        self.load_timings = {}
+        self._load_models(device)
+        self.caption_cache = CaptionCache(max_bytes=config.get('caption_cache_bytes', 16 * 1024 * 1024), path=config.get('caption_cache_path'))
+        self.ocr_cache = OcrCache(max_bytes=config.get('ocr_cache_bytes', 16 * 1024 * 1024), path=config.get('ocr_cache_path'))
+
+        # Incremental parsing only re-parses the tiles that changed since the last frame
+        self.incremental = config.get('incremental', False)
+        self.tile_size = config.get('incremental_tile_size', 160)
+        self.region_margin = config.get('incremental_margin', 16)
+        self.max_dirty_fraction = config.get('incremental_max_dirty_fraction', 0.5)
+        self.incremental_state = IncrementalState()
+        # Headless runs have nobody looking at the labeled image, so they skip drawing it
+        self.render_labeled_img = config.get('render_labeled_img', True)
+        # Per-stage milliseconds of the most recent parse or parse_batch call
+        self.last_timings = {}
+
+        if config.get('warmup', False):
+            self.warmup()
+        logger.info('Omniparser initialized')
+
+    def _load_models(self, device: str):
+        """Load the icon detector, caption model and OCR engine concurrently.
+
+        The models are independent and loading is dominated by file I/O and
+        native code that releases the GIL, so loading them in parallel brings
+        startup close to the slowest single model.
+        """
+        def timed(name, load_fn, *args, **kwargs):
+            start = time.perf_counter()
+            result = load_fn(*args, **kwargs)
+            self.load_timings[name] = time.perf_counter() - start
+            return result
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='model-load') as pool:
+            som_future = pool.submit(timed, 'som_model', get_yolo_model, model_path=self.config['som_model_path'])
+            caption_future = pool.submit(timed, 'caption_model', get_caption_model_processor, model_name=self.config['caption_model_name'], model_name_or_path=self.config['caption_model_path'], device=device)
+            ocr_future = pool.submit(timed, 'ocr', get_paddle_ocr if self.use_paddleocr else get_easyocr_reader)
+            self.som_model = som_future.result()
+            self.caption_model_processor = caption_future.result()
+            ocr_future.result()
+        self.load_timings['total'] = time.perf_counter() - start
+
+        for name, seconds in self.load_timings.items():
+            logger.info(f"Loaded {name} in {seconds:.2f}s")
+
+    def warmup(self):
+        """Run one parse on a synthetic frame so the first real parse does not pay for lazy initialization"""
+        start = time.perf_counter()
+        # Parse without the caches so the synthetic screen's captions and text never reach the
+        # persisted cache files or the hit/miss counters
+        caption_cache, ocr_cache = self.caption_cache, self.ocr_cache
+        self.caption_cache = self.ocr_cache = None
+        try:
+            self.parse(make_synthetic_screen())
+        finally:
+            self.caption_cache, self.ocr_cache = caption_cache, ocr_cache
+        # Don't let the synthetic frame act as the previous frame for incremental parsing
+        self.reset_incremental_state()
+        self.load_timings['warmup'] = time.perf_counter() - start
+        logger.info(f"Warm-up parse took {self.load_timings['warmup']:.2f}s")
 
-        self.som_model = get_yolo_model(model_path=config['som_model_path'])
-        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device)
-        print('Omniparser initialized!!!')
+    def close(self):
+        """Persist caches that have a file configured and report their hit rates"""
+        self.caption_cache.save()
+        self.ocr_cache.save()
+        for name, stats in self.get_cache_stats().items():
+            logger.info(f"{name} cache: {stats}")
 
-    def parse(self, image: Image.Image):
-        print('image size:', image.size)
-        
+    def get_cache_stats(self) -> Dict:
+        """Get hit/miss counters for the caption and OCR caches"""
+        return {
+            'caption': self.caption_cache.get_stats(),
+            'ocr': self.ocr_cache.get_stats(),
+        }
+
+    def reset_incremental_state(self):
+        """Forget the previous frame so the next parse is a full parse"""
+        self.incremental_state.reset()
+
+    def _get_draw_bbox_config(self, image: Image.Image) -> Dict:
         box_overlay_ratio = max(image.size) / 3200
-        draw_bbox_config = {
+        return {
             'text_scale': 0.8 * box_overlay_ratio,
             'text_thickness': max(int(2 * box_overlay_ratio), 1),
             'text_padding': max(int(3 * box_overlay_ratio), 1),
             'thickness': max(int(3 * box_overlay_ratio), 1),
         }
 
-        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
-        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128)
+    def _parse_elements_batch(self, images: List[Image.Image], timer: StageTimer) -> List[List[Dict]]:
+        """Run OCR, icon detection and captioning over whole RGB images, batching detection and captioning"""
+        with timer.stage('ocr'):
+            ocr_results = [check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=self.use_paddleocr, ocr_cache=self.ocr_cache)[0] for image in images]
+        return get_parsed_elements_batch(images, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], ocr_bboxes=[ocr_bbox for _, ocr_bbox in ocr_results], caption_model_processor=self.caption_model_processor, ocr_texts=[text for text, _ in ocr_results], use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128, caption_cache=self.caption_cache, timer=timer)
+
+    def parse(self, image: Union[Image.Image, np.ndarray], state: Optional[IncrementalState] = None, render: Optional[bool] = None):
+        """Parse a screenshot into a labeled image and a list of elements
+
+        Args:
+            image: The screenshot, as a PIL Image or an RGB array such as CaptureBackend.capture returns
+            state: Incremental parsing state to diff against, defaults to the parser's own
+            render: Whether to draw the labeled image, defaults to the render_labeled_img config
+
+        Returns:
+            tuple: (labeled PIL Image or None if not rendered, list of element dicts)
+        """
+        return self.parse_batch([image], [state], render=render)[0]
+
+    def parse_batch(self, images: List[Union[Image.Image, np.ndarray]], states: Optional[List[Optional[IncrementalState]]] = None, render: Optional[bool] = None) -> List[Tuple]:
+        """Parse several screenshots, such as the current frames of several VMs, together.
+
+        Icon detection and captioning are batched across the frames (and across
+        the dirty regions of incrementally parsed frames), so the caption model
+        runs fuller batches than it does one frame at a time. The results are
+        the same as calling parse() on each frame in order.
+
+        Per-stage durations of the call (ocr, yolo, overlap, crop, caption,
+        annotate and, when incremental, dirty_regions) are recorded in
+        last_timings, in milliseconds.
+
+        Args:
+            images: The screenshots, as PIL Images or RGB arrays; arrays must not be modified afterwards
+            states: Optional incremental parsing state per screenshot; None entries use the parser's own
+            render: Whether to draw the labeled images, defaults to the render_labeled_img config
+
+        Returns:
+            list: (labeled PIL Image or None if not rendered, list of element dicts) per screenshot
+        """
+        if render is None:
+            render = self.render_labeled_img
+        start = time.perf_counter()
+        timer = StageTimer()
+        # Arrays, such as captured frames, are used as they are rather than copied back out of a PIL image
+        frames = [image if isinstance(image, np.ndarray) else None for image in images]
+        images = [Image.fromarray(frame) if frame is not None else image if image.mode == 'RGB' else image.convert('RGB') for frame, image in zip(frames, images)]
+        if render or self.incremental:
+            frames = [frame if frame is not None else np.asarray(image) for frame, image in zip(frames, images)]
+        for image in images:
+            logger.debug('image size: %s', image.size)
+
+        if self.incremental:
+            results = self._parse_incremental_rounds(images, frames, states, render, timer)
+        else:
+            elements_list = self._parse_elements_batch(images, timer)
+            if not render:
+                results = [(None, elements) for elements in elements_list]
+            else:
+                with timer.stage('annotate'):
+                    results = [(get_labeled_img(frame, elements, output_coord_in_ratio=True, draw_bbox_config=self._get_draw_bbox_config(image))[0], elements)
+                               for image, frame, elements in zip(images, frames, elements_list)]
+
+        self.last_timings = timer.get_ms()
+        self.last_timings['total'] = (time.perf_counter() - start) * 1000
+        return results
+
+    def _parse_incremental_rounds(self, images: List[Image.Image], frames: List[np.ndarray], states: Optional[List[Optional[IncrementalState]]], render: bool, timer: StageTimer) -> List[Tuple]:
+        """Incrementally parse frames, batching frames whose incremental states differ"""
+        # A frame is diffed against the previous frame with the same state, so
+        # frames sharing a state go into successive rounds instead of one batch
+        states = [state or self.incremental_state for state in (states or [None] * len(images))]
+        rounds = []
+        seen = {}
+        for i, state in enumerate(states):
+            round_index = seen.get(id(state), 0)
+            seen[id(state)] = round_index + 1
+            if round_index == len(rounds):
+                rounds.append([])
+            rounds[round_index].append(i)
+
+        results = [None] * len(images)
+        for indices in rounds:
+            for i, result in zip(indices, self._parse_incremental_batch([images[i] for i in indices], [frames[i] for i in indices], [states[i] for i in indices], render, timer)):
+                results[i] = result
+        return results
+
+    def _parse_incremental_batch(self, images: List[Image.Image], frames: List[np.ndarray], states: List[IncrementalState], render: bool, timer: StageTimer) -> List[Tuple]:
+        """Parse only the regions of each frame that changed since its previous frame.
+
+        Elements from the previous parse that lie entirely outside the changed
+        regions are kept as they are; everything inside a changed region is
+        detected, OCR'd and captioned again on a crop of that region. The whole
+        frames and region crops of every frame are parsed as one batch.
+        """
+        with timer.stage('dirty_regions'):
+            plans = [self._get_dirty_regions(frame, state) for frame, state in zip(frames, states)]
+
+        # Whole frames for full parses, crops for incremental ones
+        jobs = []
+        for i, (image, regions) in enumerate(zip(images, plans)):
+            if regions is None:
+                jobs.append((i, None, image))
+            else:
+                jobs.extend((i, region, image.crop(region)) for region in regions)
+        parsed = self._parse_elements_batch([job_image for _, _, job_image in jobs], timer) if jobs else []
+        new_elements = [[] for _ in images]
+        for (i, region, _), elements in zip(jobs, parsed):
+            if region is not None:
+                _map_region_elements(elements, region, images[i].size)
+            new_elements[i].extend(elements)
+
+        with timer.stage('annotate'):
+            return [self._update_incremental_state(image, frame, state, regions, elements, render)
+                    for image, frame, state, regions, elements in zip(images, frames, states, plans, new_elements)]
+
+    def _update_incremental_state(self, image: Image.Image, frame: np.ndarray, state: IncrementalState, regions, new_elements: List[Dict], render: bool):
+        """Combine the newly parsed elements with the unchanged previous ones and label the frame if render is set"""
+        if regions is None:
+            # First frame, new resolution or too much of the screen changed
+            elements = new_elements
+            state.full_parse_count += 1
+            state.last_dirty_fraction = 1.0
+        elif not regions:
+            # Nothing changed at all
+            state.last_frame = frame
+            state.last_dirty_fraction = 0.0
+            if render and state.last_labeled_img is None:
+                # The previous frame was parsed without rendering
+                state.last_labeled_img, _ = get_labeled_img(frame, state.last_elements, output_coord_in_ratio=True, draw_bbox_config=self._get_draw_bbox_config(image))
+            return state.last_labeled_img if render else None, list(state.last_elements)
+        else:
+            h, w = frame.shape[:2]
+            elements = [elem for elem in state.last_elements if not any(_box_intersects(_to_pixels(elem['bbox'], w, h), region) for region in regions)]
+            elements.extend(new_elements)
+            state.incremental_parse_count += 1
+            state.last_dirty_fraction = sum(_box_area(region) for region in regions) / float(w * h)
+
+        # Keep a stable top-to-bottom order so unchanged elements keep their ids
+        elements.sort(key=lambda elem: (SOURCE_ORDER.get(elem.get('source'), len(SOURCE_ORDER)), elem['bbox'][1], elem['bbox'][0]))
+        labeled_img = None
+        if render:
+            labeled_img, _ = get_labeled_img(frame, elements, output_coord_in_ratio=True, draw_bbox_config=self._get_draw_bbox_config(image))
+        state.last_frame = frame
+        state.last_elements = elements
+        state.last_labeled_img = labeled_img
+        return labeled_img, list(elements)
+
+    def _get_dirty_regions(self, frame: np.ndarray, state: IncrementalState) -> Optional[List[Tuple[int, int, int, int]]]:
+        """Find the pixel regions that need to be parsed again.
+
+        Changed tiles are grouped into connected rectangles, padded by a margin
+        and then grown until every previous element they touch lies entirely
+        inside them, so no element is ever split across a region border. The
+        margin covers new elements whose edges match the pixels underneath.
+
+        Returns:
+            list of (x1, y1, x2, y2) regions, an empty list if nothing changed, or
+            None if a full parse is needed instead
+        """
+        if state.last_frame is None or state.last_frame.shape != frame.shape:
+            return None
+
+        h, w = frame.shape[:2]
+        tile = self.tile_size
+        changed = (frame != state.last_frame).any(axis=2)
+        if not changed.any():
+            return []
+
+        # Pad to a whole number of tiles and reduce each tile to a single dirty flag
+        tiles_y, tiles_x = -(-h // tile), -(-w // tile)
+        padded = np.zeros((tiles_y * tile, tiles_x * tile), dtype=bool)
+        padded[:h, :w] = changed
+        dirty = padded.reshape(tiles_y, tile, tiles_x, tile).any(axis=(1, 3))
+
+        regions = []
+        for tx1, ty1, tx2, ty2 in _connected_tile_groups(dirty):
+            regions.append((
+                max(tx1 * tile - self.region_margin, 0),
+                max(ty1 * tile - self.region_margin, 0),
+                min(tx2 * tile + self.region_margin, w),
+                min(ty2 * tile + self.region_margin, h),
+            ))
+
+        element_boxes = [_to_pixels(elem['bbox'], w, h) for elem in state.last_elements]
+        regions = _grow_regions(regions, element_boxes)
+
+        if sum(_box_area(region) for region in regions) > self.max_dirty_fraction * w * h:
+            return None
+        return regions
+
+
+def _to_pixels(bbox, w: int, h: int) -> Tuple[int, int, int, int]:
+    """Convert an xyxy ratio box to an xyxy pixel box that covers it, clipped to the frame"""
+    return (
+        max(int(np.floor(bbox[0] * w)), 0),
+        max(int(np.floor(bbox[1] * h)), 0),
+        min(int(np.ceil(bbox[2] * w)), w),
+        min(int(np.ceil(bbox[3] * h)), h),
+    )
+
+
+def _map_region_elements(elements: List[Dict], region: Tuple[int, int, int, int], frame_size: Tuple[int, int]):
+    """Map element boxes parsed on a crop of the frame from crop ratios back to frame ratios, in place"""
+    x1, y1, x2, y2 = region
+    w, h = frame_size
+    crop_w, crop_h = x2 - x1, y2 - y1
+    for elem in elements:
+        bx1, by1, bx2, by2 = elem['bbox']
+        elem['bbox'] = [
+            (bx1 * crop_w + x1) / w,
+            (by1 * crop_h + y1) / h,
+            (bx2 * crop_w + x1) / w,
+            (by2 * crop_h + y1) / h,
+        ]
+
+
+def _box_area(box) -> int:
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def _box_intersects(box1, box2) -> bool:
+    return box1[0] < box2[2] and box2[0] < box1[2] and box1[1] < box2[3] and box2[1] < box1[3]
+
+
+def _box_union(box1, box2) -> Tuple[int, int, int, int]:
+    return (min(box1[0], box2[0]), min(box1[1], box2[1]), max(box1[2], box2[2]), max(box1[3], box2[3]))
+
+
+def _connected_tile_groups(dirty: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """Bounding boxes (in tile units, exclusive end) of 8-connected groups of dirty tiles"""
+    seen = np.zeros_like(dirty)
+    groups = []
+    for ty, tx in zip(*np.nonzero(dirty)):
+        if seen[ty, tx]:
+            continue
+        seen[ty, tx] = True
+        stack = [(ty, tx)]
+        x1, y1, x2, y2 = tx, ty, tx + 1, ty + 1
+        while stack:
+            cy, cx = stack.pop()
+            x1, y1, x2, y2 = min(x1, cx), min(y1, cy), max(x2, cx + 1), max(y2, cy + 1)
+            for ny in range(max(cy - 1, 0), min(cy + 2, dirty.shape[0])):
+                for nx in range(max(cx - 1, 0), min(cx + 2, dirty.shape[1])):
+                    if dirty[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        stack.append((ny, nx))
+        groups.append((int(x1), int(y1), int(x2), int(y2)))
+    return groups
+
+
+def _grow_regions(regions, element_boxes):
+    """Grow regions to fully contain every element box they touch and merge overlapping regions"""
+    changed = True
+    while changed:
+        changed = False
+        for i, region in enumerate(regions):
+            for box in element_boxes:
+                if _box_intersects(region, box) and _box_union(region, box) != region:
+                    region = _box_union(region, box)
+                    changed = True
+            regions[i] = region
 
-        return dino_labled_img, parsed_content_list
+        merged = []
+        for region in regions:
+            for j, other in enumerate(merged):
+                if _box_intersects(region, other):
+                    merged[j] = _box_union(region, other)
+                    changed = True
+                    break
+            else:
+                merged.append(region)
+        regions = merged
+    return regions
@@ -0,0 +1,464 @@
+import argparse
+import ipaddress
+import logging
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from omniparser import Omniparser, IncrementalState
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = ('127.0.0.1', 6010)
+# Environment variable holding the key clients present to the server
+AUTHKEY_ENV = 'MEGAAPPTESTER_PARSER_AUTHKEY'
+# Where the key is kept when the environment variable isn't set; created with a random key on first use
+AUTHKEY_PATH = os.path.join(os.path.expanduser('~'), '.megaapptester', 'parser_authkey')
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Parse a "host:port" or "port" string into a listener address"""
+    host, _, port = address.rpartition(':')
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+def load_authkey(path: str = AUTHKEY_PATH) -> bytes:
+    """Get the key shared by the server and its clients.
+
+    The connection unpickles what the other end sends, so the key must not be
+    guessable: it comes from the AUTHKEY_ENV environment variable, or else from
+    a file only the current user can read, which is created with a random key
+    the first time it is needed.
+
+    Args:
+        path (str): Key file used when the environment variable isn't set
+
+    Returns:
+        bytes: The key
+    """
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    try:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    key = secrets.token_hex(32).encode()
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another process created it first
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    logger.info(f"Created parser server key file {path}")
+    return key
+
+
+def is_loopback(host: str) -> bool:
+    """True if every address host resolves to is on this machine"""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+
+def _attach_shared_memory(name: str) -> SharedMemory:
+    """Attach to a segment created by another process without taking ownership of it"""
+    shm = SharedMemory(name=name)
+    if os.name == 'posix':
+        # Before Python 3.13 attaching registers the segment with this process's
+        # resource tracker, which would unlink the client's segment when we exit
+        from multiprocessing import resource_tracker
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+    return shm
+
+
+class OmniparserServer:
+    """Hosts one Omniparser for several local clients.
+
+    Clients connect over a multiprocessing connection and pass frames through a
+    shared memory segment they own; only the segment name, the frame shape and
+    the parsed content travel over the connection. The labeled image is
+    written back into the same segment. Each client gets its own incremental
+    parsing state. Parses run on a single worker thread that drains every
+    waiting parse request into one Omniparser.parse_batch call, so concurrent
+    clients share detection and caption batches, while pings and stats are
+    answered straight away.
+
+    Requests are dicts with an 'op' key:
+        parse: {'shm_name', 'shape', 'render'} -> {'parsed_content', 'parse_ms', 'batch_size', 'timings', 'rendered'}
+        reset: forget the client's previous frame
+        ping: liveness check -> {'pid', 'uptime_s', 'clients'}
+        stats: server, per-client and cache statistics
+        shutdown: finish in-flight requests and stop the server
+    Every response has 'ok', and 'error' when ok is False.
+    """
+
+    def __init__(self, parser: Omniparser, address: Tuple[str, int] = DEFAULT_ADDRESS, authkey: Optional[bytes] = None, max_batch_size: int = 8,
+                 allow_remote: bool = False):
+        """Initialize the server
+
+        Args:
+            parser: The loaded parser shared by all clients
+            address: (host, port) to listen on
+            authkey: Key clients must present to connect, defaults to load_authkey()
+            max_batch_size (int): Most frames parsed together in one batch
+            allow_remote (bool): Allow listening on an address other machines can reach.
+                Anyone holding the key can then run code in the server process.
+        """
+        if not allow_remote and not is_loopback(address[0]):
+            raise ValueError(f"Refusing to listen on non-loopback address {address[0]} without allow_remote")
+        self.parser = parser
+        self.address = address
+        self.authkey = authkey or load_authkey()
+        self.max_batch_size = max_batch_size
+        self._listener = None
+        self._parse_queue = queue.Queue()
+        self._parse_thread = None
+        self._clients_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._clients = {}
+        self._client_threads = []
+        self._next_client_id = 1
+        self.started_at = time.perf_counter()
+        self.parse_count = 0
+        self.batch_count = 0
+        self.parse_seconds = 0.0
+        self.error_count = 0
+
+    def serve_forever(self):
+        """Accept clients until shutdown() is called or a client requests shutdown"""
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.address = self._listener.address
+        logger.info(f"Omniparser server listening on {self.address[0]}:{self.address[1]}")
+        self._parse_thread = threading.Thread(target=self._parse_worker, daemon=True)
+        self._parse_thread.start()
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    conn = self._listener.accept()
+                except Exception as e:
+                    if self._stop_event.is_set():
+                        break
+                    logger.warning(f"Rejected client connection: {e}")
+                    continue
+                if self._stop_event.is_set():
+                    conn.close()
+                    break
+                thread = threading.Thread(target=self._serve_client, args=(conn,), daemon=True)
+                self._client_threads.append(thread)
+                thread.start()
+        finally:
+            self._stop_event.set()
+            self._listener.close()
+            for thread in self._client_threads:
+                thread.join(timeout=30)
+            self._parse_queue.put(None)
+            self._parse_thread.join(timeout=30)
+            logger.info("Omniparser server stopped")
+
+    def shutdown(self):
+        """Stop accepting clients and disconnect idle ones once in-flight requests finish"""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        # accept() has no timeout, so wake it with a throwaway connection
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+
+    def _serve_client(self, conn):
+        with self._clients_lock:
+            client_id = self._next_client_id
+            self._next_client_id += 1
+            client = {'state': IncrementalState(), 'requests': 0, 'parses': 0, 'parse_seconds': 0.0, 'connected_at': time.time()}
+            self._clients[client_id] = client
+        logger.info(f"Client {client_id} connected")
+
+        try:
+            while not self._stop_event.is_set():
+                # Poll so idle clients notice a shutdown
+                if not conn.poll(0.5):
+                    continue
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                client['requests'] += 1
+                response = self._handle_request(request, client)
+                try:
+                    conn.send(response)
+                except OSError:
+                    break
+                if request.get('op') == 'shutdown':
+                    self.shutdown()
+        finally:
+            conn.close()
+            with self._clients_lock:
+                del self._clients[client_id]
+            logger.info(f"Client {client_id} disconnected")
+
+    def _handle_request(self, request: Dict, client: Dict) -> Dict:
+        op = request.get('op')
+        try:
+            if op == 'parse':
+                return self._handle_parse(request, client)
+            if op == 'reset':
+                client['state'].reset()
+                return {'ok': True}
+            if op == 'ping':
+                return {'ok': True, 'pid': os.getpid(), 'uptime_s': time.perf_counter() - self.started_at, 'clients': len(self._clients)}
+            if op == 'stats':
+                return {'ok': True, **self.get_stats()}
+            if op == 'shutdown':
+                return {'ok': True}
+            return {'ok': False, 'error': f"Unknown op: {op}"}
+        except Exception as e:
+            self.error_count += 1
+            logger.warning(f"Error handling {op} request: {e}")
+            return {'ok': False, 'error': str(e)}
+
+    def _handle_parse(self, request: Dict, client: Dict) -> Dict:
+        shape = tuple(request['shape'])
+        shm = _attach_shared_memory(request['shm_name'])
+        try:
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            # Copy out of the segment since the labeled image is written back into it
+            job = {'image': frame.copy(), 'state': client['state'], 'render': request.get('render', True), 'done': threading.Event(), 'result': None, 'timings': {}, 'error': None}
+            self._parse_queue.put(job)
+            job['done'].wait()
+            if job['error'] is not None:
+                raise job['error']
+            labeled_img, parsed_content = job['result']
+            if labeled_img is not None:
+                frame[...] = np.asarray(labeled_img.convert('RGB'))
+            del frame
+        finally:
+            shm.close()
+
+        client['parses'] += 1
+        client['parse_seconds'] += job['elapsed']
+        return {'ok': True, 'parsed_content': parsed_content, 'parse_ms': job['elapsed'] * 1000, 'batch_size': job['batch_size'], 'timings': job['timings'], 'rendered': labeled_img is not None}
+
+    def _parse_worker(self):
+        """Parse queued frames, batching every request that is waiting when a batch starts"""
+        while True:
+            job = self._parse_queue.get()
+            if job is None:
+                return
+            batch = [job]
+            while len(batch) < self.max_batch_size:
+                try:
+                    job = self._parse_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    # Finish this batch first, then stop
+                    self._parse_queue.put(None)
+                    break
+                batch.append(job)
+
+            start = time.perf_counter()
+            # Clients that don't want the labeled image (headless runs) skip drawing it
+            for render in (True, False):
+                group = [job for job in batch if job['render'] == render]
+                if group:
+                    self._parse_group(group, render)
+            elapsed = time.perf_counter() - start
+
+            self.parse_count += len(batch)
+            self.batch_count += 1
+            self.parse_seconds += elapsed
+            for job in batch:
+                job['elapsed'] = elapsed
+                job['batch_size'] = len(batch)
+                job['done'].set()
+
+    def _parse_group(self, batch: List[Dict], render: bool):
+        try:
+            results = self.parser.parse_batch([job['image'] for job in batch], [job['state'] for job in batch], render=render)
+            for job, result in zip(batch, results):
+                job['result'] = result
+                job['timings'] = self.parser.last_timings
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0]['error'] = e
+            else:
+                # Parse one at a time so a bad frame only fails its own request
+                for job in batch:
+                    try:
+                        job['result'] = self.parser.parse(job['image'], state=job['state'], render=render)
+                        job['timings'] = self.parser.last_timings
+                    except Exception as frame_error:
+                        job['error'] = frame_error
+
+    def get_stats(self) -> Dict:
+        """Get server, per-client and cache statistics"""
+        with self._clients_lock:
+            clients = {
+                client_id: {
+                    'requests': client['requests'],
+                    'parses': client['parses'],
+                    'avg_parse_ms': client['parse_seconds'] / client['parses'] * 1000 if client['parses'] else 0.0,
+                    'connected_s': time.time() - client['connected_at'],
+                    **client['state'].get_stats(),
+                }
+                for client_id, client in self._clients.items()
+            }
+        return {
+            'server': {
+                'pid': os.getpid(),
+                'uptime_s': time.perf_counter() - self.started_at,
+                'parses': self.parse_count,
+                'batches': self.batch_count,
+                'avg_batch_size': self.parse_count / self.batch_count if self.batch_count else 0.0,
+                'avg_batch_ms': self.parse_seconds / self.batch_count * 1000 if self.batch_count else 0.0,
+                'errors': self.error_count,
+            },
+            'clients': clients,
+            'caches': self.parser.get_cache_stats(),
+            'load_timings': self.parser.load_timings,
+        }
+
+
+class OmniparserClient:
+    """Drop-in replacement for Omniparser that parses on an OmniparserServer.
+
+    The frame is copied into a shared memory segment owned by the client and
+    reused between calls, so no image is pickled in either direction.
+    """
+
+    def __init__(self, address: Tuple[str, int] = DEFAULT_ADDRESS, authkey: Optional[bytes] = None, render: bool = True):
+        """Connect to a running server
+
+        Args:
+            address: (host, port) the server listens on
+            authkey: Key the server was started with, defaults to load_authkey()
+            render: Whether the server should draw labeled images; parse returns None for them if not
+        """
+        self.address = address
+        self.render = render
+        self._conn = Client(address, authkey=authkey or load_authkey())
+        self._lock = threading.RLock()
+        self._shm = None
+        # Per-stage milliseconds of the server batch the most recent parse ran in
+        self.last_timings = {}
+
+    def _request(self, request: Dict) -> Dict:
+        with self._lock:
+            self._conn.send(request)
+            response = self._conn.recv()
+        if not response.get('ok'):
+            raise RuntimeError(f"Parser server error: {response.get('error')}")
+        return response
+
+    def _get_frame_buffer(self, nbytes: int) -> SharedMemory:
+        if self._shm is None or self._shm.size < nbytes:
+            self._release_frame_buffer()
+            self._shm = SharedMemory(create=True, size=nbytes)
+        return self._shm
+
+    def _release_frame_buffer(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def parse(self, image: Union[Image.Image, np.ndarray]):
+        """Parse a screenshot, as a PIL Image or an RGB array, on the server
+
+        Returns:
+            tuple: (labeled PIL Image or None if not rendered, list of element dicts), as Omniparser.parse
+        """
+        frame = image if isinstance(image, np.ndarray) else np.asarray(image.convert('RGB'))
+        with self._lock:
+            shm = self._get_frame_buffer(frame.nbytes)
+            buffer = np.ndarray(frame.shape, dtype=np.uint8, buffer=shm.buf)
+            buffer[...] = frame
+            response = self._request({'op': 'parse', 'shm_name': shm.name, 'shape': frame.shape, 'render': self.render})
+            labeled_img = Image.fromarray(buffer.copy()) if response['rendered'] else None
+            del buffer
+        self.last_timings = response['timings']
+        return labeled_img, response['parsed_content']
+
+    def reset_incremental_state(self):
+        """Forget this client's previous frame so the next parse is a full parse"""
+        self._request({'op': 'reset'})
+
+    def ping(self) -> Dict:
+        """Check the server is alive"""
+        return self._request({'op': 'ping'})
+
+    def get_stats(self) -> Dict:
+        """Get server, per-client and cache statistics"""
+        return self._request({'op': 'stats'})
+
+    def get_cache_stats(self) -> Dict:
+        """Get hit/miss counters for the server's caption and OCR caches"""
+        return self.get_stats()['caches']
+
+    def shutdown_server(self):
+        """Ask the server to stop once in-flight requests finish"""
+        self._request({'op': 'shutdown'})
+
+    def close(self):
+        """Disconnect and free the frame buffer; the server keeps running"""
+        with self._lock:
+            self._release_frame_buffer()
+            self._conn.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Host Omniparser in a long-lived process shared by several clients")
+    arg_parser.add_argument('--address', default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help='host:port to listen on')
+    arg_parser.add_argument('--authkey', help=f'Key clients must present; defaults to ${AUTHKEY_ENV}, or a random key kept in {AUTHKEY_PATH}')
+    arg_parser.add_argument('--allow-remote', action='store_true',
+                            help='Allow a non-loopback --address; anyone with the key can run code in the server')
+    arg_parser.add_argument('--no-warmup', action='store_true', help='Skip the warm-up parse at startup')
+    arg_parser.add_argument('--log-level', default='INFO', help='DEBUG, INFO, WARNING or ERROR')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    config = {
+        'som_model_path': 'weights/icon_detect/model.pt',
+        'caption_model_name': 'florence2',
+        'caption_model_path': 'weights/icon_caption_florence',
+        'BOX_TRESHOLD': 0.05,
+        'incremental': True,
+        'caption_cache_path': 'weights/caption_cache.json',
+        'ocr_cache_path': 'weights/ocr_cache.json',
+        'warmup': not args.no_warmup
+    }
+    address = parse_address(args.address)
+    if not args.allow_remote and not is_loopback(address[0]):
+        arg_parser.error(f"--address {args.address} is not a loopback address; pass --allow-remote to listen on it")
+    parser = Omniparser(config)
+    server = OmniparserServer(parser, address, args.authkey.encode() if args.authkey else None, allow_remote=args.allow_remote)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    finally:
+        parser.close()
+
+
+if __name__ == "__main__":
+    main()
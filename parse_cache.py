@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe LRU cache of string keys with a byte budget.
+
+    Values must be JSON serializable so the cache can optionally be persisted
+    to disk and reloaded at startup.
+    """
+
+    # Rough per-entry bookkeeping overhead counted against the byte budget
+    ENTRY_OVERHEAD = 64
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, path: Optional[str] = None):
+        """Initialize the cache
+
+        Args:
+            max_bytes (int): Approximate memory budget; least recently used entries are evicted beyond it
+            path (str): Optional JSON file the cache is loaded from and saved to
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def _entry_size(self, key: str, value) -> int:
+        return len(key) + len(json.dumps(value)) + self.ENTRY_OVERHEAD
+
+    def get(self, key: str):
+        """Look up a key, marking it as recently used.
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: str, value):
+        """Store a value, evicting least recently used entries to stay within the budget"""
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entry_size(key, self._entries.pop(key))
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self.current_bytes -= self._entry_size(old_key, old_value)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def load(self):
+        """Load entries from the persistence file, oldest first"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load cache from {self.path}: {e}")
+            return
+        for key, value in data.get('entries', []):
+            self.put(key, value)
+        logger.info(f"Loaded {len(self)} cache entries from {self.path}")
+
+    def save(self):
+        """Write entries to the persistence file, if one is configured"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {'version': 1, 'entries': list(self._entries.items())}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save cache to {self.path}: {e}")
+
+    def make_key(self, crop: np.ndarray, namespace: str = '') -> str:
+        """Build a content-addressed cache key from an image crop
+
+        Args:
+            crop: The pixels the cached value was computed from
+            namespace: Anything else the value depends on, such as model name and settings
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(namespace.encode('utf-8'))
+        digest.update(str(crop.shape).encode('ascii'))
+        digest.update(np.ascontiguousarray(crop).tobytes())
+        return digest.hexdigest()
+
+    def get_stats(self) -> dict:
+        """Get hit/miss counters and memory use"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'bytes': self.current_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class CaptionCache(LRUCache):
+    """Icon captions keyed by the content of the resized icon crop.
+
+    The key also covers the caption model and prompt, so a persisted cache is
+    never reused for a different model.
+    """
+
+
+class OcrCache(LRUCache):
+    """Recognized (text, confidence) pairs keyed by the pixels of a detected text box.
+
+    The key also covers the OCR engine and recognition settings.
+    """
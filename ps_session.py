@@ -0,0 +1,324 @@
+"""A long-lived shell process that runs commands one after another.
+
+Starting powershell.exe and importing the Hyper-V module costs from hundreds
+of milliseconds to seconds, so HyperVConnection keeps one PowerShell process
+open and sends every command through its stdin. Each command is base64
+encoded into a single line, so quoting and line breaks can't break the
+framing, and its output comes back between two marker lines that carry the
+exit status. The shell is a pluggable dialect: PowerShellDialect on Windows,
+PosixShellDialect to exercise the same session code against /bin/sh.
+"""
+import base64
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class ShellError(RuntimeError):
+    """A shell command failed, or the shell process died while running it"""
+    pass
+
+
+class ShellTimeout(ShellError):
+    """A shell command did not finish in time; the shell process is restarted"""
+    pass
+
+
+class ShellResult:
+    """Output and exit status of one command"""
+
+    def __init__(self, command: str, output: str, status: int, elapsed: float):
+        self.command = command
+        self.output = output
+        self.status = status
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 0
+
+    def json(self) -> Any:
+        """Parse the output as JSON; empty output is None"""
+        return json.loads(self.output) if self.output.strip() else None
+
+    def __repr__(self):
+        return f"ShellResult(status={self.status}, elapsed={self.elapsed * 1000:.0f}ms, output={self.output[:80]!r})"
+
+
+class PowerShellDialect:
+    """Windows PowerShell reading commands from stdin"""
+    argv = ['powershell', '-NoLogo', '-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass', '-Command', '-']
+    # Output is read as UTF-8
+    preamble = "[Console]::OutputEncoding = [Text.Encoding]::UTF8"
+
+    def wrap(self, command: str, begin: str, end: str) -> str:
+        """One line of PowerShell that runs command between the begin and end marker lines.
+
+        The command is dot-sourced so variables and imported modules persist
+        between commands. Errors are terminating, and their message becomes the
+        output with status 1.
+        """
+        encoded = base64.b64encode(command.encode('utf-8')).decode('ascii')
+        return (f"[Console]::Out.WriteLine('{begin}'); $__status = 0; "
+                f"try {{ $ErrorActionPreference = 'Stop'; "
+                f". ([ScriptBlock]::Create([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{encoded}')))) 2>&1 "
+                f"| Out-String -Stream -Width 4096 | ForEach-Object {{ [Console]::Out.WriteLine($_) }} }} "
+                f"catch {{ [Console]::Out.WriteLine($_.Exception.Message); $__status = 1 }}; "
+                f"[Console]::Out.WriteLine(''); [Console]::Out.WriteLine(\"{end} $__status\"); [Console]::Out.Flush()")
+
+    def json_command(self, command: str) -> str:
+        """Command that prints the result of command as JSON"""
+        return f"{command} | ConvertTo-Json -Compress -Depth 4"
+
+    @staticmethod
+    def quote(value: str) -> str:
+        """Single-quoted PowerShell string literal"""
+        return "'" + str(value).replace("'", "''") + "'"
+
+
+class PosixShellDialect:
+    """/bin/sh reading commands from stdin, a stand-in for PowerShell where it isn't available"""
+    argv = ['/bin/sh']
+    preamble = None
+
+    def wrap(self, command: str, begin: str, end: str) -> str:
+        encoded = base64.b64encode(command.encode('utf-8')).decode('ascii')
+        return (f"printf '%s\\n' '{begin}'; {{ eval \"$(printf '%s' '{encoded}' | base64 -d)\"; }} 2>&1; "
+                f"__status=$?; printf '\\n%s %s\\n' '{end}' \"$__status\"")
+
+    def json_command(self, command: str) -> str:
+        # Commands are expected to print JSON themselves
+        return command
+
+    @staticmethod
+    def quote(value: str) -> str:
+        return "'" + str(value).replace("'", "'\\''") + "'"
+
+
+class ShellSession:
+    """Runs commands through one long-lived shell process.
+
+    The process is started on first use and restarted automatically when it
+    exits or a command times out; startup_commands (such as importing a
+    module) run again after every start. Commands are serialized, and
+    run_many pipelines several commands by writing them all before reading
+    any output.
+    """
+
+    def __init__(self, dialect=None, timeout: float = 60.0, startup_commands: Sequence[str] = ()):
+        """Initialize the session; the shell is started on the first command
+
+        Args:
+            dialect: PowerShellDialect (default) or PosixShellDialect
+            timeout (float): Default seconds a command may take before the shell is restarted
+            startup_commands: Commands to run every time the shell starts
+        """
+        self.dialect = dialect or PowerShellDialect()
+        self.timeout = timeout
+        self.startup_commands = list(startup_commands)
+        self._process = None
+        self._lines = None
+        self._lock = threading.RLock()
+        # Unique per session, so command output can't be mistaken for a marker
+        self._marker = f"__shell_session_{uuid.uuid4().hex}"
+        self._next_id = 0
+        self.starts = 0
+        self.commands = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.command_seconds = 0.0
+        self.start_seconds = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        start_time = time.perf_counter()
+        self._process = subprocess.Popen(self.dialect.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         text=True, encoding='utf-8', errors='replace', bufsize=1)
+        # Each process gets its own queue so lines from a killed shell are never read as output of the next one
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self._process.stdout, self._lines), daemon=True).start()
+        self.starts += 1
+        if self.dialect.preamble:
+            self._write(self.dialect.preamble)
+        for command in self.startup_commands:
+            result = self._run_batch([command], self.timeout)[0]
+            if not result.ok:
+                # Otherwise the next command would find the shell alive and run without the startup commands
+                self._kill()
+                raise ShellError(f"Startup command failed: {command}: {result.output}")
+        self.start_seconds += time.perf_counter() - start_time
+
+    @staticmethod
+    def _read_lines(stream, lines: queue.Queue):
+        for line in stream:
+            lines.put(line)
+        # End of output: the process exited
+        lines.put(None)
+
+    def _write(self, line: str):
+        self._process.stdin.write(line + '\n')
+        self._process.stdin.flush()
+
+    def _kill(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def _ensure_started(self):
+        if not self.alive:
+            self._kill()
+            self._start()
+
+    def _run_batch(self, commands: List[str], timeout: float) -> List[ShellResult]:
+        ids = []
+        for command in commands:
+            command_id = self._next_id
+            self._next_id += 1
+            ids.append(command_id)
+            self._write(self.dialect.wrap(command, f"{self._marker} BEGIN {command_id}", f"{self._marker} END {command_id}"))
+
+        results = []
+        deadline = time.perf_counter() + timeout
+        for command, command_id in zip(commands, ids):
+            start_time = time.perf_counter()
+            begin = f"{self._marker} BEGIN {command_id}"
+            end = f"{self._marker} END {command_id} "
+            output = []
+            started = False
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    self.timeouts += 1
+                    self._kill()
+                    raise ShellTimeout(f"Command timed out after {timeout:.0f}s: {command}")
+                if line is None:
+                    self._kill()
+                    raise ShellError(f"Shell exited while running: {command}")
+                line = line.rstrip('\r\n')
+                if not started:
+                    # Anything before the begin marker (prompts, preamble output) is not ours
+                    started = line == begin
+                elif line.startswith(end):
+                    status = int(line[len(end):].strip() or 1)
+                    break
+                else:
+                    output.append(line)
+            elapsed = time.perf_counter() - start_time
+            self.commands += 1
+            self.command_seconds += elapsed
+            if status != 0:
+                self.failures += 1
+            # The wrapper always ends the output with one extra line break
+            results.append(ShellResult(command, '\n'.join(output).rstrip('\n'), status, elapsed))
+        return results
+
+    def run_many(self, commands: Sequence[str], timeout: Optional[float] = None) -> List[ShellResult]:
+        """Run several commands in order, writing them all to the shell before reading their output
+
+        Args:
+            commands: Commands to run
+            timeout (float): Seconds all of them may take together, defaults to the session timeout
+
+        Returns:
+            list: ShellResult per command
+        """
+        with self._lock:
+            self._ensure_started()
+            return self._run_batch(list(commands), self.timeout if timeout is None else timeout)
+
+    def run(self, command: str, timeout: Optional[float] = None, check: bool = False) -> ShellResult:
+        """Run a command
+
+        Args:
+            command: Command to run
+            timeout (float): Seconds it may take, defaults to the session timeout
+            check (bool): Raise ShellError if the command fails
+
+        Returns:
+            ShellResult: The command's output and status
+        """
+        result = self.run_many([command], timeout)[0]
+        if check and not result.ok:
+            raise ShellError(f"Command failed: {command}: {result.output}")
+        return result
+
+    def run_json(self, command: str, timeout: Optional[float] = None) -> Any:
+        """Run a command and return its result parsed from JSON; raises ShellError if it fails"""
+        return self.run(self.dialect.json_command(command), timeout, check=True).json()
+
+    def close(self):
+        """Stop the shell process"""
+        with self._lock:
+            if self.alive:
+                try:
+                    self._process.stdin.close()
+                    self._process.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            self._kill()
+
+    def get_stats(self) -> Dict:
+        """Get process start, command, failure and timeout counters and average latencies"""
+        return {
+            'starts': self.starts,
+            'commands': self.commands,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'avg_command_ms': self.command_seconds * 1000 / self.commands if self.commands else 0.0,
+            'avg_start_ms': self.start_seconds * 1000 / self.starts if self.starts else 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Exercise the session against /bin/sh: output, JSON, failures, state, timeout and respawn, pipelining
+    with ShellSession(PosixShellDialect(), timeout=5.0, startup_commands=["GREETING=hello"]) as session:
+        assert session.run("echo \"$GREETING world\"").output == "hello world"
+        assert session.run_json("printf '{\"Name\": \"vm1\", \"State\": 2}'") == {"Name": "vm1", "State": 2}
+        assert session.run("echo 'it''s'; printf 'a\\nb\\n'").output == "its\na\nb"
+        failed = session.run("echo oops >&2; exit_code() { return 3; }; exit_code")
+        assert failed.status == 3 and failed.output == "oops", failed
+        try:
+            session.run("sleep 10", timeout=0.5)
+            raise AssertionError("timeout not raised")
+        except ShellTimeout:
+            pass
+        # The shell was restarted and the startup commands ran again
+        assert session.run("echo $GREETING").output == "hello"
+
+        # Pipelined: all commands are written before any output is read
+        results = session.run_many([f"echo {i}" for i in range(50)])
+        assert [r.output for r in results] == [str(i) for i in range(50)]
+        print(session.get_stats())
+
+    # A failed startup command stops the shell, so the startup commands run again with the next command
+    marker = os.path.join(tempfile.gettempdir(), f"shell_session_{uuid.uuid4().hex}")
+    with ShellSession(PosixShellDialect(), timeout=5.0, startup_commands=[f"test -e {marker}", "MODULE=loaded"]) as session:
+        try:
+            session.run("true")
+            raise AssertionError("startup failure not raised")
+        except ShellError:
+            pass
+        assert not session.alive
+        open(marker, 'w').close()
+        try:
+            assert session.run("echo $MODULE").output == "loaded"
+        finally:
+            os.remove(marker)
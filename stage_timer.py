@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class StageTimer:
+    """Collects how long each named stage of one operation took.
+
+    A stage timed more than once (for example once per frame of a batch)
+    accumulates its durations.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager timing the enclosed block as the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """Add a duration, in seconds, to a stage"""
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def get_ms(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, in the order the stages first ran"""
+        return {name: seconds * 1000 for name, seconds in self.durations.items()}
+
+
+def timed_stage(timer: Optional[StageTimer], name: str):
+    """timer.stage(name), or a no-op context if no timer was passed"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+class RollingStats:
+    """Rolling percentiles of per-stage durations over the most recent samples"""
+
+    def __init__(self, window: int = 500):
+        """Initialize the statistics
+
+        Args:
+            window (int): Number of most recent samples per stage the percentiles cover
+        """
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, durations_ms: Dict[str, float]):
+        """Record one sample for each stage in a {stage: milliseconds} dict"""
+        with self._lock:
+            for name, ms in durations_ms.items():
+                if name not in self._samples:
+                    self._samples[name] = deque(maxlen=self.window)
+                self._samples[name].append(ms)
+
+    def clear(self):
+        """Forget every sample"""
+        with self._lock:
+            self._samples.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Get count, mean, p50, p95 and p99 in milliseconds for every stage"""
+        with self._lock:
+            samples = {name: np.array(values) for name, values in self._samples.items()}
+        stats = {}
+        for name, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[name] = {'count': len(values), 'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+        return stats
+
+    def format_table(self) -> List[str]:
+        """Format the statistics as aligned text lines, one per stage"""
+        stats = self.get_stats()
+        if not stats:
+            return ["No timings recorded yet"]
+        width = max(len('stage'), *(len(name) for name in stats))
+        lines = [f"{'stage':<{width}} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+        for name, stage in stats.items():
+            lines.append(f"{name:<{width}} {stage['count']:>6} {stage['p50']:>9.1f} {stage['p95']:>9.1f} {stage['p99']:>9.1f}")
+        return lines
@@ -5,43 +5,106 @@ import base64
 import time
 from PIL import Image, ImageDraw, ImageFont
 import json
-import requests
 # utility function
 import os
-from openai import AzureOpenAI
 
 import json
 import sys
 import os
+import threading
+import logging
 import cv2
 import numpy as np
-# %matplotlib inline
-from matplotlib import pyplot as plt
-import easyocr
-from paddleocr import PaddleOCR
-reader = easyocr.Reader(['en'])
-paddle_ocr = PaddleOCR(
-    lang='en',  # other lang also available
-    use_angle_cls=False,
-    use_gpu=False,  # using cuda will conflict with pytorch in the same process
-    show_log=False,
-    max_batch_size=1024,
-    use_dilation=True,  # improves accuracy
-    det_db_score_mode='slow',  # improves accuracy
-    rec_batch_num=1024)
+# matplotlib, easyocr and paddleocr are heavy and only needed on some paths, so they are imported on first use
+
+# OCR engines are built on first use, and only the engine that is actually selected
+_reader = None
+_paddle_ocr = None
+_ocr_engine_lock = threading.Lock()
+
+
+def get_easyocr_reader():
+    """Get the shared EasyOCR reader, building it on first use"""
+    global _reader
+    with _ocr_engine_lock:
+        if _reader is None:
+            import easyocr
+            _reader = easyocr.Reader(['en'])
+    return _reader
+
+
+def get_paddle_ocr():
+    """Get the shared PaddleOCR instance, building it on first use"""
+    global _paddle_ocr
+    with _ocr_engine_lock:
+        if _paddle_ocr is None:
+            from paddleocr import PaddleOCR
+            _paddle_ocr = PaddleOCR(
+                lang='en',  # other lang also available
+                use_angle_cls=False,
+                use_gpu=False,  # using cuda will conflict with pytorch in the same process
+                show_log=False,
+                max_batch_size=1024,
+                use_dilation=True,  # improves accuracy
+                det_db_score_mode='slow',  # improves accuracy
+                rec_batch_num=1024)
+    return _paddle_ocr
+
+
 import time
 import base64
 
 import os
 import ast
 import torch
-from typing import Tuple, List, Union
+from typing import Dict, Tuple, List, Union
 from torchvision.ops import box_convert
+import torch.nn.functional as F
 import re
 from torchvision.transforms import ToPILImage
 import supervision as sv
 import torchvision.transforms as T
 from box_annotator import BoxAnnotator 
+from stage_timer import timed_stage
+
+logger = logging.getLogger(__name__)
+
+
+def make_synthetic_screen(width=1920, height=1080):
+    """Draw a desktop-like test frame with windows, text and icons.
+
+    Used to warm up the models and by the benchmarks when no real screenshot is available.
+    """
+    image = Image.new('RGB', (width, height), (0, 90, 158))
+    draw = ImageDraw.Draw(image)
+    unit = max(width // 64, 8)
+    try:
+        font = ImageFont.load_default(size=unit // 2)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        font = ImageFont.load_default()
+    # desktop icons with labels
+    for i, label in enumerate(['Recycle Bin', 'This PC', 'Documents', 'Setup.exe']):
+        x, y = unit, unit + i * 4 * unit
+        draw.rectangle([x, y, x + 2 * unit, y + 2 * unit], fill=(240, 200, 80), outline=(255, 255, 255))
+        draw.text((x, y + 2 * unit + 4), label, fill=(255, 255, 255), font=font)
+    # an installer style dialog
+    left, top = width // 4, height // 4
+    right, bottom = 3 * width // 4, 3 * height // 4
+    draw.rectangle([left, top, right, bottom], fill=(243, 243, 243), outline=(80, 80, 80))
+    draw.rectangle([left, top, right, top + 2 * unit], fill=(255, 255, 255))
+    draw.text((left + unit, top + unit // 2), 'Setup - Example Application', fill=(0, 0, 0), font=font)
+    draw.text((left + unit, top + 4 * unit), 'Welcome to the Example Application Setup Wizard', fill=(0, 0, 0), font=font)
+    for i, label in enumerate(['< Back', 'Next >', 'Cancel']):
+        x = right - (3 - i) * 6 * unit
+        draw.rectangle([x, bottom - 3 * unit, x + 5 * unit, bottom - unit], fill=(225, 225, 225), outline=(0, 120, 215))
+        draw.text((x + unit, bottom - 5 * unit // 2), label, fill=(0, 0, 0), font=font)
+    # taskbar
+    draw.rectangle([0, height - 2 * unit, width, height], fill=(32, 32, 32))
+    for i in range(6):
+        x = width // 2 - 6 * unit + i * 2 * unit
+        draw.rectangle([x + 4, height - 2 * unit + 4, x + 2 * unit - 4, height - 4], fill=(90 + 25 * i, 140, 220))
+    return image
 
 
 def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None):
@@ -75,53 +138,194 @@ def get_yolo_model(model_path):
     return model
 
 
+# Icons are shrunk to this size before captioning, as in the original OmniParser pipeline
+ICON_CROP_SIZE = 64
+
+
 @torch.inference_mode()
-def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128):
-    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
-    to_pil = ToPILImage()
-    if starting_idx:
-        non_ocr_boxes = filtered_boxes[starting_idx:]
-    else:
-        non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
-        try:
-            xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-            ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-            cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-            cropped_image = cv2.resize(cropped_image, (64, 64))
-            croped_pil_image.append(to_pil(cropped_image))
-        except:
-            continue
+def get_icon_crops(filtered_boxes, starting_idx, image_source, device=None):
+    """Cut the icons to caption out of the image in one batched bilinear resampling pass
+
+    Each box is resampled to ICON_CROP_SIZE x ICON_CROP_SIZE the way cv2.resize
+    (INTER_LINEAR) resamples the box's pixel slice: same sample positions, and
+    positions past the slice's edge clamped to its edge pixels, so pixels outside
+    the box never contribute. Results match cv2.resize to within rounding.
+
+    Args:
+        filtered_boxes: xyxy ratio boxes
+        starting_idx: Index of the first box without content; earlier boxes are skipped
+        image_source: RGB image array
+        device: Device to crop on, defaults to the CPU
+
+    Returns:
+        tuple: (uint8 tensor of shape (N, 3, 64, 64) for the boxes with a non-empty pixel area,
+            list with one bool per box telling whether it has a crop)
+    """
+    non_ocr_boxes = torch.as_tensor(filtered_boxes[starting_idx:] if starting_idx else filtered_boxes, dtype=torch.float32).reshape(-1, 4)
+    h, w = image_source.shape[:2]
+    # Same truncation to whole pixels as slicing image_source[int(y1*h):int(y2*h), int(x1*w):int(x2*w)]
+    pixel_boxes = (non_ocr_boxes * torch.tensor([w, h, w, h])).trunc()
+    pixel_boxes[:, 0::2] = pixel_boxes[:, 0::2].clamp(0, w)
+    pixel_boxes[:, 1::2] = pixel_boxes[:, 1::2].clamp(0, h)
+    # Boxes that are empty once snapped to pixels can't be captioned
+    valid = (pixel_boxes[:, 2] > pixel_boxes[:, 0]) & (pixel_boxes[:, 3] > pixel_boxes[:, 1])
+    if not valid.any():
+        return torch.zeros((0, 3, ICON_CROP_SIZE, ICON_CROP_SIZE), dtype=torch.uint8), valid.tolist()
+
+    frame = torch.as_tensor(image_source, device=device or 'cpu')
+    boxes = pixel_boxes[valid].to(frame.device)
+
+    def sample_axis(start, end):
+        # One sample per output pixel at its center, clamped to the slice as cv2.INTER_LINEAR does
+        size = end - start
+        centers = (torch.arange(ICON_CROP_SIZE, device=frame.device, dtype=torch.float32) + 0.5)[None]
+        position = (centers * (size / ICON_CROP_SIZE)[:, None] - 0.5).clamp(min=0)
+        position = torch.minimum(position, (size - 1)[:, None])
+        low = position.floor()
+        weight = position - low
+        high = torch.minimum(low + 1, (size - 1)[:, None])
+        return (start[:, None] + low).long(), (start[:, None] + high).long(), weight
+
+    x_low, x_high, x_weight = sample_axis(boxes[:, 0], boxes[:, 2])
+    y_low, y_high, y_weight = sample_axis(boxes[:, 1], boxes[:, 3])
+    # Channel-first so each corner is gathered per channel plane and the blends run on contiguous rows
+    planes = frame.permute(2, 0, 1).reshape(frame.shape[2], -1)
+    width = frame.shape[1]
+
+    def gather(rows, cols):
+        # (N, 64, 1) row offsets plus (N, 1, 64) columns index an (N, 64, 64) grid of samples
+        index = (rows * width)[:, :, None] + cols[:, None, :]
+        index = index.reshape(-1)
+        # Selecting from each plane separately is several times faster than one 2D index_select
+        return torch.stack([plane.index_select(0, index) for plane in planes]).reshape(-1, *rows.shape[:1], ICON_CROP_SIZE, ICON_CROP_SIZE).float()
+
+    x_weight = x_weight[None, :, None, :]
+    y_weight = y_weight[None, :, :, None]
+    top = torch.lerp(gather(y_low, x_low), gather(y_low, x_high), x_weight)
+    bottom = torch.lerp(gather(y_high, x_low), gather(y_high, x_high), x_weight)
+    crops = torch.lerp(top, bottom, y_weight).permute(1, 0, 2, 3)
+    return crops.round().clamp(0, 255).to(torch.uint8), valid.tolist()
+
+
+# Tokenized caption prompts keyed by (processor id, prompt, device)
+_caption_text_inputs = {}
+
+
+def _get_caption_text_inputs(processor, prompt: str, device) -> dict:
+    """Tokenized prompt for the caption model, computed once per processor and prompt.
+
+    The prompt is the same for every crop, so the processor only has to be run
+    once on a dummy image; the image part of its output is discarded.
+    """
+    key = (id(processor), prompt, str(device))
+    if key not in _caption_text_inputs:
+        inputs = processor(images=[Image.new('RGB', (ICON_CROP_SIZE, ICON_CROP_SIZE))], text=[prompt], return_tensors="pt")
+        _caption_text_inputs[key] = {name: value.to(device) for name, value in inputs.items() if name != 'pixel_values'}
+    return _caption_text_inputs[key]
 
+
+def _crops_to_pixel_values(crops: torch.Tensor, image_processor, do_resize: bool, dtype) -> torch.Tensor:
+    """Turn uint8 icon crops into the caption model's pixel_values without going through PIL.
+
+    Applies the processor's resize, center crop, rescale and normalize steps as
+    tensor ops on the whole batch.
+    """
+    pixel_values = crops
+    if do_resize and getattr(image_processor, 'do_resize', False):
+        size = image_processor.size
+        if 'height' in size:
+            target = (size['height'], size['width'])
+        else:
+            target = (size['shortest_edge'], size['shortest_edge'])
+        if pixel_values.device.type == 'cpu':
+            # Antialiased uint8 bicubic uses the same kernel and rounding as the processor's PIL resize
+            pixel_values = F.interpolate(pixel_values, size=target, mode='bicubic', antialias=True)
+        else:
+            pixel_values = F.interpolate(pixel_values.float(), size=target, mode='bicubic', antialias=True).round().clamp(0, 255)
+        if getattr(image_processor, 'do_center_crop', False):
+            crop_h, crop_w = image_processor.crop_size['height'], image_processor.crop_size['width']
+            top, left = (target[0] - crop_h) // 2, (target[1] - crop_w) // 2
+            pixel_values = pixel_values[:, :, top:top + crop_h, left:left + crop_w]
+
+    # Rescale and normalize folded into a single multiply-add per channel
+    channels = pixel_values.shape[1]
+    scale = torch.full((channels,), image_processor.rescale_factor if getattr(image_processor, 'do_rescale', True) else 1.0)
+    offset = torch.zeros(channels)
+    if getattr(image_processor, 'do_normalize', True):
+        mean, std = torch.tensor(image_processor.image_mean), torch.tensor(image_processor.image_std)
+        scale, offset = scale / std, -mean / std
+    scale, offset = scale.view(1, -1, 1, 1).to(pixel_values.device), offset.view(1, -1, 1, 1).to(pixel_values.device)
+    return torch.addcmul(offset, pixel_values.float(), scale).to(dtype)
+
+
+@torch.inference_mode()
+def caption_icon_crops(crops, caption_model_processor, prompt=None, batch_size=128, caption_cache=None):
+    """Caption icon crops in batches of batch_size, skipping crops found in the cache
+
+    Args:
+        crops: uint8 tensor of 64x64 crops as returned by get_icon_crops, possibly pooled from several frames
+        caption_cache: Optional CaptionCache used to skip captioning icons seen before
+
+    Returns:
+        list: One caption per crop, in order
+    """
+    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
     if not prompt:
         if 'florence' in model.config.name_or_path:
             prompt = "<CAPTION>"
         else:
             prompt = "The image shows"
+
+    # Icons repeat frame after frame, so only crops missing from the cache are captioned
+    generated_texts = [None] * len(crops)
+    cache_keys = [None] * len(crops)
+    if caption_cache is not None:
+        namespace = f"{model.config.name_or_path}|{prompt}"
+        crops_np = crops.cpu().numpy()
+        for i, cropped_image in enumerate(crops_np):
+            cache_keys[i] = caption_cache.make_key(cropped_image, namespace)
+            generated_texts[i] = caption_cache.get(cache_keys[i])
+    miss_indices = [i for i, text in enumerate(generated_texts) if text is None]
     
-    generated_texts = []
+    miss_texts = []
     device = model.device
-    for i in range(0, len(croped_pil_image), batch_size):
-        start = time.time()
-        batch = croped_pil_image[i:i+batch_size]
-        t1 = time.time()
-        if model.device.type == 'cuda':
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
-        else:
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt").to(device=device)
+    # On GPU the 64x64 crops go to the model as they are
+    do_resize = model.device.type != 'cuda'
+    dtype = torch.float16 if model.device.type == 'cuda' else torch.float32
+    text_inputs = _get_caption_text_inputs(processor, prompt, device) if miss_indices else None
+    for i in range(0, len(miss_indices), batch_size):
+        batch = crops[miss_indices[i:i+batch_size]].to(device)
+        inputs = {name: value.expand(len(batch), -1) for name, value in text_inputs.items()}
+        inputs['pixel_values'] = _crops_to_pixel_values(batch, processor.image_processor, do_resize, dtype)
         if 'florence' in model.config.name_or_path:
             generated_ids = model.generate(input_ids=inputs["input_ids"],pixel_values=inputs["pixel_values"],max_new_tokens=20,num_beams=1, do_sample=False)
         else:
             generated_ids = model.generate(**inputs, max_length=100, num_beams=5, no_repeat_ngram_size=2, early_stopping=True, num_return_sequences=1) # temperature=0.01, do_sample=True,
         generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
         generated_text = [gen.strip() for gen in generated_text]
-        generated_texts.extend(generated_text)
+        miss_texts.extend(generated_text)
+
+    for i, text in zip(miss_indices, miss_texts):
+        generated_texts[i] = text
+        if caption_cache is not None:
+            caption_cache.put(cache_keys[i], text)
     
     return generated_texts
 
 
+def _expand_captions(captions, valid):
+    """Spread captions over all boxes, giving boxes without a crop an empty caption"""
+    captions = iter(captions)
+    return [next(captions) if has_crop else '' for has_crop in valid]
+
+
+def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128, caption_cache=None):
+    crops, valid = get_icon_crops(filtered_boxes, starting_idx, image_source, device=caption_model_processor['model'].device)
+    captions = caption_icon_crops(crops, caption_model_processor, prompt=prompt, batch_size=batch_size, caption_cache=caption_cache)
+    return _expand_captions(captions, valid)
+
+
 
 def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor):
     to_pil = ToPILImage()
@@ -175,56 +379,70 @@ def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, captio
 
     return generated_texts
 
-def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
-    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+def _pairwise_overlap(boxes1, boxes2):
+    """Pairwise intersection areas of two xyxy box arrays, plus the area of every box.
+
+    Args:
+        boxes1: (N, 4) float array
+        boxes2: (M, 4) float array
+
+    Returns:
+        tuple: (N, M) intersection areas, (N,) areas of boxes1, (M,) areas of boxes2
+    """
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    return intersection, area1, area2
+
+
+def _pairwise_iou(intersection, area1, area2):
+    """Largest of IoU and the two containment ratios for every pair of boxes"""
+    union = area1[:, None] + area2[None, :] - intersection + 1e-6
+    both_positive = (area1[:, None] > 0) & (area2[None, :] > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio1 = np.where(both_positive, intersection / area1[:, None], 0)
+        ratio2 = np.where(both_positive, intersection / area2[None, :], 0)
+        return np.maximum(intersection / union, np.maximum(ratio1, ratio2))
+
+
+def _suppressed_by_smaller_box(boxes, iou_threshold, chunk_size=1024):
+    """Flag boxes that overlap a smaller box by more than iou_threshold.
+
+    Rows are processed in chunks so memory stays bounded for thousands of boxes.
+    """
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for start in range(0, len(boxes), chunk_size):
+        intersection, chunk_area, area = _pairwise_overlap(boxes[start:start + chunk_size], boxes)
+        iou = _pairwise_iou(intersection, chunk_area, area)
+        suppressed[start:start + chunk_size] = ((iou > iou_threshold) & (chunk_area[:, None] > area[None, :])).any(axis=1)
+    return suppressed
 
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
 
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.95
+def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
 
     boxes = boxes.tolist()
     filtered_boxes = []
     if ocr_bbox:
         filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1 in enumerate(boxes):
-        # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
-        is_valid_box = True
-        for j, box2 in enumerate(boxes):
-            # keep the smaller box
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            # add the following 2 lines to include ocr bbox
-            if ocr_bbox:
-                # only add the box if it does not overlap with any ocr bbox
-                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
-                    filtered_boxes.append(box1)
-            else:
-                filtered_boxes.append(box1)
+    if not boxes:
+        return torch.tensor(filtered_boxes)
+
+    # keep the smaller box of every overlapping pair
+    box_array = np.array(boxes, dtype=np.float64)
+    valid = np.nonzero(~_suppressed_by_smaller_box(box_array, iou_threshold))[0]
+    if ocr_bbox:
+        # only add the box if it does not overlap with any ocr bbox, unless it is inside it
+        intersection, area, ocr_area = _pairwise_overlap(box_array[valid], np.array(ocr_bbox, dtype=np.float64))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            is_inside = intersection / area[:, None] > 0.95
+        conflict = (_pairwise_iou(intersection, area, ocr_area) > iou_threshold) & ~is_inside
+        valid = valid[~conflict.any(axis=1)]
+    filtered_boxes.extend(boxes[i] for i in valid)
     return torch.tensor(filtered_boxes)
 
 
@@ -236,76 +454,47 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
     '''
     assert ocr_bbox is None or isinstance(ocr_bbox, List)
 
-    def box_area(box):
-        return (box[2] - box[0]) * (box[3] - box[1])
-
-    def intersection_area(box1, box2):
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        return max(0, x2 - x1) * max(0, y2 - y1)
-
-    def IoU(box1, box2):
-        intersection = intersection_area(box1, box2)
-        union = box_area(box1) + box_area(box2) - intersection + 1e-6
-        if box_area(box1) > 0 and box_area(box2) > 0:
-            ratio1 = intersection / box_area(box1)
-            ratio2 = intersection / box_area(box2)
-        else:
-            ratio1, ratio2 = 0, 0
-        return max(intersection / union, ratio1, ratio2)
-
-    def is_inside(box1, box2):
-        # return box1[0] >= box2[0] and box1[1] >= box2[1] and box1[2] <= box2[2] and box1[3] <= box2[3]
-        intersection = intersection_area(box1, box2)
-        ratio1 = intersection / box_area(box1)
-        return ratio1 > 0.80
-
-    # boxes = boxes.tolist()
     filtered_boxes = []
     if ocr_bbox:
         filtered_boxes.extend(ocr_bbox)
-    # print('ocr_bbox!!!', ocr_bbox)
-    for i, box1_elem in enumerate(boxes):
-        box1 = box1_elem['bbox']
-        is_valid_box = True
-        for j, box2_elem in enumerate(boxes):
-            # keep the smaller box
-            box2 = box2_elem['bbox']
-            if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
-                is_valid_box = False
-                break
-        if is_valid_box:
-            if ocr_bbox:
-                # keep yolo boxes + prioritize ocr label
-                box_added = False
-                ocr_labels = ''
-                for box3_elem in ocr_bbox:
-                    if not box_added:
-                        box3 = box3_elem['bbox']
-                        if is_inside(box3, box1): # ocr inside icon
-                            # box_added = True
-                            # delete the box3_elem from ocr_bbox
-                            try:
-                                # gather all ocr labels
-                                ocr_labels += box3_elem['content'] + ' '
-                                filtered_boxes.remove(box3_elem)
-                            except:
-                                continue
-                            # break
-                        elif is_inside(box1, box3): # icon inside ocr, don't added this icon box, no need to check other ocr bbox bc no overlap between ocr bbox, icon can only be in one ocr box
-                            box_added = True
-                            break
-                        else:
-                            continue
-                if not box_added:
-                    if ocr_labels:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
-                    else:
-                        filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
-            else:
-                filtered_boxes.append(box1)
+    if not boxes:
+        return filtered_boxes
+
+    # keep the smaller box of every overlapping pair
+    box_array = np.array([elem['bbox'] for elem in boxes], dtype=np.float64)
+    valid = np.nonzero(~_suppressed_by_smaller_box(box_array, iou_threshold))[0]
+
+    if ocr_bbox:
+        intersection, area, ocr_area = _pairwise_overlap(box_array[valid], np.array([elem['bbox'] for elem in ocr_bbox], dtype=np.float64))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ocr_inside_icon = intersection / ocr_area[None, :] > 0.80
+            icon_inside_ocr = intersection / area[:, None] > 0.80
+        # ocr boxes are scanned in order; the first ocr box that contains the icon (and is not
+        # itself inside it) stops the scan, and the icon is then dropped in favour of the ocr label
+        stops_scan = icon_inside_ocr & ~ocr_inside_icon
+        has_stop = stops_scan.any(axis=1)
+        first_stop = np.where(has_stop, stops_scan.argmax(axis=1), len(ocr_bbox))
+
+    for row, i in enumerate(valid):
+        box1_elem = boxes[i]
+        if ocr_bbox:
+            # keep yolo boxes + prioritize ocr label
+            ocr_labels = ''
+            for k in np.nonzero(ocr_inside_icon[row, :first_stop[row]])[0]:
+                box3_elem = ocr_bbox[k]
+                try:
+                    # gather all ocr labels
+                    ocr_labels += box3_elem['content'] + ' '
+                    filtered_boxes.remove(box3_elem)
+                except:
+                    continue
+            if not has_stop[row]:
+                if ocr_labels:
+                    filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+                else:
+                    filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+        else:
+            filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
     return filtered_boxes # torch.tensor(filtered_boxes)
 
 
@@ -398,89 +587,271 @@ def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.
 
     return boxes, conf, phrases
 
+def predict_yolo_batch(model, images, box_threshold, imgsz, scale_img, iou_threshold=0.7):
+    """Run predict_yolo over several images with one model.predict call per image size.
+
+    Images are grouped by size because ultralytics only letterboxes a batch the
+    way it letterboxes a single image when every image in it has the same
+    shape, which keeps the boxes identical to per-image prediction.
+
+    Args:
+        imgsz: Inference size used with scale_img; None means each image's own (h, w)
+
+    Returns:
+        list: (boxes, conf, phrases) per image, in input order
+    """
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.size, []).append(i)
+
+    results = [None] * len(images)
+    for (w, h), indices in groups.items():
+        batch = [images[i] for i in indices]
+        if scale_img:
+            predictions = model.predict(source=batch, conf=box_threshold, imgsz=imgsz or (h, w), iou=iou_threshold)
+        else:
+            predictions = model.predict(source=batch, conf=box_threshold, iou=iou_threshold)
+        for i, prediction in zip(indices, predictions):
+            boxes = prediction.boxes.xyxy
+            results[i] = (boxes, prediction.boxes.conf, [str(j) for j in range(len(boxes))])
+    return results
+
 def int_box_area(box, w, h):
     x1, y1, x2, y2 = box
     int_box = [int(x1*w), int(y1*h), int(x2*w), int(y2*h)]
     area = (int_box[2] - int_box[0]) * (int_box[3] - int_box[1])
     return area
 
-def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128):
+def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128, caption_cache=None, timer=None, lazy=False):
     """Process either an image path or Image object
     
     Args:
         image_source: Either a file path (str) or PIL Image object
+        lazy: Return a LabeledImage that only draws the labels when its image is
+            requested, instead of drawing them straight away
         ...
+
+    Returns:
+        tuple: (labeled PIL Image, or LabeledImage if lazy, label coordinates, element dicts)
     """
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
-    image_source = image_source.convert("RGB") # for CLIP
-    w, h = image_source.size
-    if not imgsz:
-        imgsz = (h, w)
-    # print('image size:', w, h)
-    xyxy, logits, phrases = predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
-    xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
-    image_source = np.asarray(image_source)
-    phrases = [str(i) for i in range(len(phrases))]
-
-    # annotate the image with labels
-    if ocr_bbox:
-        ocr_bbox = torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])
-        ocr_bbox=ocr_bbox.tolist()
-    else:
-        print('no ocr bbox!!!')
-        ocr_bbox = None
+    if image_source.mode != "RGB":
+        image_source = image_source.convert("RGB") # for CLIP
+    filtered_boxes_elem = get_parsed_elements(image_source, model=model, BOX_TRESHOLD=BOX_TRESHOLD, ocr_bbox=ocr_bbox, caption_model_processor=caption_model_processor, ocr_text=ocr_text, use_local_semantics=use_local_semantics, iou_threshold=iou_threshold, prompt=prompt, scale_img=scale_img, imgsz=imgsz, batch_size=batch_size, caption_cache=caption_cache, timer=timer)
+    if lazy:
+        label_image = LabeledImage(image_source, filtered_boxes_elem, output_coord_in_ratio=output_coord_in_ratio, text_scale=text_scale, text_padding=text_padding, draw_bbox_config=draw_bbox_config, timer=timer)
+        return label_image, label_image.label_coordinates, filtered_boxes_elem
+    with timed_stage(timer, 'annotate'):
+        label_image, label_coordinates = get_labeled_img(np.asarray(image_source), filtered_boxes_elem, output_coord_in_ratio=output_coord_in_ratio, text_scale=text_scale, text_padding=text_padding, draw_bbox_config=draw_bbox_config)
+    return label_image, label_coordinates, filtered_boxes_elem
 
-    ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
-    xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
-    filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
-    
-    # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
-    filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
-    # get the index of the first 'content': None
-    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
-    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
-    print('len(filtered_boxes):', len(filtered_boxes), starting_idx)
+
+def get_parsed_elements(image_source: Image.Image, model=None, BOX_TRESHOLD=0.01, ocr_bbox=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9, prompt=None, scale_img=False, imgsz=None, batch_size=128, caption_cache=None, timer=None):
+    """Detect icons, merge them with the OCR boxes and caption the icons without text.
+
+    Args:
+        image_source: RGB PIL Image
+        ocr_bbox: OCR boxes in pixel xyxy format, as returned by check_ocr_box
+        caption_cache: Optional CaptionCache used to skip captioning icons seen before
+        timer: Optional StageTimer that records the yolo, overlap, crop and caption stages
+        ...
+
+    Returns:
+        list: Element dicts with 'type', 'bbox' (xyxy ratio), 'interactivity', 'content' and 'source'
+    """
+    return get_parsed_elements_batch([image_source], model=model, BOX_TRESHOLD=BOX_TRESHOLD, ocr_bboxes=[ocr_bbox], caption_model_processor=caption_model_processor, ocr_texts=[ocr_text], use_local_semantics=use_local_semantics, iou_threshold=iou_threshold, prompt=prompt, scale_img=scale_img, imgsz=imgsz, batch_size=batch_size, caption_cache=caption_cache, timer=timer)[0]
+
+
+def get_parsed_elements_batch(images: List[Image.Image], model=None, BOX_TRESHOLD=0.01, ocr_bboxes=None, caption_model_processor=None, ocr_texts=None, use_local_semantics=True, iou_threshold=0.9, prompt=None, scale_img=False, imgsz=None, batch_size=128, caption_cache=None, timer=None):
+    """get_parsed_elements for several images at once.
+
+    Icon detection runs batched across the images and the icon crops of every
+    image are pooled into shared caption batches, so the captioner runs full
+    batches even when each image only has a few uncaptioned icons.
+
+    Args:
+        images: RGB PIL Images
+        ocr_bboxes: Per-image OCR boxes in pixel xyxy format
+        ocr_texts: Per-image OCR text matching ocr_bboxes
+        timer: Optional StageTimer that records the yolo, overlap, crop and caption stages
+
+    Returns:
+        list: Per-image lists of element dicts, as returned by get_parsed_elements
+    """
+    if ocr_bboxes is None:
+        ocr_bboxes = [None] * len(images)
+    if ocr_texts is None:
+        ocr_texts = [[]] * len(images)
+    with timed_stage(timer, 'yolo'):
+        predictions = predict_yolo_batch(model=model, images=images, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+
+    frames = []
+    for image, (xyxy, logits, phrases), ocr_bbox, ocr_text in zip(images, predictions, ocr_bboxes, ocr_texts):
+        w, h = image.size
+        xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
+        image_source = np.asarray(image)
+
+        # annotate the image with labels
+        if ocr_bbox:
+            ocr_bbox = torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])
+            ocr_bbox=ocr_bbox.tolist()
+        else:
+            logger.debug('no ocr bbox')
+            ocr_bbox = []
+
+        ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
+        xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
+        with timed_stage(timer, 'overlap'):
+            filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
+        
+        # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
+        filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
+        # get the index of the first 'content': None
+        starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
+        filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+        logger.debug('len(filtered_boxes): %d, starting_idx: %d', len(filtered_boxes), starting_idx)
+        frames.append((image_source, ocr_bbox, filtered_boxes_elem, filtered_boxes, starting_idx))
 
     # get parsed icon local semantics
-    time1 = time.time()
-    if use_local_semantics:
+    if use_local_semantics and any(starting_idx >= 0 for *_, starting_idx in frames):
         caption_model = caption_model_processor['model']
-        if 'phi3_v' in caption_model.config.model_type: 
-            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
+        if 'phi3_v' in caption_model.config.model_type:
+            with timed_stage(timer, 'caption'):
+                parsed_content_icons = [get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor) if starting_idx >= 0 else []
+                                        for image_source, ocr_bbox, _, filtered_boxes, starting_idx in frames]
         else:
-            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size)
-        ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
-        icon_start = len(ocr_text)
-        parsed_content_icon_ls = []
+            # Pool the crops of every image into the same caption batches
+            with timed_stage(timer, 'crop'):
+                crops_per_frame = [get_icon_crops(filtered_boxes, starting_idx, image_source, device=caption_model.device) if starting_idx >= 0 else (None, [])
+                                   for image_source, _, _, filtered_boxes, starting_idx in frames]
+                pooled = torch.cat([crops for crops, _ in crops_per_frame if crops is not None])
+            with timed_stage(timer, 'caption'):
+                captions = caption_icon_crops(pooled, caption_model_processor, prompt=prompt, batch_size=batch_size, caption_cache=caption_cache)
+            parsed_content_icons = []
+            for _, valid in crops_per_frame:
+                crop_count = sum(valid)
+                parsed_content_icons.append(_expand_captions(captions[:crop_count], valid))
+                captions = captions[crop_count:]
         # fill the filtered_boxes_elem None content with parsed_content_icon in order
-        for i, box in enumerate(filtered_boxes_elem):
-            if box['content'] is None:
-                box['content'] = parsed_content_icon.pop(0)
-        for i, txt in enumerate(parsed_content_icon):
-            parsed_content_icon_ls.append(f"Icon Box ID {str(i+icon_start)}: {txt}")
-        parsed_content_merged = ocr_text + parsed_content_icon_ls
-    else:
-        ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
-        parsed_content_merged = ocr_text
-    print('time to get parsed content:', time.time()-time1)
+        for (_, _, filtered_boxes_elem, _, _), parsed_content_icon in zip(frames, parsed_content_icons):
+            for i, box in enumerate(filtered_boxes_elem):
+                if box['content'] is None:
+                    box['content'] = parsed_content_icon.pop(0)
+
+    return [filtered_boxes_elem for _, _, filtered_boxes_elem, _, _ in frames]
+
+
+def get_labeled_img(image_source: np.ndarray, filtered_boxes_elem, output_coord_in_ratio=False, text_scale=0.4, text_padding=5, draw_bbox_config=None):
+    """Draw the numbered element boxes onto a copy of the image.
+
+    Args:
+        image_source: RGB image array
+        filtered_boxes_elem: Element dicts as returned by get_parsed_elements
 
+    Returns:
+        tuple: (labeled PIL Image, label coordinates keyed by element index in xywh format)
+    """
+    h, w = image_source.shape[:2]
+    if filtered_boxes_elem:
+        filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+    else:
+        filtered_boxes = torch.zeros((0, 4))
     filtered_boxes = box_convert(boxes=filtered_boxes, in_fmt="xyxy", out_fmt="cxcywh")
 
     phrases = [i for i in range(len(filtered_boxes))]
     
     # draw boxes
     if draw_bbox_config:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, **draw_bbox_config)
+        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, **draw_bbox_config)
     else:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
+        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
     
     label_image = Image.fromarray(annotated_frame)
     if output_coord_in_ratio:
         label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
         assert w == annotated_frame.shape[1] and h == annotated_frame.shape[0]
 
-    return label_image, label_coordinates, filtered_boxes_elem
+    return label_image, label_coordinates
+
+
+def get_label_coordinates(filtered_boxes_elem, w: int, h: int, output_coord_in_ratio=False) -> Dict[str, List[float]]:
+    """The label coordinates get_labeled_img returns, without drawing anything.
+
+    Args:
+        filtered_boxes_elem: Element dicts as returned by get_parsed_elements
+        w, h: Size of the image in pixels
+
+    Returns:
+        dict: Element box keyed by element index, in xywh format
+    """
+    if not filtered_boxes_elem:
+        return {}
+    boxes = box_convert(boxes=torch.tensor([box['bbox'] for box in filtered_boxes_elem]), in_fmt="xyxy", out_fmt="cxcywh")
+    # Same arithmetic as annotate, so the values match get_labeled_img exactly
+    xywh = box_convert(boxes=boxes * torch.Tensor([w, h, w, h]), in_fmt="cxcywh", out_fmt="xywh").numpy()
+    label_coordinates = {f"{i}": v for i, v in enumerate(xywh)}
+    if output_coord_in_ratio:
+        label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
+    return label_coordinates
+
+
+class LabeledImage:
+    """A labeled image that is only drawn when it is asked for.
+
+    Holds on to the frame and the elements instead of drawing the numbered
+    boxes into a full resolution copy of the frame. Callers that only need the
+    elements never pay for drawing or copying; get_image() draws the image the
+    first time it is called and returns the same image after that.
+    """
+
+    def __init__(self, image_source: Union[Image.Image, np.ndarray], filtered_boxes_elem, output_coord_in_ratio=False, text_scale=0.4, text_padding=5, draw_bbox_config=None, timer=None):
+        """Initialize the handle
+
+        Args:
+            image_source: RGB PIL Image or image array; it must not be modified afterwards
+            filtered_boxes_elem: Element dicts as returned by get_parsed_elements
+            timer: Optional StageTimer that records the annotate stage when the image is drawn
+        """
+        self.image_source = image_source
+        self.elements = filtered_boxes_elem
+        self.output_coord_in_ratio = output_coord_in_ratio
+        self.text_scale = text_scale
+        self.text_padding = text_padding
+        self.draw_bbox_config = draw_bbox_config
+        self.timer = timer
+        self._image = None
+        self._label_coordinates = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height) of the image"""
+        if self._image is not None:
+            return self._image.size
+        if isinstance(self.image_source, np.ndarray):
+            return self.image_source.shape[1], self.image_source.shape[0]
+        return self.image_source.size
+
+    @property
+    def rendered(self) -> bool:
+        """Whether the image has been drawn yet"""
+        return self._image is not None
+
+    @property
+    def label_coordinates(self) -> Dict[str, List[float]]:
+        """Label coordinates keyed by element index in xywh format; does not draw the image"""
+        if self._label_coordinates is None:
+            self._label_coordinates = get_label_coordinates(self.elements, *self.size, output_coord_in_ratio=self.output_coord_in_ratio)
+        return self._label_coordinates
+
+    def get_image(self) -> Image.Image:
+        """Get the labeled PIL Image, drawing it on the first call"""
+        if self._image is None:
+            with timed_stage(self.timer, 'annotate'):
+                self._image, self._label_coordinates = get_labeled_img(np.asarray(self.image_source), self.elements, output_coord_in_ratio=self.output_coord_in_ratio, text_scale=self.text_scale, text_padding=self.text_padding, draw_bbox_config=self.draw_bbox_config)
+            # The frame is no longer needed
+            self.image_source = None
+        return self._image
 
 
 def get_xywh(input):
@@ -498,7 +869,106 @@ def get_xywh_yolo(input):
     x, y, w, h = int(x), int(y), int(w), int(h)
     return x, y, w, h
 
-def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False):
+# readtext() keyword arguments that belong to EasyOCR's detection step
+EASYOCR_DETECT_ARGS = {'min_size', 'text_threshold', 'low_text', 'link_threshold', 'canvas_size', 'mag_ratio', 'slope_ths', 'ycenter_ths', 'height_ths', 'width_ths', 'add_margin', 'threshold', 'bbox_min_score', 'bbox_min_size', 'max_candidates'}
+# readtext() keyword arguments under which each box is recognized independently of the others
+EASYOCR_CACHEABLE_RECOGNIZE_ARGS = {'decoder', 'beamWidth', 'workers', 'allowlist', 'blocklist', 'contrast_ths', 'adjust_contrast', 'filter_ths'}
+
+
+def easyocr_readtext_cached(image_np, easyocr_args, ocr_cache):
+    """Equivalent of reader.readtext() that only recognizes text boxes missing from ocr_cache.
+
+    Detection always runs on the whole image. Each detected box is then keyed by
+    the grey pixels it covers, and recognition runs only for boxes whose crop has
+    not been seen before.
+    """
+    from easyocr.utils import reformat_input
+
+    reader = get_easyocr_reader()
+    detect_args = {k: v for k, v in easyocr_args.items() if k in EASYOCR_DETECT_ARGS}
+    recognize_args = {k: v for k, v in easyocr_args.items() if k not in EASYOCR_DETECT_ARGS}
+    if not set(recognize_args) <= EASYOCR_CACHEABLE_RECOGNIZE_ARGS:
+        # paragraph merging, rotation etc. combine boxes, so results can't be cached per box
+        return reader.readtext(image_np, **easyocr_args)
+
+    img, img_cv_grey = reformat_input(image_np)
+    horizontal_list, free_list = reader.detect(img, reformat=False, **detect_args)
+    horizontal_list, free_list = horizontal_list[0], free_list[0]
+    max_y, max_x = img_cv_grey.shape[:2]
+    namespace = 'easyocr|' + repr(sorted(recognize_args.items()))
+
+    # Work out the box recognize() will report for each detection and the pixels it reads
+    boxes, points, keys = [], [], []
+    for box in horizontal_list:
+        x_min, x_max = max(0, box[0]), min(box[1], max_x)
+        y_min, y_max = max(0, box[2]), min(box[3], max_y)
+        boxes.append(box)
+        points.append([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]])
+        keys.append(ocr_cache.make_key(img_cv_grey[y_min:y_max, x_min:x_max], namespace))
+    for box in free_list:
+        xs, ys = [int(p[0]) for p in box], [int(p[1]) for p in box]
+        x_min, y_min = max(0, min(xs)), max(0, min(ys))
+        # Free boxes are warped to a rectangle, so the polygon's shape is part of the key
+        shape = repr([(x - x_min, y - y_min) for x, y in zip(xs, ys)])
+        boxes.append(box)
+        points.append(box)
+        keys.append(ocr_cache.make_key(img_cv_grey[y_min:max(ys), x_min:max(xs)], namespace + shape))
+
+    results = [None] * len(boxes)
+    for i, key in enumerate(keys):
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            results[i] = (points[i], cached[0], cached[1])
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        num_horizontal = len(horizontal_list)
+        miss_horizontal = [boxes[i] for i in misses if i < num_horizontal]
+        miss_free = [boxes[i] for i in misses if i >= num_horizontal]
+        recognized = reader.recognize(img_cv_grey, miss_horizontal, miss_free, reformat=False, **recognize_args)
+        # recognize() drops empty crops, so match its results back to the boxes by coordinates
+        by_points = {repr([[int(v) for v in p] for p in item[0]]): item for item in recognized}
+        for i in misses:
+            item = by_points.get(repr([[int(v) for v in p] for p in points[i]]))
+            if item is None:
+                continue
+            results[i] = (points[i], item[1], item[2])
+            ocr_cache.put(keys[i], [item[1], float(item[2])])
+
+    return [result for result in results if result is not None]
+
+
+def paddleocr_cached(image_np, ocr_cache):
+    """Equivalent of paddle_ocr.ocr() that only recognizes text boxes missing from ocr_cache.
+
+    Returns:
+        list: [points, (text, score)] items, like one page of paddle_ocr.ocr() output
+    """
+    # paddleocr registers its bundled tools package on import
+    paddle_ocr = get_paddle_ocr()
+    from tools.infer.predict_system import sorted_boxes
+    from tools.infer.utility import get_rotate_crop_image
+
+    dt_boxes, _ = paddle_ocr.text_detector(image_np)
+    if dt_boxes is None or len(dt_boxes) == 0:
+        return []
+    dt_boxes = sorted_boxes(dt_boxes)
+
+    crops = [get_rotate_crop_image(image_np, np.array(box, dtype=np.float32)) for box in dt_boxes]
+    keys = [ocr_cache.make_key(crop, 'paddleocr') for crop in crops]
+    rec_res = [ocr_cache.get(key) for key in keys]
+
+    misses = [i for i, res in enumerate(rec_res) if res is None]
+    if misses:
+        recognized, _ = paddle_ocr.text_recognizer([crops[i] for i in misses])
+        for i, (text, score) in zip(misses, recognized):
+            rec_res[i] = [text, float(score)]
+            ocr_cache.put(keys[i], rec_res[i])
+
+    return [[box.tolist(), (res[0], res[1])] for box, res in zip(dt_boxes, rec_res) if res[1] >= paddle_ocr.drop_score]
+
+
+def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False, ocr_cache=None):
     if isinstance(image_source, str):
         image_source = Image.open(image_source)
     if image_source.mode == 'RGBA':
@@ -511,13 +981,19 @@ def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, out
             text_threshold = 0.5
         else:
             text_threshold = easyocr_args['text_threshold']
-        result = paddle_ocr.ocr(image_np, cls=False)[0]
+        if ocr_cache is not None:
+            result = paddleocr_cached(image_np, ocr_cache)
+        else:
+            result = get_paddle_ocr().ocr(image_np, cls=False)[0]
         coord = [item[0] for item in result if item[1][1] > text_threshold]
         text = [item[1][0] for item in result if item[1][1] > text_threshold]
     else:  # EasyOCR
         if easyocr_args is None:
             easyocr_args = {}
-        result = reader.readtext(image_np, **easyocr_args)
+        if ocr_cache is not None:
+            result = easyocr_readtext_cached(image_np, easyocr_args, ocr_cache)
+        else:
+            result = get_easyocr_reader().readtext(image_np, **easyocr_args)
         coord = [item[0] for item in result]
         text = [item[1] for item in result]
     if display_img:
@@ -528,6 +1004,7 @@ def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, out
             bb.append((x, y, a, b))
             cv2.rectangle(opencv_img, (x, y), (x+a, y+b), (0, 255, 0), 2)
         #  matplotlib expects RGB
+        from matplotlib import pyplot as plt
         plt.imshow(cv2.cvtColor(opencv_img, cv2.COLOR_BGR2RGB))
     else:
         if output_bb_format == 'xywh':
@@ -1,14 +1,20 @@
 import win32gui
-import win32ui
 import win32con
 import win32process
 import psutil
 from PIL import Image
 import numpy as np
-from typing import Optional, Tuple, List, Union
+from typing import Optional, List, Union
 import ctypes
+from ctypes import wintypes
+import logging
+import threading
 import win32api
 import time
+from capture_backends import CaptureBackend
+from keyboard_input import type_text
+
+logger = logging.getLogger(__name__)
 
 top_offset = 108
 bottom_offset = 37
@@ -131,8 +137,8 @@ def is_window_valid(hwnd: int) -> bool:
     except Exception:
         return False
 
-def find_vmconnect_window() -> Optional[int]:
-    """Find the VMConnect window handle"""
+def _enumerate_vmconnect_windows() -> Optional[int]:
+    """Find the VMConnect window handle by enumerating every top-level window"""
     def callback(hwnd, hwnds):
         if win32gui.IsWindowVisible(hwnd):
             window_text = win32gui.GetWindowText(hwnd)
@@ -161,114 +167,253 @@ def find_vmconnect_window() -> Optional[int]:
     print("Found VMConnect windows but none are valid/visible")
     return None
 
-def capture_window_screenshot(hwnd: int) -> Optional[Image.Image]:
-    """Capture a screenshot of the specified window"""
-    window_dc = None
-    mfc_dc = None
-    save_dc = None
-    save_bitmap = None
-    
-    try:
-        # Get window dimensions
-        left, top, right, bottom = win32gui.GetWindowRect(hwnd)
-        width = right - left
-        height = bottom - top
-
-        # Get the DPI scale factor - this seems like it doesn't work right now
-#        scale_factor = get_dpi_scale(hwnd)
-#        print(f"DPI Scale factor: {scale_factor}")
-        
-        # Apply scaling
-        width = int(width * 1.5)
-        height = int(height * 1.5)
+# The VMConnect window handle is looked up once and reused for as long as it stays valid
+_cached_hwnd = None
+_hwnd_lock = threading.Lock()
+_lookup_stats = {
+    "lookups": 0,
+    "cache_hits": 0,
+    "invalidations": 0,
+    "lookup_seconds": 0.0,
+    "last_lookup_ms": 0.0,
+}
 
+def find_vmconnect_window(refresh: bool = False) -> Optional[int]:
+    """Find the VMConnect window handle
 
-        print(f"Window dimensions: {width}x{height} at ({left},{top})")
+    The handle is cached; windows are only enumerated again when the cached
+    handle stops being a valid, visible window (or when refresh is set).
 
-        # Get the target window DC
-        window_dc = win32gui.GetDC(hwnd)
-        if not window_dc:
-            print("Failed to get window DC")
-            return None
-            
-        # Create DC objects
-        mfc_dc = win32ui.CreateDCFromHandle(window_dc)
-        save_dc = mfc_dc.CreateCompatibleDC()
-        
-        # Create bitmap object
-        save_bitmap = win32ui.CreateBitmap()
-        save_bitmap.CreateCompatibleBitmap(mfc_dc, width, height)
-        save_dc.SelectObject(save_bitmap)
+    Args:
+        refresh: Ignore the cached handle and enumerate the windows again
 
-        # Try to copy window content using PrintWindow
+    Returns:
+        Optional[int]: The window handle, or None if no VMConnect window was found
+    """
+    global _cached_hwnd
+    with _hwnd_lock:
+        if _cached_hwnd is not None and not refresh:
+            if is_window_valid(_cached_hwnd):
+                _lookup_stats["cache_hits"] += 1
+                return _cached_hwnd
+            _lookup_stats["invalidations"] += 1
+            _cached_hwnd = None
+
+        start_time = time.perf_counter()
+        hwnd = _enumerate_vmconnect_windows()
+        elapsed = time.perf_counter() - start_time
+        _lookup_stats["lookups"] += 1
+        _lookup_stats["lookup_seconds"] += elapsed
+        _lookup_stats["last_lookup_ms"] = elapsed * 1000
+        _cached_hwnd = hwnd
+        return hwnd
+
+def get_window_lookup_stats() -> dict:
+    """Get VMConnect window lookup counters: enumerations, cache hits, invalidations and timings"""
+    with _hwnd_lock:
+        stats = dict(_lookup_stats)
+    lookup_seconds = stats.pop("lookup_seconds")
+    stats["total_lookup_ms"] = lookup_seconds * 1000
+    stats["avg_lookup_ms"] = lookup_seconds * 1000 / stats["lookups"] if stats["lookups"] else 0.0
+    return stats
+
+class BitmapInfoHeader(ctypes.Structure):
+    _fields_ = [("biSize", ctypes.c_uint32),
+                ("biWidth", ctypes.c_int32),
+                ("biHeight", ctypes.c_int32),
+                ("biPlanes", ctypes.c_uint16),
+                ("biBitCount", ctypes.c_uint16),
+                ("biCompression", ctypes.c_uint32),
+                ("biSizeImage", ctypes.c_uint32),
+                ("biXPelsPerMeter", ctypes.c_int32),
+                ("biYPelsPerMeter", ctypes.c_int32),
+                ("biClrUsed", ctypes.c_uint32),
+                ("biClrImportant", ctypes.c_uint32)]
+
+# Own DLL instances so the handle-sized argument and return types below don't affect ctypes.windll users
+_user32 = ctypes.WinDLL('user32', use_last_error=True)
+_gdi32 = ctypes.WinDLL('gdi32')
+_user32.GetDC.restype = wintypes.HDC
+_user32.GetDC.argtypes = [wintypes.HWND]
+_user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+_user32.PrintWindow.argtypes = [wintypes.HWND, wintypes.HDC, wintypes.UINT]
+_gdi32.CreateCompatibleDC.restype = wintypes.HDC
+_gdi32.CreateCompatibleDC.argtypes = [wintypes.HDC]
+_gdi32.CreateDIBSection.restype = wintypes.HBITMAP
+_gdi32.CreateDIBSection.argtypes = [wintypes.HDC, ctypes.POINTER(BitmapInfoHeader), wintypes.UINT, ctypes.POINTER(ctypes.c_void_p), wintypes.HANDLE, wintypes.DWORD]
+_gdi32.SelectObject.restype = wintypes.HGDIOBJ
+_gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+_gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+_gdi32.DeleteDC.argtypes = [wintypes.HDC]
+
+PW_RENDERFULLCONTENT = 2
+DIB_RGB_COLORS = 0
+BI_RGB = 0
+
+class CaptureSession(CaptureBackend):
+    """Captures one window over and over without rebuilding the GDI objects every frame.
+
+    The window DC, a memory DC and a top-down 32-bit DIB section are created on
+    the first capture and kept until the window changes size. PrintWindow draws
+    straight into the DIB section, whose pixels are exposed as a NumPy view, so
+    there is no GetBitmapBits copy and no intermediate PIL images.
+    """
+    def __init__(self, hwnd: int, scale: float = 1.5):
+        """Initialize the session
+
+        Args:
+            hwnd: Handle of the window to capture
+            scale: Factor from the window rect to the captured size in pixels
+                (the DPI scale factor, which can't be queried reliably yet)
+        """
+        super().__init__()
+        self.hwnd = hwnd
+        self.scale = scale
+        self.recreations = 0
+        self._window_dc = None
+        self._mem_dc = None
+        self._bitmap = None
+        self._old_bitmap = None
+        self._size = None
+        self._pixels = None
+
+    def _create_buffers(self, width: int, height: int):
+        self._release_buffers()
+        self._window_dc = _user32.GetDC(self.hwnd)
+        if not self._window_dc:
+            raise OSError("Failed to get window DC")
+        self._mem_dc = _gdi32.CreateCompatibleDC(self._window_dc)
+
+        # A negative height makes the DIB top-down, so rows are in screen order
+        header = BitmapInfoHeader(biSize=ctypes.sizeof(BitmapInfoHeader), biWidth=width, biHeight=-height, biPlanes=1, biBitCount=32, biCompression=BI_RGB)
+        bits = ctypes.c_void_p()
+        self._bitmap = _gdi32.CreateDIBSection(self._window_dc, ctypes.byref(header), DIB_RGB_COLORS, ctypes.byref(bits), None, 0)
+        if not self._bitmap or not bits.value:
+            raise OSError("Failed to create DIB section")
+        self._old_bitmap = _gdi32.SelectObject(self._mem_dc, self._bitmap)
+
+        buffer = (ctypes.c_uint8 * (width * height * 4)).from_address(bits.value)
+        self._pixels = np.ctypeslib.as_array(buffer).reshape(height, width, 4)
+        self._size = (width, height)
+        self.recreations += 1
+        logger.debug(f"Capture buffers created: {width}x{height}")
+
+    def _release_buffers(self):
+        self._pixels = None
+        self._size = None
+        if self._mem_dc and self._old_bitmap:
+            _gdi32.SelectObject(self._mem_dc, self._old_bitmap)
+        if self._bitmap:
+            _gdi32.DeleteObject(self._bitmap)
+        if self._mem_dc:
+            _gdi32.DeleteDC(self._mem_dc)
+        if self._window_dc:
+            _user32.ReleaseDC(self.hwnd, self._window_dc)
+        self._window_dc = self._mem_dc = self._bitmap = self._old_bitmap = None
+
+    def capture_view(self) -> Optional[np.ndarray]:
+        """Capture the window into the DIB section.
+
+        Returns:
+            np.ndarray: (height, width, 4) BGRX view of the VM screen without the
+                VMConnect toolbar and status bar, or None if capture failed. The view
+                points into the DIB section, so it is only valid until the next capture.
+        """
         try:
+            left, top, right, bottom = win32gui.GetWindowRect(self.hwnd)
+            width = int((right - left) * self.scale)
+            height = int((bottom - top) * self.scale)
+            if (width, height) != self._size:
+                self._create_buffers(width, height)
+
             # PW_CLIENTONLY = 1
             # PW_RENDERFULLCONTENT = 2
-            result = ctypes.windll.user32.PrintWindow(
-                hwnd, 
-                save_dc.GetSafeHdc(), 
-                2
-            )
+            if not _user32.PrintWindow(self.hwnd, self._mem_dc, PW_RENDERFULLCONTENT):
+                print("PrintWindow failed to copy window content")
+                print(f"Last error code: {ctypes.get_last_error()}")
+                return None
+            # Make sure GDI has finished writing into the DIB section before it is read
+            _gdi32.GdiFlush()
 
+            # Crop to remove top and bottom offsets
+            return self._pixels[top_offset:height - bottom_offset]
         except Exception as e:
-            print(f"PrintWindow failed with exception: {e}")
-            result = 0
-
-        if result:
-            try:
-                # Convert to PIL Image
-                bmpinfo = save_bitmap.GetInfo()
-                bmpstr = save_bitmap.GetBitmapBits(True)
-                # Create full image first
-                full_img = Image.frombuffer(
-                    'RGB',
-                    (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-                    bmpstr, 'raw', 'BGRX', 0, 1)
-                
-                # Crop to remove top and bottom offsets
-                img = full_img.crop((0, top_offset, bmpinfo['bmWidth'], bmpinfo['bmHeight'] - bottom_offset))
-
-                return img
-            except Exception as e:
-                print(f"Failed to convert bitmap to image: {e}")
-                return None
-        else:
-            print("PrintWindow failed to copy window content")
-            error_code = ctypes.get_last_error()
-            print(f"Last error code: {error_code}")
+            print(f"Error capturing screenshot: {e}")
+            self._release_buffers()
             return None
 
-    except Exception as e:
-        print(f"Error capturing screenshot: {e}")
-        return None
-    finally:
-        # Clean up in finally block to ensure resources are released
-        if save_bitmap:
-            win32gui.DeleteObject(save_bitmap.GetHandle())
-        if save_dc:
-            save_dc.DeleteDC()
-        if mfc_dc:
-            mfc_dc.DeleteDC()
-        if window_dc:
-            win32gui.ReleaseDC(hwnd, window_dc)
+    def close(self):
+        """Release the DCs and the DIB section"""
+        self._release_buffers()
 
-def get_vmconnect_screenshot() -> Optional[Image.Image]:
-    """Get a screenshot from the active VMConnect window"""
+    def get_stats(self) -> dict:
+        """Get frame, failure and buffer recreation counters"""
+        stats = super().get_stats()
+        stats['recreations'] = self.recreations
+        return stats
+
+def capture_window_screenshot(hwnd: int) -> Optional[Image.Image]:
+    """Capture a screenshot of the specified window"""
+    with CaptureSession(hwnd) as session:
+        frame = session.capture()
+    return Image.fromarray(frame) if frame is not None else None
+
+# Reused between frames, and replaced when the VMConnect window changes
+_session = None
+_session_lock = threading.Lock()
+
+def get_vmconnect_frame() -> Optional[np.ndarray]:
+    """Capture the active VMConnect window as an RGB array, reusing the capture buffers between calls
+
+    Returns:
+        np.ndarray: (height, width, 3) RGB array owned by the caller, or None if capture failed
+    """
+    global _session
     hwnd = find_vmconnect_window()
     if not hwnd:
         print("No VMConnect window found")
         return None
-    
-    return capture_window_screenshot(hwnd)
+
+    with _session_lock:
+        if _session is None or _session.hwnd != hwnd:
+            if _session is not None:
+                _session.close()
+            _session = CaptureSession(hwnd)
+        return _session.capture()
+
+def get_vmconnect_screenshot() -> Optional[Image.Image]:
+    """Get a screenshot from the active VMConnect window"""
+    frame = get_vmconnect_frame()
+    return Image.fromarray(frame) if frame is not None else None
+
+# Seconds to let VMConnect settle after it is brought to the foreground
+FOREGROUND_SETTLE_SECONDS = 0.5
+
+_foreground_lock = threading.Lock()
+_foreground_stats = {
+    "activations": 0,
+    "skipped": 0,
+    "activation_seconds": 0.0,
+}
 
 def set_foreground_vmconnect() -> Optional[int]:
-    """Set VMConnect window as foreground window and return its handle"""
+    """Set VMConnect window as foreground window and return its handle
+
+    When VMConnect already is the foreground window, the Ctrl wake-up and the
+    settle delay are skipped.
+    """
     hwnd = find_vmconnect_window()
     if not hwnd:
         print("Could not find VMConnect window")
         return None
+
+    if win32gui.GetForegroundWindow() == hwnd:
+        with _foreground_lock:
+            _foreground_stats["skipped"] += 1
+        return hwnd
         
     try:
+        start_time = time.perf_counter()
         # Bring window to foreground
         if not win32gui.IsWindowVisible(hwnd):
             win32gui.ShowWindow(hwnd, win32con.SW_SHOW)
@@ -278,7 +423,10 @@ def set_foreground_vmconnect() -> Optional[int]:
         win32gui.SendMessage(hwnd, win32con.WM_KEYUP, VK_CONTROL, 0)
         
         win32gui.SetForegroundWindow(hwnd)
-        time.sleep(0.5)  # Give window time to come to foreground
+        time.sleep(FOREGROUND_SETTLE_SECONDS)  # Give window time to come to foreground
+        with _foreground_lock:
+            _foreground_stats["activations"] += 1
+            _foreground_stats["activation_seconds"] += time.perf_counter() - start_time
         return hwnd
     except Exception as e:
         print(f"Failed to set foreground window: {e}")
@@ -286,6 +434,19 @@ def set_foreground_vmconnect() -> Optional[int]:
         print(f"Last error code: {error_code}")
         return None
 
+def get_foreground_stats() -> dict:
+    """Get how often VMConnect had to be activated, how often it already was in front, and the time that saved
+
+    The saving is estimated from the average cost of the activations that did happen.
+    """
+    with _foreground_lock:
+        stats = dict(_foreground_stats)
+    activation_seconds = stats.pop("activation_seconds")
+    avg_activation_ms = activation_seconds * 1000 / stats["activations"] if stats["activations"] else FOREGROUND_SETTLE_SECONDS * 1000
+    stats["avg_activation_ms"] = avg_activation_ms
+    stats["saved_ms"] = stats["skipped"] * avg_activation_ms
+    return stats
+
 def send_special_key(key_code: Union[int, List[int]], press_only: bool = False) -> bool:
     """Send special key press to VMConnect window
     
@@ -330,11 +491,20 @@ def send_special_key(key_code: Union[int, List[int]], press_only: bool = False)
         print(f"Failed to send special key: {e}")
         return False
 
-def send_text(text: str) -> bool:
+# Seconds to wait after each typed character; 0 types a whole string in a few SendInput calls
+TYPING_KEY_DELAY = 0.0
+
+def send_text(text: str, key_delay: Optional[float] = None, use_unicode: bool = False) -> bool:
     """Send text input to VMConnect window
     
+    The keystrokes for the whole string, including shift handling, are built
+    into one INPUT array and submitted in bulk (see keyboard_input).
+
     Args:
         text: String to type into the window
+        key_delay: Seconds to wait after each character for guests that drop fast
+            input, defaults to TYPING_KEY_DELAY
+        use_unicode: Send characters the keyboard layout can't type as Unicode events
         
     Returns:
         bool: True if successful, False otherwise
@@ -345,45 +515,9 @@ def send_text(text: str) -> bool:
         return False
 
     try:
-        extra = ctypes.c_ulong(0)
-        ii_ = Input_I()
-
-        for char in text:
-            # Get virtual key code and shift state
-            vk = win32api.VkKeyScan(char)
-            if vk == -1:
-                print(f"No virtual key code found for character: {char}")
-                continue
-                
-            needs_shift = (vk >> 8) & 0x1  # Check if shift modifier is needed
-            vk = vk & 0xFF  # Get base virtual key code
-            
-            # Press shift if needed
-            if needs_shift:
-                ii_.ki = KeyBdInput(VK_SHIFT, 0, 0, 0, ctypes.pointer(extra))
-                x = Input(ctypes.c_ulong(1), ii_)
-                ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
-                time.sleep(0.05)
-            
-            # Send key down
-            ii_.ki = KeyBdInput(vk, 0, 0, 0, ctypes.pointer(extra))
-            x = Input(ctypes.c_ulong(1), ii_)
-            ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
-            time.sleep(0.05)
-            
-            # Send key up
-            ii_.ki = KeyBdInput(vk, 0, win32con.KEYEVENTF_KEYUP, 0, ctypes.pointer(extra))
-            x = Input(ctypes.c_ulong(1), ii_)
-            ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
-            time.sleep(0.05)
-            
-            # Release shift if it was pressed
-            if needs_shift:
-                ii_.ki = KeyBdInput(VK_SHIFT, 0, win32con.KEYEVENTF_KEYUP, 0, ctypes.pointer(extra))
-                x = Input(ctypes.c_ulong(1), ii_)
-                ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
-                time.sleep(0.05)
-                
+        if not type_text(text, use_unicode=use_unicode, key_delay=TYPING_KEY_DELAY if key_delay is None else key_delay):
+            logger.warning("SendInput did not accept all keystrokes, input may be blocked")
+            return False
         return True
         
     except Exception as e: